@@ -0,0 +1,11 @@
+"""
+Benchmarks tracking the performance of keystash.
+
+Each module is a script run from the repository root, for example:
+
+    python -m benchmarks.importtime
+    python -m benchmarks.vault
+
+Results can be saved as JSON with `--json FILE` and compared with a later
+run with `--baseline FILE`.
+"""
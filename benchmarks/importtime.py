@@ -0,0 +1,144 @@
+"""
+Measure the start-up time of keystash with `python -X importtime`.
+
+Every scenario runs the CLI in a fresh interpreter, in an empty home
+directory, and reports the time spent importing modules (the sum of the
+cumulative times of the top level imports) and the wall-clock time of the
+whole process, the best of `--repeat` runs.
+
+None of the scenarios needs the vault, so none of them may load the heavy
+dependencies in `HEAVY_MODULES`; the benchmark fails if one does.
+
+Usage:
+
+    python -m benchmarks.importtime [--repeat N] [--json FILE]
+        [--baseline FILE] [--tolerance PERCENT]
+
+`--json` saves the results, and `--baseline` compares them with results
+saved earlier, failing if a scenario got slower by more than the tolerance.
+"""
+import argparse, json, os, pathlib, re, subprocess, sys, tempfile, time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Command line arguments of each scenario.
+SCENARIOS = {
+    "help": ["--help"],
+    "command help": ["get", "--help"],
+    "argument error": ["get"],
+    "unknown command": ["frobnicate"]
+}
+
+# Top level packages that must only load when a command uses the vault.
+HEAVY_MODULES = ("bcrypt", "cryptography", "pyperclip")
+
+RUNNER = "import sys; sys.argv = ['keystash', *sys.argv[1:]]; from src import main; main.main()"
+
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+def run(arguments: list[str], home: str) -> dict:
+    """
+    Run the CLI once with the given arguments. Return the import time and
+    the wall-clock time in milliseconds, and the heavy modules loaded.
+    """
+    environment = {**os.environ, "HOME": home}
+    environment.pop("KEYSTASH_AGENT_SOCK", None)
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", RUNNER, *arguments],
+        cwd=ROOT, env=environment, capture_output=True, text=True
+    )
+    wall = (time.perf_counter() - start) * 1000
+
+    imports = 0
+    heavy = set()
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match is None:
+            continue
+
+        _, cumulative, indent, module = match.groups()
+        if not indent:
+            imports += int(cumulative)
+        if module.split(".")[0] in HEAVY_MODULES:
+            heavy.add(module.split(".")[0])
+
+    return {"imports_ms": imports / 1000, "wall_ms": wall, "heavy_modules": sorted(heavy)}
+
+def measure(repeat: int) -> dict:
+    """
+    Return the best result of `repeat` runs of every scenario.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        for name, arguments in SCENARIOS.items():
+            runs = [run(arguments, home) for _ in range(repeat)]
+            results[name] = {
+                "imports_ms": round(min(result["imports_ms"] for result in runs), 2),
+                "wall_ms": round(min(result["wall_ms"] for result in runs), 2),
+                "heavy_modules": sorted({
+                    module for result in runs for module in result["heavy_modules"]
+                })
+            }
+
+        if any(pathlib.Path(home).iterdir()):
+            raise RuntimeError("Starting keystash wrote to the home directory.")
+
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Return a message for every scenario whose import time grew by more
+    than `tolerance` percent over the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        before, after = baseline[name]["imports_ms"], result["imports_ms"]
+        if after > before * (1 + tolerance / 100):
+            regressions.append(f"{name}: imports took {after} ms, up from {before} ms.")
+
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.importtime")
+    parser.add_argument("--repeat", type=int, default=5,
+        help="Runs of each scenario; the best is kept. Default: 5.")
+    parser.add_argument("--json", dest="json_file", default=None,
+        help="Save the results to this file.")
+    parser.add_argument("--baseline", default=None,
+        help="Results saved with --json to compare with.")
+    parser.add_argument("--tolerance", type=float, default=20,
+        help="Percent the import time may grow over the baseline. Default: 20.")
+    arguments = parser.parse_args()
+
+    results = measure(arguments.repeat)
+
+    print(f"{'scenario':<20}{'imports (ms)':>14}{'process (ms)':>14}  heavy modules")
+    for name, result in results.items():
+        print(
+            f"{name:<20}{result['imports_ms']:>14.2f}{result['wall_ms']:>14.2f}  "
+            f"{', '.join(result['heavy_modules']) or '-'}"
+        )
+
+    if arguments.json_file:
+        pathlib.Path(arguments.json_file).write_text(json.dumps(results, indent=4) + "\n")
+
+    failures = [
+        f"{name}: loaded {', '.join(result['heavy_modules'])}."
+        for name, result in results.items() if result["heavy_modules"]
+    ]
+    if arguments.baseline:
+        baseline = json.loads(pathlib.Path(arguments.baseline).read_text())
+        failures += compare(results, baseline, arguments.tolerance)
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Deterministic synthetic credentials for benchmarks.
+
+`generate()` yields the same credentials for the same arguments on every
+machine, so benchmark runs can be compared. Like a real vault, services
+repeat (about `CREDENTIALS_PER_SERVICE` credentials each), and some
+credentials have no username or email.
+"""
+import random, string
+
+# Characters in each field, unless given otherwise.
+FIELD_SIZES = {"service": 16, "username": 12, "email": 24, "password": 20}
+
+CREDENTIALS_PER_SERVICE = 10
+FIRST_ID = 101
+
+WORD_CHARACTERS = string.ascii_lowercase + string.digits
+PASSWORD_CHARACTERS = string.ascii_letters + string.digits + string.punctuation
+
+def generate(count: int, seed: int = 0, field_sizes: dict | None = None):
+    """
+    Yield `count` credentials with IDs counting up from `FIRST_ID`.
+
+    `field_sizes` maps fields to their number of characters, overriding
+    `FIELD_SIZES`.
+    """
+    sizes = {**FIELD_SIZES, **(field_sizes or {})}
+    generator = random.Random(seed)
+    services = [
+        _word(generator, sizes["service"])
+        for _ in range(max(1, count // CREDENTIALS_PER_SERVICE))
+    ]
+
+    for id in range(FIRST_ID, FIRST_ID + count):
+        username = _word(generator, sizes["username"])
+        yield {
+            "service": generator.choice(services),
+            "password": "".join(generator.choices(PASSWORD_CHARACTERS, k=sizes["password"])),
+            "username": username if generator.random() < 0.8 else None,
+            "email": _email(generator, sizes["email"]) if generator.random() < 0.7 else None,
+            "id": id
+        }
+
+def _word(generator: random.Random, size: int) -> str:
+    return "".join(generator.choices(WORD_CHARACTERS, k=size))
+
+def _email(generator: random.Random, size: int) -> str:
+    domain = "@example.com"
+    return _word(generator, max(1, size - len(domain))) + domain
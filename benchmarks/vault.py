@@ -0,0 +1,345 @@
+"""
+Time the stages of using the vault on synthetic vaults of several sizes.
+
+For every vault size, set of KDF parameters, record format (see
+`codec`) and, with `--threads`, number of threads encrypting and
+decrypting the vault (see `container`), a vault of synthetic credentials
+(see `synthetic`) is written to a temporary directory, and
+each stage in `STAGES` runs `--repeat` times; the best time is kept. Each
+stage then runs once more under `tracemalloc` to measure the peak memory
+it allocates. Memory allocated inside the crypto library (such as the
+memory scrypt and Argon2id use) isn't seen by `tracemalloc`, so the
+process's maximum resident set size is reported as well.
+
+Stages:
+
+    kdf        Derive the key from the master password.
+    unlock     Check the master password with a cold key cache
+               (`storage.unlock()`).
+    serialize  Encode the frames and index chunks of every credential in
+               the record format, as the container does.
+    encrypt    Seal every encoded record with the data key.
+    write      Write the whole vault (`storage.write_vault()`).
+    decrypt    Unseal every sealed record.
+    parse      Decode every encoded record.
+    read       Read the whole vault (`storage.read_vault()`).
+    filter     Filter the credentials in memory by service
+               (`helpers.filter_credentials()`), `--lookups` times.
+    search     Search the vault by service (`storage.search_metadata()`),
+               `--lookups` times.
+    get        Get a credential by ID (`storage.get_credential()`),
+               `--lookups` times.
+
+The serialize and write stages also report the bytes encoded and the size
+of the vault file.
+
+Everything runs offline, with nothing but keystash and the standard
+library. Usage:
+
+    python -m benchmarks.vault [--records N ...] [--kdf SPEC ...]
+        [--format FORMAT ...] [--threads N ...] [--field-size FIELD=CHARACTERS ...] [--seed N] [--repeat N]
+        [--lookups N] [--json FILE] [--baseline FILE] [--tolerance PERCENT]
+
+A KDF is given as its name and parameters, like "scrypt:n=16384,r=8,p=1"
+or "pbkdf2-sha256:iterations=600000", or as "default" for the KDF new
+vaults use. `--json` saves the results, and `--baseline` compares them
+with results saved earlier, failing if a stage got slower or allocated
+more memory by more than the tolerance.
+"""
+from benchmarks import synthetic
+from src.utils import codec, constants, container, crypto_utils, helpers, storage
+import argparse, contextlib, json, os, pathlib, platform, random, resource, sys
+import tempfile, time, tracemalloc
+
+STAGES = (
+    "kdf", "unlock", "serialize", "encrypt", "write",
+    "decrypt", "parse", "read", "filter", "search", "get"
+)
+
+# Differences below these are noise, whatever the tolerance.
+NOISE_SECONDS = 0.001
+NOISE_BYTES = 64 * 1024
+
+ASSOCIATED_DATA = b"benchmark"
+
+def measure(
+    records: int, kdf: dict, seed: int, field_sizes: dict, repeat: int, lookups: int,
+    format: str = constants.RECORD_FORMAT, threads: int | None = None
+) -> dict:
+    """
+    Run every stage on a synthetic vault of `records` credentials whose key
+    is derived with `kdf`, with its records in `format`, and with `threads`
+    threads (`constants.CRYPTO_THREADS`) if given. Return the best
+    time in seconds and the peak memory allocated in bytes of each stage,
+    and the bytes written by the serialize and write stages.
+    """
+    credentials = list(synthetic.generate(records, seed, field_sizes))
+    chosen = random.Random(seed).choices(credentials, k=lookups)
+    services = [credential["service"] for credential in chosen]
+    ids = [credential["id"] for credential in chosen]
+
+    salt = os.urandom(16)
+    data_key = crypto_utils.generate_data_key()
+    encoded = _encode(credentials, format)
+    sealed = [crypto_utils.seal(data_key, record, ASSOCIATED_DATA) for record in encoded]
+
+    with _temporary_vault(format, threads):
+        storage.write_vault(credentials)
+        storage.set_kdf(kdf)
+
+        stages = {
+            "kdf": lambda: crypto_utils.derive(
+                kdf, constants.MASTER_PASSWORD.encode("utf-8"), salt
+            ),
+            "unlock": lambda: (crypto_utils.clear_key_cache(), storage.unlock()),
+            "serialize": lambda: _encode(credentials, format),
+            "encrypt": lambda: [
+                crypto_utils.seal(data_key, record, ASSOCIATED_DATA) for record in encoded
+            ],
+            "write": lambda: storage.write_vault(credentials),
+            "decrypt": lambda: [
+                crypto_utils.unseal(data_key, record, ASSOCIATED_DATA) for record in sealed
+            ],
+            "parse": lambda: _decode(encoded, records),
+            "read": storage.read_vault,
+            "filter": lambda: [
+                helpers.filter_credentials(credentials, service=service) for service in services
+            ],
+            "search": lambda: [list(storage.search_metadata(service=service)) for service in services],
+            "get": lambda: [storage.get_credential(id) for id in ids]
+        }
+
+        results = {}
+        for name in STAGES:
+            results[name] = {
+                "seconds": round(min(_time(stages[name]) for _ in range(repeat)), 6),
+                "peak_bytes": _peak(stages[name])
+            }
+
+        results["serialize"]["bytes"] = sum(map(len, encoded))
+        results["write"]["bytes"] = constants.VAULT.stat().st_size
+
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Return a message for every stage whose time or peak memory grew by
+    more than `tolerance` percent over the baseline.
+    """
+    regressions = []
+    for scenario, stages in results["scenarios"].items():
+        for stage, result in stages.items():
+            before = baseline["scenarios"].get(scenario, {}).get(stage)
+            if before is None:
+                continue
+
+            for key, unit, noise in (
+                ("seconds", "s", NOISE_SECONDS), ("peak_bytes", "bytes", NOISE_BYTES)
+            ):
+                if (
+                    result[key] > before[key] * (1 + tolerance / 100)
+                    and result[key] - before[key] > noise
+                ):
+                    regressions.append(
+                        f"{scenario}, {stage}: {result[key]} {unit}, up from {before[key]} {unit}."
+                    )
+
+    return regressions
+
+def parse_kdf(specification: str) -> dict:
+    """
+    Return the KDF parameters given like "scrypt:n=16384,r=8,p=1", or the
+    default KDF for "default".
+    """
+    if specification == "default":
+        return crypto_utils.default_kdf()
+
+    name, _, parameters = specification.partition(":")
+    if name not in crypto_utils.KDFS:
+        raise argparse.ArgumentTypeError(f"unknown KDF: {name!r}")
+
+    kdf = {"name": name}
+    for parameter in filter(None, parameters.split(",")):
+        key, _, value = parameter.partition("=")
+        try:
+            kdf[key] = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid KDF parameter: {parameter!r}")
+
+    return kdf
+
+def parse_field_size(specification: str) -> tuple[str, int]:
+    field, _, size = specification.partition("=")
+    if field not in synthetic.FIELD_SIZES or not size.isdigit():
+        raise argparse.ArgumentTypeError(f"expected FIELD=CHARACTERS, got {specification!r}")
+
+    return field, int(size)
+
+def scenario_name(records: int, kdf: dict, format: str, threads: int | None = None) -> str:
+    parameters = ",".join(f"{key}={kdf[key]}" for key in sorted(kdf) if key != "name")
+    name = f"{records} records, {kdf['name']}:{parameters}, {format}"
+
+    return name if threads is None else f"{name}, {threads} threads"
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.vault")
+    parser.add_argument("--records", type=int, nargs="+", default=[10, 1000, 10000],
+        help="Vault sizes, in credentials. Default: 10 1000 10000.")
+    parser.add_argument("--kdf", type=parse_kdf, action="append", default=None,
+        help="KDF to derive the key with, like 'scrypt:n=16384,r=8,p=1'. "
+        "Can be given more than once. Default: the KDF new vaults use.")
+    parser.add_argument("--format", dest="formats", choices=codec.FORMATS, action="append",
+        default=None,
+        help="Record format of the vault. Can be given more than once. Default: every format.")
+    parser.add_argument("--threads", type=int, nargs="+", default=[None],
+        help="Threads encrypting and decrypting the vault, each measured separately. "
+        "Default: constants.CRYPTO_THREADS.")
+    parser.add_argument("--field-size", dest="field_sizes", type=parse_field_size,
+        action="append", default=[],
+        help="Characters in a field of the synthetic credentials, like 'password=64'.")
+    parser.add_argument("--seed", type=int, default=0,
+        help="Seed of the synthetic credentials. Default: 0.")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="Runs of each stage; the best is kept. Default: 3.")
+    parser.add_argument("--lookups", type=int, default=100,
+        help="Lookups made by the filter, search and get stages. Default: 100.")
+    parser.add_argument("--json", dest="json_file", default=None,
+        help="Save the results to this file.")
+    parser.add_argument("--baseline", default=None,
+        help="Results saved with --json to compare with.")
+    parser.add_argument("--tolerance", type=float, default=20,
+        help="Percent a stage may grow over the baseline. Default: 20.")
+    arguments = parser.parse_args()
+
+    kdfs = arguments.kdf or [crypto_utils.default_kdf()]
+    field_sizes = {**synthetic.FIELD_SIZES, **dict(arguments.field_sizes)}
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()
+        },
+        "parameters": {
+            "seed": arguments.seed,
+            "field_sizes": field_sizes,
+            "repeat": arguments.repeat,
+            "lookups": arguments.lookups
+        },
+        "scenarios": {}
+    }
+
+    for kdf in kdfs:
+        for format in arguments.formats or codec.FORMATS:
+            for threads in arguments.threads:
+                for records in arguments.records:
+                    name = scenario_name(records, kdf, format, threads)
+                    stages = measure(
+                        records, kdf, arguments.seed, field_sizes,
+                        arguments.repeat, arguments.lookups, format, threads
+                    )
+                    results["scenarios"][name] = stages
+
+                    print(name)
+                    print(f"    {'stage':<12}{'seconds':>12}{'peak (KiB)':>14}{'size (KiB)':>14}")
+                    for stage, result in stages.items():
+                        size = f"{result['bytes'] / 1024:.1f}" if "bytes" in result else ""
+                        print(
+                            f"    {stage:<12}{result['seconds']:>12.6f}"
+                            f"{result['peak_bytes'] / 1024:>14.1f}{size:>14}"
+                        )
+
+    # ru_maxrss is in KiB on Linux.
+    results["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"Maximum resident set size: {results['max_rss_bytes'] // 1024 ** 2} MiB")
+
+    if arguments.json_file:
+        pathlib.Path(arguments.json_file).write_text(json.dumps(results, indent=4) + "\n")
+
+    failures = []
+    if arguments.baseline:
+        baseline = json.loads(pathlib.Path(arguments.baseline).read_text())
+        failures = compare(results, baseline, arguments.tolerance)
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+
+    return 1 if failures else 0
+
+def _encode(credentials: list, format: str) -> list[bytes]:
+    """
+    Encode the frame of every credential, then the index chunks, as the
+    container does.
+    """
+    records, entries = [], []
+    offset = 0
+    for credential in credentials:
+        metadata, secrets = {}, {}
+        for key, value in credential.items():
+            (secrets if key in container.SECRET_FIELDS else metadata)[key] = value
+
+        records.append(codec.encode_frame(secrets, format))
+        entries.append([credential["id"], offset, len(records[-1]), metadata])
+        offset += len(records[-1])
+
+    for start in range(0, len(entries), container.INDEX_CHUNK_SIZE):
+        records.append(codec.encode_index(entries[start:start + container.INDEX_CHUNK_SIZE], format))
+
+    return records
+
+def _decode(records: list, frames: int) -> list:
+    """
+    Decode the records encoded by `_encode()`, the first `frames` of them
+    frames.
+    """
+    return [
+        *map(codec.decode_frame, records[:frames]),
+        *map(codec.decode_index, records[frames:])
+    ]
+
+@contextlib.contextmanager
+def _temporary_vault(format: str = constants.RECORD_FORMAT, threads: int | None = None):
+    """
+    Point keystash to an empty data directory and a master password for
+    the duration of a `with` block, creating vaults with records in
+    `format`, and encrypting them with `threads` threads if given.
+    """
+    names = (
+        "DATA_DIR", "VAULT", "HASH", "LOCK", "JOURNAL", "MASTER_PASSWORD", "RECORD_FORMAT",
+        "CRYPTO_THREADS"
+    )
+    saved = {name: getattr(constants, name) for name in names}
+
+    with tempfile.TemporaryDirectory(prefix="keystash-benchmark-") as directory:
+        path = pathlib.Path(directory)
+        constants.DATA_DIR = path
+        constants.VAULT = path / "vault"
+        constants.HASH = path / "hash"
+        constants.LOCK = path / "lock"
+        constants.JOURNAL = path / "journal"
+        constants.MASTER_PASSWORD = "benchmark master password"
+        constants.RECORD_FORMAT = format
+        if threads is not None:
+            constants.CRYPTO_THREADS = threads
+        crypto_utils.clear_key_cache()
+        try:
+            yield
+        finally:
+            crypto_utils.clear_key_cache()
+            for name, value in saved.items():
+                setattr(constants, name, value)
+
+def _time(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def _peak(function) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,9 @@
 Add credentials to the vault.
 """
 from getpass import getpass
-from src.utils import storage
-import secrets, string, random
+from src.utils import passwords, storage
+
+_policy = None	# Policy of generated passwords (see `generate_password`), built on first use.
 
 def build_cli(subparsers):
     """
@@ -26,30 +27,34 @@ def build_cli(subparsers):
         dest="email", required=False, default=None,
         help="Email associated with the account."
     )
+    add_parser.add_argument(
+        "-p", "--password",
+        dest="password", required=False, default=None,
+        help="Password to store. Prompted for by default. Meant for "
+        "'keystash batch' scripts: on the command line, it is saved in your "
+        "shell history."
+    )
 
-def add(service: str, username: str, email: str) -> None:
+def add(service: str, username: str, email: str, password: str | None = None) -> None:
     """
     Add credential to the vault.
 
     This function takes the service, username, and email as
-    parameters, prompts the user for the password, and generates
-    the credential's unique ID. It also generates a strong password
-    when the user doesn't provide one.
+    parameters and prompts the user for the password if it isn't
+    given. It generates a strong password when the user doesn't
+    provide one. The vault gives the credential its unique ID.
     """
-    vault_contents = storage.read_vault()
-    id = get_unique_id(vault_contents)
-    password = get_password()
+    if password is None:
+        password = get_password()
     candidate = {
         "service": service,
         "password": password,
         "username": username,
-        "email": email,
-        "id": id
+        "email": email
     }
 
     # Write to vault.
-    vault_contents.append(candidate)
-    storage.write_vault(vault_contents)
+    storage.add_credential(candidate)
     print("Credential saved successfully!")
 
 def get_password() -> str:
@@ -78,37 +83,9 @@ def generate_password():
         Has at least one uppercase letter and one lowercase letter.
         Has at least 3 numbers.
     """
-    password_length = 16
-    symbols = "!@#$%^&*()-_=+[]{};:,.?/"
-    characters = string.ascii_letters + string.digits + symbols
+    global _policy
 
-    while True:
-        password = "".join(secrets.choice(characters) for _ in range(password_length))
-        # Check password strength.
-        if (any(char.isupper() for char in password)
-        and any(char.islower() for char in password)
-        and sum(char.isdigit() for char in password) >= 3):
-            break
+    if _policy is None:
+        _policy = passwords.Policy(16, minimums={"upper": 1, "lower": 1, "digits": 3})
 
-    return password
-
-def get_unique_id(existing_credentials):
-    """
-    Generate a unique ID between 100 and 999 (inclusive) that is not already in use.
-    
-    Parameters:
-    existing_credentials (list): A list of dictionaries, each containing an "ID" key
-    
-    Returns:
-    int: A unique ID between 100 and 999
-    
-    Raises:
-    ValueError: If all possible IDs are already taken
-    """
-    existing_ids = {record["id"] for record in existing_credentials}
-    available_ids = set(range(100, 1000)) - existing_ids
-    
-    if not available_ids:
-        raise ValueError("All IDs between 100 and 999 are already taken")
-    
-    return random.choice(list(available_ids))
+    return next(passwords.generate_passwords(1, _policy))
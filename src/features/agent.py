@@ -0,0 +1,390 @@
+"""
+Keep the vault unlocked in a background process, like ssh-agent.
+
+`keystash agent` asks for the master password, unlocks the vault, and
+serves vault operations on a Unix domain socket. It prints the shell
+commands setting `constants.AGENT_SOCKET_VARIABLE` to the path of the
+socket, so it is started with:
+
+    eval "$(keystash agent)"
+
+While the variable is set, `get`, `search`, `add`, `update` and `remove`
+send their vault operations to the agent instead of asking for the master
+password and opening the vault themselves.
+
+The socket is created in a directory only the user can access, and the
+agent drops connections from other users where the platform reports the
+peer's credentials. Every request is a JSON object on one line, answered
+by a JSON object on one line: {"result": ...} or {"error": "..."}.
+Connections are served concurrently, and operations on the vault one at
+a time.
+
+The agent locks itself after `constants.AGENT_IDLE_TIMEOUT` seconds
+without a request, or on `keystash agent -k`: it forgets the master
+password, the derived keys and the decrypted vault, and exits.
+"""
+from src.utils import constants, storage, helpers
+from src.features import add, remove, search, update
+import json, os, pathlib, shlex, socket, socketserver, struct, sys
+import tempfile, threading, time
+
+crypto_utils = helpers.lazy_import("src.utils.crypto_utils")
+pyperclip = helpers.lazy_import("pyperclip")
+
+# Commands sent to the agent when it is running.
+COMMANDS = ("get", "search", "add", "update", "remove")
+
+_operation_lock = threading.Lock()	# Held while a request uses the vault.
+_last_request = 0.0	# time.monotonic() of the last request served.
+_lock_requested = threading.Event()
+
+def build_cli(subparsers):
+    agent_parser = subparsers.add_parser("agent")
+    agent_parser.add_argument(
+        "-a", "--socket",
+        dest="socket", required=False, default=None,
+        help="Path of the socket to listen on. Default: a new private directory in /tmp."
+    )
+    agent_parser.add_argument(
+        "-t", "--timeout",
+        dest="timeout", required=False, default=constants.AGENT_IDLE_TIMEOUT, type=float,
+        help="Seconds without a request after which the agent locks itself. "
+        f"Default: {constants.AGENT_IDLE_TIMEOUT}."
+    )
+    agent_parser.add_argument(
+        "-f", "--foreground",
+        dest="foreground", action="store_true",
+        help="Don't fork into the background."
+    )
+    agent_parser.add_argument(
+        "-k", "--kill",
+        dest="kill", action="store_true",
+        help=f"Lock the agent named by ${constants.AGENT_SOCKET_VARIABLE}."
+    )
+
+def agent(
+    socket_path: str | None = None,
+    timeout: float = constants.AGENT_IDLE_TIMEOUT,
+    foreground: bool = False
+) -> None:
+    """
+    Unlock the vault and serve requests on a Unix domain socket until the
+    agent is idle for `timeout` seconds or is told to lock.
+
+    Print the shell commands pointing clients to the agent. Unless
+    `foreground` is True, the agent then forks into the background.
+    """
+    # Decrypt the vault now, so requests never pay for the key derivation.
+    storage.enable_cache()
+    storage.read_vault()
+
+    directory = None
+    if socket_path is None:
+        directory = pathlib.Path(tempfile.mkdtemp(prefix="keystash-"))
+        socket_path = directory / "agent.sock"
+    socket_path = pathlib.Path(socket_path)
+
+    server = listen(socket_path)
+
+    sys.stdout.flush()
+    pid = os.getpid() if foreground else os.fork()
+    if pid:
+        quoted = shlex.quote(str(socket_path))
+        print(f"{constants.AGENT_SOCKET_VARIABLE}={quoted}; export {constants.AGENT_SOCKET_VARIABLE};")
+        print(f"echo Agent pid {pid};")
+        sys.stdout.flush()
+        if not foreground:
+            server.socket.close()
+            return
+    else:
+        # Detach from the terminal the agent was started from.
+        os.setsid()
+        null = os.open(os.devnull, os.O_RDWR)
+        for descriptor in (0, 1, 2):
+            os.dup2(null, descriptor)
+
+    try:
+        serve(server, timeout)
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+        if directory is not None:
+            directory.rmdir()
+
+def listen(socket_path: pathlib.Path) -> socketserver.BaseServer:
+    """
+    Return a server listening on a new socket only the user can connect to.
+    """
+    # Create the socket without permissions for anyone else, rather than
+    # restricting them once others could already connect.
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(str(socket_path), _Handler)
+    finally:
+        os.umask(umask)
+
+    server.daemon_threads = True
+    return server
+
+def serve(server: socketserver.BaseServer, timeout: float) -> None:
+    """
+    Handle requests on a server until no request came for `timeout`
+    seconds or a client asked the agent to lock, then lock.
+    """
+    global _last_request
+
+    _last_request = time.monotonic()
+    _lock_requested.clear()
+    try:
+        while not _lock_requested.is_set():
+            remaining = _last_request + timeout - time.monotonic()
+            if remaining <= 0:
+                break
+
+            # Wake up now and then to notice a lock request.
+            server.timeout = min(remaining, 0.5)
+            server.handle_request()
+    finally:
+        with _operation_lock:
+            lock()
+
+def lock() -> None:
+    """
+    Forget the master password, the derived keys, and the decrypted vault.
+    """
+    storage.disable_cache()
+    crypto_utils.clear_key_cache()
+    constants.MASTER_PASSWORD = None
+
+def forward(cli_namespace) -> bool:
+    """
+    Run a command through the agent, if it is one the agent serves and the
+    agent is running. Return False if the command must run by itself.
+    """
+    path = os.environ.get(constants.AGENT_SOCKET_VARIABLE)
+
+    if cli_namespace.cmd == "agent" and cli_namespace.kill:
+        if not path:
+            print(f"{constants.AGENT_SOCKET_VARIABLE} is not set.")
+            sys.exit()
+        try:
+            call({"op": "lock"})
+        except OSError:
+            print(f"No agent is listening on {path}.")
+            sys.exit()
+        except ValueError as error:
+            print(f"Agent: {error}", file=sys.stderr)
+            sys.exit(1)
+        print("Agent locked.")
+        return True
+
+    if cli_namespace.cmd not in COMMANDS or cli_namespace.interactive_mode or not path:
+        return False
+
+    # Check arguments before sending anything, so that only the agent's
+    # errors are reported as the agent's.
+    if cli_namespace.cmd in ("get", "remove", "update"):
+        try:
+            int(cli_namespace.id)
+        except ValueError:
+            print(f"Invalid ID: {cli_namespace.id!r}.", file=sys.stderr)
+            sys.exit(1)
+
+    try:
+        call({"op": "ping"})
+    except OSError:
+        print(f"No agent is listening on {path}.", file=sys.stderr)
+        return False
+    except ValueError as error:
+        print(f"Agent: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    run_remote(cli_namespace)
+    return True
+
+def run_remote(cli_namespace) -> None:
+    """
+    Run a command with the vault operations sent to the agent. Prompts and
+    output are the same as when the command runs by itself.
+    """
+    if cli_namespace.cmd == "add":
+        password = cli_namespace.password
+        if password is None:
+            password = add.get_password()
+        _request({"op": "add", "credential": {
+            "service": cli_namespace.service,
+            "password": password,
+            "username": cli_namespace.username,
+            "email": cli_namespace.email
+        }})
+        print("Credential saved successfully!")
+
+    elif cli_namespace.cmd == "search":
+        search.show(_request({
+            "op": "find",
+            "service": cli_namespace.service,
+            "username": cli_namespace.username,
+            "email": cli_namespace.email,
+            "mode": cli_namespace.mode,
+            "limit": cli_namespace.limit
+        }))
+
+    elif cli_namespace.cmd == "get":
+        id = int(cli_namespace.id)
+        target = _request({"op": "get", "id": id})
+        if target is None:
+            print(f"No credential with ID {id} found!")
+            sys.exit()
+
+        pyperclip.copy(target["password"])
+        print("Password copied to clipboard.")
+
+    elif cli_namespace.cmd == "remove":
+        id = int(cli_namespace.id)
+        target = _request({"op": "get", "id": id})
+        if target is None:
+            print(f"No credential with id {id} found!")
+            sys.exit()
+
+        if not remove.confirm(target):
+            sys.exit()
+
+        _request({"op": "remove", "id": id})
+        print("Credential removed successfully.")
+
+    elif cli_namespace.cmd == "update":
+        id = int(cli_namespace.id)
+        password = cli_namespace.password
+        if password == update.PROMPT:
+            password = add.get_password()
+
+        if not _request({
+            "op": "update",
+            "id": id,
+            "service": cli_namespace.service,
+            "username": cli_namespace.username,
+            "email": cli_namespace.email,
+            "password": password
+        }):
+            print(f"No credential with ID {id} found!")
+            sys.exit()
+
+        print("Credential updated successfully!")
+
+def _request(request: dict):
+    """
+    Send a request for `run_remote()`. The agent may lock itself, fail, or
+    go away between the ping and the command: report it and exit.
+    """
+    try:
+        return call(request)
+    except (OSError, ValueError) as error:
+        print(f"Agent: {error}", file=sys.stderr)
+        sys.exit(1)
+
+def call(request: dict):
+    """
+    Send a request to the agent named by `constants.AGENT_SOCKET_VARIABLE`
+    and return the result.
+
+    Raise OSError if no agent answers, and ValueError with the agent's
+    message if the request failed.
+    """
+    path = os.environ[constants.AGENT_SOCKET_VARIABLE]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with connection.makefile("rb") as answer:
+            line = answer.readline()
+
+    if not line:
+        raise ConnectionError("The agent closed the connection.")
+
+    response = json.loads(line)
+    if "error" in response:
+        raise ValueError(response["error"])
+
+    return response["result"]
+
+def _run(request: dict):
+    """
+    Run a request on the unlocked vault and return its result.
+    """
+    operation = request["op"]
+
+    if operation == "ping":
+        return True
+
+    elif operation == "lock":
+        _lock_requested.set()
+        return True
+
+    elif operation == "get":
+        return storage.get_credential(request["id"])
+
+    elif operation == "find":
+        return [
+            {key: value for key, value in credential.items() if key != "password"}
+            for credential in search.find(
+                request["service"], request["username"], request["email"],
+                request["mode"], request["limit"]
+            )
+        ]
+
+    elif operation == "add":
+        return storage.add_credential(request["credential"])
+
+    elif operation == "update":
+        target = storage.get_credential(request["id"])
+        if target is None:
+            return False
+
+        return storage.update_credential(update.changed(
+            target, request["service"], request["username"],
+            request["email"], request["password"]
+        ))
+
+    elif operation == "remove":
+        return storage.remove_credential(request["id"])
+
+    raise ValueError(f"Unknown operation: {operation!r}.")
+
+def _same_user(connection: socket.socket) -> bool:
+    """
+    Return False if the peer of a connection is another user. Platforms
+    without SO_PEERCRED rely on the permissions of the socket alone.
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return True
+
+    credentials = connection.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", credentials)
+    return uid == os.getuid()
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Answer the request of a client connected to the agent.
+    """
+    def handle(self):
+        global _last_request
+
+        if not _same_user(self.connection):
+            return
+
+        try:
+            request = json.loads(self.rfile.readline())
+            with _operation_lock:
+                _last_request = time.monotonic()
+                if constants.MASTER_PASSWORD is None:
+                    raise ValueError("The agent is locked.")
+                response = {"result": _run(request)}
+        except Exception as error:
+            # Always answer, so the client reports the error instead of
+            # finding the connection closed. Some errors (InvalidTag) have
+            # no message.
+            response = {"error": str(error) or type(error).__name__}
+
+        # Credentials are `model.Credential` objects.
+        self.wfile.write(json.dumps(response, default=dict).encode("utf-8") + b"\n")
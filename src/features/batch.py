@@ -0,0 +1,163 @@
+"""
+Run a script of commands against the vault with a single unlock and a
+single vault write.
+"""
+from src.utils import storage
+from src.features import add, update, search
+import contextlib, io, json, shlex, sys
+
+# Commands a script can run.
+COMMANDS = ("add", "remove", "update", "get", "search")
+
+def build_cli(subparsers):
+    batch_parser = subparsers.add_parser("batch")
+    batch_parser.add_argument(
+        dest="file", nargs="?", default="-",
+        help="File holding one command per line, like 'add -s github.com "
+        "-u octocat -p hunter2'. Read from standard input if '-' or not given."
+    )
+    batch_parser.add_argument(
+        "--all-or-nothing",
+        dest="all_or_nothing", action="store_true",
+        help="Save nothing to the vault if any command fails."
+    )
+
+def batch(file: str, parser, all_or_nothing: bool = False) -> None:
+    """
+    Run the commands in a script, one per line, parsed by `parser` (the
+    parser returned by `main.build_cli()`).
+
+    Blank lines and lines starting with "#" are skipped. Arguments are
+    split like a shell does, so values can be quoted. Commands run against
+    the vault held in memory, and their changes are saved with one write at
+    the end, so a script of any length derives the master key once and
+    writes the vault once. Commands don't prompt: `add` and `update -p`
+    without a password generate one, and `remove` doesn't ask for
+    confirmation.
+
+    Results are printed to stdout: `get` prints the password, and `search`
+    prints the matching credentials as JSON, one per line, without their
+    passwords. Failures are printed to stderr with their line number, and
+    the exit status is 1 if any command failed.
+
+    In an interactive session deferring writes, the changes are saved with
+    the session's own, and `all_or_nothing` only drops the script's.
+    """
+    # Interactive mode may already have a cache, with writes of its own
+    # pending: keep them out of a rollback and leave its settings alone.
+    state = storage.cache_state()
+    storage.enable_cache(defer_writes=True)
+    failures = 0
+    count = 0
+
+    try:
+        with (sys.stdin if file == "-" else open(file, encoding="utf-8")) as script:
+            for number, line in enumerate(script, 1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+
+                count += 1
+                try:
+                    for output in run(parse(parser, line)):
+                        print(output)
+                except ValueError as error:
+                    failures += 1
+                    print(f"Line {number}: {error}", file=sys.stderr)
+
+        if failures and all_or_nothing:
+            storage.restore_cache(state)
+            print(f"{failures} of {count} commands failed. Nothing was saved.", file=sys.stderr)
+            sys.exit(1)
+
+        if not state["defer_writes"]:
+            storage.sync()
+    finally:
+        if state["enabled"]:
+            storage.enable_cache(defer_writes=state["defer_writes"])
+        else:
+            storage.disable_cache()
+
+    if failures:
+        print(f"{failures} of {count} commands failed.", file=sys.stderr)
+        sys.exit(1)
+
+def parse(parser, line: str):
+    """
+    Parse a line of a script. Raise ValueError with the parser's message if
+    it isn't a command a script can run.
+    """
+    try:
+        arguments = shlex.split(line)
+    except ValueError as error:
+        raise ValueError(f"Can't split the line: {error}.")
+
+    errors = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(errors), contextlib.redirect_stdout(io.StringIO()):
+            cli_namespace = parser.parse_args(arguments)
+    except SystemExit:
+        message = errors.getvalue().strip().splitlines()
+        raise ValueError(message[-1] if message else "Help can't be shown in a script.")
+
+    if cli_namespace.cmd not in COMMANDS:
+        raise ValueError(f"Only {', '.join(COMMANDS)} can be run in a script.")
+
+    return cli_namespace
+
+def run(cli_namespace):
+    """
+    Run a parsed command against the vault and yield its output lines.
+    Raise ValueError if it fails.
+    """
+    if cli_namespace.cmd == "add":
+        password = cli_namespace.password or add.generate_password()
+        id = storage.add_credential({
+            "service": cli_namespace.service,
+            "password": password,
+            "username": cli_namespace.username,
+            "email": cli_namespace.email
+        })
+        yield f"Added credential {id}."
+
+    elif cli_namespace.cmd == "update":
+        id = _id(cli_namespace.id)
+        target = _get(id)
+        password = cli_namespace.password
+        if password == update.PROMPT:
+            password = add.generate_password()
+
+        storage.update_credential(update.changed(
+            target, cli_namespace.service, cli_namespace.username,
+            cli_namespace.email, password
+        ))
+        yield f"Updated credential {id}."
+
+    elif cli_namespace.cmd == "remove":
+        id = _id(cli_namespace.id)
+        if not storage.remove_credential(id):
+            raise ValueError(f"No credential with ID {id} found.")
+        yield f"Removed credential {id}."
+
+    elif cli_namespace.cmd == "get":
+        yield _get(_id(cli_namespace.id))["password"]
+
+    elif cli_namespace.cmd == "search":
+        for credential in search.find(
+            cli_namespace.service, cli_namespace.username, cli_namespace.email,
+            cli_namespace.mode, cli_namespace.limit
+        ):
+            credential = {key: value for key, value in credential.items() if key != "password"}
+            yield json.dumps(credential)
+
+def _id(id: str) -> int:
+    try:
+        return int(id)
+    except ValueError:
+        raise ValueError(f"Invalid ID: {id!r}.")
+
+def _get(id: int) -> dict:
+    credential = storage.get_credential(id)
+    if credential is None:
+        raise ValueError(f"No credential with ID {id} found.")
+    return credential
@@ -0,0 +1,164 @@
+"""
+Pick KDF parameters for this machine and apply them to the vault.
+
+`keystash calibrate` times the KDF on this machine and picks the strongest
+parameters deriving a key within a target time and memory budget. The
+vault's data key is then wrapped with a key derived with them, upgrading
+the vault in place. `--dry-run` only shows the parameters.
+
+Parameters never go below `MINIMUMS`, even if that misses the target.
+"""
+from src.utils import constants, storage, helpers
+import os, sys, time
+
+crypto_utils = helpers.lazy_import("src.utils.crypto_utils")
+exceptions = helpers.lazy_import("cryptography.exceptions")
+
+# Weakest parameters calibration picks for each KDF.
+MINIMUMS = {
+    "argon2id": {"memory": 19 * 1024, "iterations": 2},
+    "scrypt": {"n": 2 ** 14},
+    "pbkdf2-sha256": {"iterations": 310000}
+}
+
+MIB = 1024 * 1024
+
+def build_cli(subparsers):
+    calibrate_parser = subparsers.add_parser("calibrate")
+    calibrate_parser.add_argument(
+        "-k", "--kdf",
+        dest="kdf", required=False, default=None, choices=list(MINIMUMS),
+        help="KDF to derive the key with. Default: the KDF the vault uses."
+    )
+    calibrate_parser.add_argument(
+        "-t", "--time",
+        dest="time", required=False, default=constants.CALIBRATION_TIME, type=float,
+        help=f"Seconds deriving the key should take. Default: {constants.CALIBRATION_TIME}."
+    )
+    calibrate_parser.add_argument(
+        "-m", "--memory",
+        dest="memory", required=False, default=constants.CALIBRATION_MEMORY, type=int,
+        help=f"MiB of memory deriving the key may use. Default: {constants.CALIBRATION_MEMORY}."
+    )
+    calibrate_parser.add_argument(
+        "-n", "--dry-run",
+        dest="dry_run", action="store_true",
+        help="Show the parameters without changing the vault."
+    )
+
+def calibrate(
+    kdf_name: str | None = None,
+    target: float = constants.CALIBRATION_TIME,
+    memory: int = constants.CALIBRATION_MEMORY,
+    dry_run: bool = False
+) -> None:
+    """
+    Pick the parameters of a KDF for `target` seconds and `memory` MiB on
+    this machine, and derive the vault's key with them.
+    """
+    current = storage.kdf()
+    if kdf_name is None:
+        kdf_name = current["name"]
+
+    try:
+        kdf, seconds = tune(kdf_name, target, memory * MIB)
+    except exceptions.UnsupportedAlgorithm:
+        print(f"{kdf_name} isn't supported by this build of cryptography.")
+        sys.exit()
+
+    print(f"Current parameters: {describe(current)}")
+    print(
+        f"Calibrated parameters: {describe(kdf)} "
+        f"({seconds:.2f} s, {memory_used(kdf) // MIB} MiB)"
+    )
+    if seconds > target and all(
+        kdf[key] <= value for key, value in MINIMUMS[kdf_name].items()
+    ):
+        print("The minimum parameters take longer than the target on this machine.")
+
+    if dry_run:
+        print("Vault not changed.")
+    elif kdf == current:
+        print("The vault already uses these parameters.")
+    else:
+        storage.set_kdf(kdf)
+        print("Vault updated.")
+
+def tune(name: str, target: float, memory: int) -> tuple[dict, float]:
+    """
+    Return the parameters of the KDF `name` deriving a key in about
+    `target` seconds with at most `memory` bytes on this machine, and the
+    seconds a derivation with them took.
+
+    Memory-hard KDFs get as much of the memory budget as the target allows,
+    then repeat work (more iterations or more scrypt blocks) to fill it.
+    """
+    minimum = MINIMUMS[name]
+
+    if name == "pbkdf2-sha256":
+        kdf = {"name": name, "iterations": minimum["iterations"]}
+        seconds = measure(kdf)
+        kdf["iterations"] = max(
+            minimum["iterations"],
+            int(kdf["iterations"] * target / seconds) // 1000 * 1000
+        )
+
+    elif name == "scrypt":
+        n = minimum["n"]
+        while 128 * 8 * n * 2 <= memory:
+            n *= 2
+
+        kdf = {"name": name, "n": n, "r": 8, "p": 1}
+        seconds = measure(kdf)
+        while seconds > target and kdf["n"] > minimum["n"]:
+            kdf["n"] //= 2
+            seconds = measure(kdf)
+
+        # scrypt computes its p blocks one after the other in the same memory.
+        kdf["p"] = max(1, int(target / seconds))
+
+    elif name == "argon2id":
+        kdf = {
+            "name": name,
+            "memory": max(minimum["memory"], memory // 1024),
+            "iterations": minimum["iterations"],
+            "lanes": 1
+        }
+        seconds = measure(kdf)
+        while seconds > target and kdf["memory"] > minimum["memory"]:
+            kdf["memory"] = max(minimum["memory"], kdf["memory"] // 2)
+            seconds = measure(kdf)
+
+        kdf["iterations"] = max(
+            minimum["iterations"], int(kdf["iterations"] * target / seconds)
+        )
+
+    else:
+        raise ValueError(f"Unknown KDF: {name!r}.")
+
+    return kdf, measure(kdf)
+
+def measure(kdf: dict) -> float:
+    """
+    Return the seconds deriving a key with the given KDF parameters takes.
+    """
+    start = time.perf_counter()
+    crypto_utils.derive(kdf, os.urandom(16), os.urandom(16))
+
+    return time.perf_counter() - start
+
+def memory_used(kdf: dict) -> int:
+    """
+    Return the bytes of memory deriving a key with the given KDF parameters
+    needs.
+    """
+    if kdf["name"] == "scrypt":
+        return 128 * kdf["r"] * kdf["n"]
+    elif kdf["name"] == "argon2id":
+        return kdf["memory"] * 1024
+
+    return 0
+
+def describe(kdf: dict) -> str:
+    parameters = " ".join(f"{key}={kdf[key]}" for key in sorted(kdf) if key != "name")
+    return f"{kdf['name']} {parameters}"
@@ -0,0 +1,30 @@
+"""
+Convert the records of the vault between the JSON and binary formats.
+
+`keystash convert binary` rewrites the vault with its records in the
+compact binary format (see `src.utils.codec`), and `keystash convert json`
+back in JSON. Without a format, the format of the vault is shown.
+"""
+from src.utils import codec, storage
+
+def build_cli(subparsers):
+    convert_parser = subparsers.add_parser("convert")
+    convert_parser.add_argument(
+        "format",
+        nargs="?", default=None, choices=codec.FORMATS,
+        help="Format to convert the vault's records to. Default: show the current format."
+    )
+
+def convert(format: str | None = None) -> None:
+    """
+    Rewrite the vault with its records in `format`, or show the format of
+    the vault if `format` is None.
+    """
+    current = storage.record_format()
+    if format is None:
+        print(f"The vault's records are stored as {current}.")
+    elif format == current:
+        print(f"The vault's records are already stored as {format}.")
+    else:
+        storage.set_format(format)
+        print(f"Vault converted to {format}.")
@@ -0,0 +1,115 @@
+"""
+Export credentials from the vault.
+"""
+from src.utils import storage, helpers, archive
+import csv, json, os, sys
+
+FIELDS = ("service", "username", "email", "password", "id")
+
+# Size of the write buffer of the exported file.
+BUFFER_SIZE = 1024 * 1024
+
+def build_cli(subparsers):
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument(
+        dest="file",
+        help="File to write the credentials to. It is overwritten if it exists."
+    )
+    export_parser.add_argument(
+        "-f", "--format",
+        dest="format", required=False, default="csv",
+        choices=["csv", "jsonl", "archive"],
+        help="'csv', 'jsonl' (JSON Lines), or 'archive' (encrypted with the "
+        "master password). Default: 'csv'."
+    )
+    export_parser.add_argument(
+        "--fields",
+        dest="fields", required=False, default=",".join(FIELDS),
+        help=f"Comma separated fields to export. Default: '{','.join(FIELDS)}'."
+    )
+    export_parser.add_argument(
+        "-s", "--service",
+        dest="service", required=False, default="any",
+        help="Only export credentials with the specified service."
+    )
+    export_parser.add_argument(
+        "-u", "--username",
+        dest="username", required=False, default="any",
+        help="Only export credentials with the specified username."
+    )
+    export_parser.add_argument(
+        "-e", "--email",
+        dest="email", required=False, default="any",
+        help="Only export credentials with the specified email."
+    )
+
+def export(
+    file: str, format: str = "csv", fields: str = ",".join(FIELDS),
+    service: str = "any", username: str = "any", email: str = "any"
+) -> None:
+    """
+    Write the credentials matching the given filters to a file.
+
+    Credentials are streamed from the vault to the file one at a time, so
+    memory use doesn't depend on the size of the vault. Passwords are only
+    decrypted if the "password" field is exported. The file is only
+    readable by the user, since it may hold passwords.
+
+    Parameters:
+        fields: (str) Comma separated fields to export, in order.
+
+        service, username, email: (str) Filters with the semantics of
+        `helpers.filter_credentials`: a value, None, or "any".
+    """
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown or not fields:
+        print(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(FIELDS)}.")
+        sys.exit()
+
+    credentials = storage.iter_vault() if "password" in fields else storage.iter_metadata()
+    credentials = (
+        {field: credential.get(field) for field in fields}
+        for credential in helpers.iter_filtered_credentials(
+            credentials, service=service, username=username, email=email
+        )
+    )
+
+    descriptor = os.open(file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # The mode only applies to new files, so restrict existing ones too,
+    # before anything is written.
+    os.fchmod(descriptor, 0o600)
+    if format == "archive":
+        with open(descriptor, "wb", buffering=BUFFER_SIZE) as output:
+            count = archive.write(output, credentials)
+    else:
+        with open(
+            descriptor, "w", buffering=BUFFER_SIZE, newline="", encoding="utf-8"
+        ) as output:
+            write = write_csv if format == "csv" else write_jsonl
+            count = write(output, credentials, fields)
+
+    print(f"Exported {count} credentials to {file}.")
+
+def write_csv(output, credentials, fields: list) -> int:
+    """
+    Write credentials as CSV with a header row. Return the number written.
+    """
+    writer = csv.DictWriter(output, fieldnames=fields)
+    writer.writeheader()
+
+    count = 0
+    for count, credential in enumerate(credentials, 1):
+        writer.writerow(credential)
+
+    return count
+
+def write_jsonl(output, credentials, fields: list) -> int:
+    """
+    Write credentials as JSON Lines. Return the number written.
+    """
+    count = 0
+    for count, credential in enumerate(credentials, 1):
+        output.write(json.dumps(credential) + "\n")
+
+    return count
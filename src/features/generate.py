@@ -0,0 +1,179 @@
+"""
+Generate passwords or passphrases in bulk.
+
+`keystash generate -n 500` prints 500 passwords, one per line, from a
+policy set by the options (see `src.utils.passwords`). With `-s`, they are
+stored as new credentials of that service instead, with one vault write.
+"""
+from src.utils import passwords, storage
+import argparse, sys
+
+# Largest values of the options, which cost time and memory that grow with them.
+MAX_COUNT = 1_000_000
+MAX_LENGTH = 1024
+MAX_WORDS = 64
+
+def build_cli(subparsers):
+    generate_parser = subparsers.add_parser("generate")
+    generate_parser.add_argument(
+        "-n", "--count",
+        dest="count", type=positive(MAX_COUNT), default=1,
+        help="Number of passwords to generate. Default: 1."
+    )
+    generate_parser.add_argument(
+        "-l", "--length",
+        dest="length", type=positive(MAX_LENGTH), default=16,
+        help="Characters in each password. Default: 16."
+    )
+    generate_parser.add_argument(
+        "-c", "--classes",
+        dest="classes", type=parse_classes, default=list(passwords.CLASSES),
+        help=f"Comma-separated character classes to use, among {', '.join(passwords.CLASSES)}. "
+        "Default: all of them."
+    )
+    generate_parser.add_argument(
+        "-m", "--min",
+        dest="minimums", type=parse_minimum, action="append", default=[],
+        help="Minimum number of characters of a class, like 'digits=3'. "
+        "Can be given more than once. Default: 1 of each class."
+    )
+    generate_parser.add_argument(
+        "-a", "--exclude-ambiguous",
+        dest="exclude_ambiguous", action="store_true",
+        help=f"Leave out characters easily mistaken for one another ({passwords.AMBIGUOUS})."
+    )
+    generate_parser.add_argument(
+        "-x", "--exclude",
+        dest="exclude", default="",
+        help="Characters to leave out."
+    )
+    generate_parser.add_argument(
+        "-w", "--words",
+        dest="words", type=positive(MAX_WORDS), default=None,
+        help="Generate passphrases of this many words from --wordlist instead of passwords."
+    )
+    generate_parser.add_argument(
+        "--wordlist",
+        dest="wordlist", default=None,
+        help="Word list of the passphrases: one word per line, optionally "
+        "after dice rolls, like the EFF large word list."
+    )
+    generate_parser.add_argument(
+        "--separator",
+        dest="separator", default="-",
+        help="Separator of the words of passphrases. Default: '-'."
+    )
+    generate_parser.add_argument(
+        "-s", "--service",
+        dest="service", default=None,
+        help="Store the passwords as new credentials of this service instead of printing them."
+    )
+    generate_parser.add_argument(
+        "-u", "--username",
+        dest="username", default=None,
+        help="Username of the stored credentials. '{n}' is replaced with 1, 2, 3..."
+    )
+    generate_parser.add_argument(
+        "-e", "--email",
+        dest="email", default=None,
+        help="Email of the stored credentials. '{n}' is replaced with 1, 2, 3..."
+    )
+
+def positive(maximum: int):
+    """
+    Return an argument type taking integers from 1 to `maximum`.
+    """
+    def parse(value: str) -> int:
+        if not value.isdigit() or not 1 <= int(value) <= maximum:
+            raise argparse.ArgumentTypeError(f"expected an integer from 1 to {maximum}, got {value!r}")
+
+        return int(value)
+
+    return parse
+
+def parse_classes(specification: str) -> list:
+    classes = [name.strip() for name in specification.split(",") if name.strip()]
+    unknown = [name for name in classes if name not in passwords.CLASSES]
+    if unknown or not classes:
+        raise argparse.ArgumentTypeError(
+            f"expected classes among {', '.join(passwords.CLASSES)}, got {specification!r}"
+        )
+
+    return classes
+
+def parse_minimum(specification: str) -> tuple[str, int]:
+    name, _, minimum = specification.partition("=")
+    if name not in passwords.CLASSES or not minimum.isdigit():
+        raise argparse.ArgumentTypeError(f"expected CLASS=COUNT, got {specification!r}")
+
+    return name, int(minimum)
+
+def generate(
+    count: int = 1, length: int = 16, classes: list | None = None, minimums: dict | None = None,
+    exclude_ambiguous: bool = False, exclude: str = "", words: int | None = None,
+    wordlist: str | None = None, separator: str = "-", service: str | None = None,
+    username: str | None = None, email: str | None = None
+) -> None:
+    """
+    Generate `count` passwords, or passphrases of `words` words from the
+    word list file `wordlist`, and print them one per line as they are
+    generated.
+
+    Passwords have `length` characters from `classes` (all of them by
+    default), at least one of each class unless `minimums` says otherwise,
+    and none of the characters in `exclude` or, if `exclude_ambiguous`,
+    `passwords.AMBIGUOUS`.
+
+    If `service` is given, the passwords are stored as new credentials of
+    that service instead, with the given username and email, where "{n}"
+    is replaced by the number of the credential, from 1.
+
+    The entropy of each password is printed to stderr, so that the output
+    can be piped.
+    """
+    if words is not None:
+        if wordlist is None:
+            print("Passphrases need a word list. Use '--wordlist FILE'.")
+            sys.exit()
+        words_available = passwords.read_wordlist(wordlist)
+        if not words_available:
+            print("The word list is empty.")
+            sys.exit()
+        generated = passwords.generate_passphrases(count, words, words_available, separator)
+        entropy = passwords.passphrase_entropy(words, words_available)
+    else:
+        classes = classes or list(passwords.CLASSES)
+        try:
+            policy = passwords.Policy(
+                length,
+                classes,
+                {**dict.fromkeys(classes, 1), **(minimums or {})},
+                exclude + (passwords.AMBIGUOUS if exclude_ambiguous else "")
+            )
+        except ValueError as error:
+            print(error)
+            sys.exit()
+        generated = passwords.generate_passwords(count, policy)
+        entropy = policy.entropy()
+
+    if service is None:
+        for password in generated:
+            print(password)
+        print(f"Entropy: {entropy:.1f} bits each.", file=sys.stderr)
+        return
+
+    ids = storage.add_credentials(
+        {
+            "service": service,
+            "password": password,
+            "username": _number(username, number),
+            "email": _number(email, number)
+        }
+        for number, password in enumerate(generated, 1)
+    )
+    if ids:
+        print(f"Stored {len(ids)} credentials (IDs {ids[0]} to {ids[-1]}).")
+    print(f"Entropy: {entropy:.1f} bits each.", file=sys.stderr)
+
+def _number(value: str | None, number: int) -> str | None:
+    return None if value is None else value.replace("{n}", str(number))
@@ -1,8 +1,10 @@
 """
 Copy a password to the clipboard.
 """
-from src.utils import storage
-import pyperclip, sys
+from src.utils import storage, helpers
+import sys
+
+pyperclip = helpers.lazy_import("pyperclip")
 
 def build_cli(subparsers):
     get_subparser = subparsers.add_parser("get")
@@ -16,13 +18,8 @@ def get(id: int) -> None:
     Do nothing if no credential with the given ID exists or if the credentials
     list is empty.
     """
-    credentials = storage.read_vault()
-
-    for cred in credentials:
-        if cred["id"] == id:
-            target = cred
-            break
-    else:
+    target = storage.get_credential(id)
+    if target is None:
         print(f"No credential with ID {id} found!")
         sys.exit()
 
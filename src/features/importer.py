@@ -0,0 +1,163 @@
+"""
+Import credentials exported by other password managers.
+"""
+from src.utils import archive, storage
+import csv, json, pathlib, sys
+
+# Columns (or keys) holding each credential field in the exports of common
+# password managers, in order of preference. Matched case-insensitively.
+FIELD_NAMES = {
+    "service": ("service", "name", "title", "url", "website", "login_uri", "uri"),
+    "password": ("password", "login_password"),
+    "username": ("username", "login_username", "login", "user"),
+    "email": ("email", "e-mail")
+}
+
+FORMATS = ("csv", "json", "archive")
+EXTENSIONS = {"ksa": "archive"}	# Formats of file extensions other than the format's name.
+
+def build_cli(subparsers):
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument(
+        dest="file",
+        help="CSV or JSON file exported by a password manager, or an archive "
+        "written by 'keystash export -f archive'."
+    )
+    import_parser.add_argument(
+        "-f", "--format",
+        dest="format", required=False, default=None, choices=FORMATS,
+        help="Format of the file. Guessed from its extension by default "
+        "('.ksa' for archives)."
+    )
+
+def import_credentials(file: str, format: str | None = None) -> None:
+    """
+    Add the credentials in an exported file to the vault.
+
+    Records without a service or a password are skipped, as are records
+    with the same service, username, and email as a credential already in
+    the vault or earlier in the file. The remaining credentials are added
+    with a single vault write, so nothing is added if the file can't be
+    read to the end.
+
+    Archives are read with the master password; credentials keep their
+    fields but get new IDs.
+    """
+    path = pathlib.Path(file)
+    if format is None:
+        extension = path.suffix.lstrip(".").lower()
+        format = EXTENSIONS.get(extension, extension)
+    if format not in FORMATS:
+        print("Unknown file format. Use '-f csv', '-f json' or '-f archive'.")
+        sys.exit()
+
+    # Only the fields compared are read, so no password is decrypted.
+    seen = {_key(credential) for credential in storage.iter_metadata()}
+    counts = {"invalid": 0, "duplicate": 0}
+
+    def new_credentials():
+        for record in read_records(path, format):
+            credential = to_credential(record)
+            if credential is None:
+                counts["invalid"] += 1
+            elif _key(credential) in seen:
+                counts["duplicate"] += 1
+            else:
+                seen.add(_key(credential))
+                yield credential
+
+    try:
+        ids = storage.add_credentials(new_credentials())
+    except (ValueError, csv.Error) as error:
+        print(f"Can't read {file}: {error}")
+        sys.exit()
+
+    print(f"Imported {len(ids)} credentials.")
+    if counts["duplicate"]:
+        print(f"Skipped {counts['duplicate']} duplicate credentials.")
+    if counts["invalid"]:
+        print(f"Skipped {counts['invalid']} records without a service or a password.")
+
+def read_records(path: pathlib.Path, format: str):
+    """
+    Yield the records in an exported file as flat dictionaries.
+
+    CSV files are read a row at a time. JSON files hold either a list of
+    records or, as Bitwarden exports do, an object with the records under
+    "items"; nested "login" objects are flattened into their record.
+    Records that aren't objects, or whose "login" or "uris" aren't as
+    expected, are yielded as empty records, which hold no credential.
+
+    Raise ValueError if a JSON file or an archive is malformed, or if an
+    archive was written with another master password.
+    """
+    if format == "archive":
+        yield from _archive_records(path)
+        return
+
+    with path.open(newline="", encoding="utf-8-sig") as file:
+        if format == "csv":
+            yield from csv.DictReader(file)
+            return
+
+        records = json.load(file)
+
+    if isinstance(records, dict):
+        records = records.get("items", [])
+    if not isinstance(records, list):
+        raise ValueError("expected a list of records or an object with \"items\".")
+
+    for record in records:
+        yield _flatten(record)
+
+def _flatten(record) -> dict:
+    """
+    Return a JSON record with its "login" object flattened into it, or an
+    empty record if it isn't shaped like one.
+    """
+    if not isinstance(record, dict):
+        return {}
+
+    login = record.pop("login", None) or {}
+    if not isinstance(login, dict):
+        return {}
+
+    uris = login.pop("uris", None) or []
+    if not isinstance(uris, list) or not all(isinstance(uri, dict) for uri in uris):
+        return {}
+
+    return {**record, **login, "uri": uris[0].get("uri") if uris else None}
+
+def _archive_records(path: pathlib.Path):
+    from cryptography.exceptions import InvalidTag
+    from cryptography.fernet import InvalidToken
+
+    with path.open("rb") as file:
+        try:
+            yield from archive.read(file)
+        except (InvalidTag, InvalidToken):
+            raise ValueError(
+                "the archive was written with another master password, or is damaged."
+            )
+
+def to_credential(record: dict) -> dict | None:
+    """
+    Return the credential held by a record, or None if it has no service
+    or no password. Missing or empty username and email become None.
+    """
+    record = {
+        str(key).strip().lower(): value
+        for key, value in record.items() if key is not None
+    }
+    credential = {}
+    for field, names in FIELD_NAMES.items():
+        values = (str(record[name]).strip() for name in names if record.get(name) is not None)
+        credential[field] = next((value for value in values if value), None)
+
+    if not credential["service"] or not credential["password"]:
+        return None
+
+    return credential
+
+def _key(credential: dict) -> tuple:
+    return credential["service"], credential.get("username"), credential.get("email")
@@ -4,18 +4,22 @@ Change the master password.
 Functions:
     build_cli: Define command-line options used by this feature.
 
-    passwd: Prompt the user for the new master password, hash it, then save it.
+    passwd: Prompt the user for the new master password, then set it.
+
+    show_progress: Show how much of the new vault file is written.
 """
-from src.utils import constants
+from src.utils import storage
 from getpass import getpass
-import bcrypt, sys
+import sys
+
+_shown = None	# Percentage last shown by `show_progress()`.
 
 def build_cli(subparsers):
     subparsers.add_parser("passwd")
 
 def passwd():
     """
-    Prompt the user for the new master password, hash it, then save it.
+    Prompt the user for the new master password, then set it.
 
     The user is prompted to enter the new master password twice. If the two
     inputs don't match, the user is prompted again, a maximum of 3 times.
@@ -25,7 +29,10 @@ def passwd():
     Note: Echo is turned off. The password typed by the user will not be
     visible on the terminal.
 
-    The password hash is stored in 'constants.HASH'.
+    The vault's data key is wrapped again with a key derived from the new
+    password (see `storage.set_master_password()`), and the vault file is
+    replaced once the new one is verified. Progress is shown on terminals.
+    If there is no vault yet, an empty one is created.
     """
     print("Setting master password.")
     for _ in range(3):
@@ -40,11 +47,25 @@ def passwd():
         print("New master password not saved.")
         sys.exit()
 
-    # Save password hash.
-    password_hash = bcrypt.hashpw(
-        new_password.strip().encode("utf-8"),
-        bcrypt.gensalt()
-    ).decode("utf-8")
-
-    constants.HASH.write_text(password_hash)
+    storage.set_master_password(new_password.strip(), progress=show_progress)
     print("Master password set successfully!")
+
+def show_progress(done: int, total: int) -> None:
+    """
+    Show the percentage of the new vault file written on stderr, if it is
+    a terminal.
+    """
+    global _shown
+
+    if not total or not sys.stderr.isatty():
+        return
+
+    percent = done * 100 // total
+    if percent == _shown:
+        return
+
+    _shown = percent
+    end = "\n" if done >= total else ""
+    print(f"\rWriting the vault: {percent}%", end=end, file=sys.stderr, flush=True)
+    if end:
+        _shown = None
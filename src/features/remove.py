@@ -19,15 +19,22 @@ def remove(id: int) -> None:
     Parameters:
         id: An integer ID of the credential to remove.
     """
-    credentials = storage.read_vault()
-    for cred in credentials:
-        if cred["id"] == id:
-            target = cred
-            break
-    else:
+    target = storage.get_credential(id)
+    if target is None:
         print(f"No credential with id {id} found!")
         sys.exit()
 
+    if not confirm(target):
+        sys.exit()
+
+    storage.remove_credential(id)
+    print("Credential removed successfully.")
+
+def confirm(target: dict) -> bool:
+    """
+    Show the credential to remove, without its password, and ask the user
+    to confirm. Return True if they do.
+    """
     print("Removing the following credential:")
     print()
     for key, value in target.items():
@@ -42,13 +49,10 @@ def remove(id: int) -> None:
             break
     else:
         print("Confirmation failed. Not removing credential.")
-        sys.exit()
+        return False
 
     if confirmation.lower() == "n":
         print("Not removing credential.")
-        sys.exit()
-
-    credentials.remove(target)
-    storage.write_vault(credentials)
-    print("Credential removed successfully.")
+        return False
 
+    return True
@@ -1,4 +1,5 @@
-from src.utils import storage, helpers
+from src.utils import storage, trigram
+import argparse
 
 def build_cli(subparsers):
     search_parser = subparsers.add_parser("search")
@@ -17,8 +18,29 @@ def build_cli(subparsers):
         dest="email", required=False, default="any",
         help="Only show credentials with the specified email."
     )
+    search_parser.add_argument(
+        "-m", "--mode",
+        dest="mode", required=False, default="exact",
+        choices=["exact", "substring", "fuzzy"],
+        help="How values are matched. 'substring' and 'fuzzy' ignore case "
+        "and show the closest matches first."
+    )
+    search_parser.add_argument(
+        "-n", "--limit",
+        dest="limit", required=False, default=10, type=parse_limit,
+        help="Maximum number of credentials shown in 'substring' and 'fuzzy' modes."
+    )
 
-def search(service: str, username: str, email: str) -> None:
+def parse_limit(value: str) -> int:
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value!r}")
+
+    return int(value)
+
+def search(
+    service: str, username: str, email: str,
+    mode: str = "exact", limit: int = 10
+) -> None:
     """
     Print the service, username, and email of credentials that
     match the given parameters.
@@ -32,16 +54,44 @@ def search(service: str, username: str, email: str) -> None:
         credentials with any value for that specific field. Passing
         "any" for service will print credentials with any value for
         the service.
+
+        mode: (str) "exact" prints credentials whose fields equal the
+        given values. "substring" prints up to `limit` credentials whose
+        fields contain them, and "fuzzy" also includes similar values
+        (see `trigram.search`). Both ignore case and print the closest
+        matches first.
     """
-    credentials = storage.read_vault()
-    matching_credentials = helpers.filter_credentials(
-        credentials, service=service,
-        username=username, email=email
-    )
+    show(find(service, username, email, mode, limit))
 
-    for credential in matching_credentials:
+def show(credentials) -> None:
+    """
+    Print the credentials found by a search, without their passwords.
+    """
+    for credential in credentials:
         print()
         for key, value in credential.items():
             if key == "password": continue
 
             print(f"{key.capitalize()}: {value}")
+
+def find(
+    service: str, username: str, email: str,
+    mode: str = "exact", limit: int = 10
+):
+    """
+    Return the credentials printed by `search()`, with the same parameters.
+    Their passwords may or may not be included.
+    """
+    if mode == "exact":
+        # Passwords aren't printed, so don't decrypt them. The vault's indexes
+        # are used, so only the matching credentials are read.
+        return storage.search_metadata(
+            service=service, username=username, email=email
+        )
+
+    credentials, index = storage.read_indexed_metadata(trigram.build_index)
+    return trigram.search(
+        credentials, index, fuzzy=mode == "fuzzy", limit=limit,
+        service=service, username=username, email=email
+    )
+
@@ -0,0 +1,78 @@
+"""
+Change a credential in the vault.
+"""
+from src.utils import storage
+from src.features import add
+import sys
+
+# Value of the password option given without a password: prompt for one.
+PROMPT = ""
+
+def build_cli(subparsers):
+    update_parser = subparsers.add_parser("update")
+    update_parser.add_argument(
+        dest="id",
+        help="ID of the credential to change. Use 'keystash search' to get it."
+    )
+    update_parser.add_argument(
+        "-s", "--service",
+        dest="service", required=False, default=None,
+        help="New name of the service."
+    )
+    update_parser.add_argument(
+        "-u", "--username",
+        dest="username", required=False, default=None,
+        help="New username."
+    )
+    update_parser.add_argument(
+        "-e", "--email",
+        dest="email", required=False, default=None,
+        help="New email."
+    )
+    update_parser.add_argument(
+        "-p", "--password",
+        dest="password", required=False, default=None, nargs="?", const=PROMPT,
+        help="Change the password. Prompted for if no password is given, "
+        "which is safer: on the command line, it is saved in your shell history."
+    )
+
+def update(
+    id: int,
+    service: str | None = None,
+    username: str | None = None,
+    email: str | None = None,
+    password: str | None = None
+) -> None:
+    """
+    Change the given fields of the credential with the given ID. Fields
+    left as None are kept. A password of `PROMPT` is prompted for, or
+    generated if the user doesn't provide one.
+    """
+    target = storage.get_credential(id)
+    if target is None:
+        print(f"No credential with ID {id} found!")
+        sys.exit()
+
+    if password == PROMPT:
+        password = add.get_password()
+
+    storage.update_credential(changed(target, service, username, email, password))
+    print("Credential updated successfully!")
+
+def changed(
+    credential: dict,
+    service: str | None,
+    username: str | None,
+    email: str | None,
+    password: str | None
+) -> dict:
+    """
+    Return a copy of a credential with the fields that aren't None changed.
+    """
+    changes = {
+        "service": service, "username": username, "email": email, "password": password
+    }
+    return {
+        **credential,
+        **{field: value for field, value in changes.items() if value is not None}
+    }
@@ -1,61 +1,163 @@
-from src.features import add, search, passwd, remove, get
-from src.utils import constants, storage
+from src.utils import constants, helpers, profiling
 from getpass import getpass
-import argparse, sys, bcrypt
+import argparse, os, sys
+
+# Features and their dependencies are loaded when a command first uses them,
+# so `--help`, argument errors and light commands start quickly.
+add = helpers.lazy_import("src.features.add")
+search = helpers.lazy_import("src.features.search")
+passwd = helpers.lazy_import("src.features.passwd")
+remove = helpers.lazy_import("src.features.remove")
+get = helpers.lazy_import("src.features.get")
+importer = helpers.lazy_import("src.features.importer")
+export = helpers.lazy_import("src.features.export")
+update = helpers.lazy_import("src.features.update")
+batch = helpers.lazy_import("src.features.batch")
+agent = helpers.lazy_import("src.features.agent")
+calibrate = helpers.lazy_import("src.features.calibrate")
+convert = helpers.lazy_import("src.features.convert")
+generate = helpers.lazy_import("src.features.generate")
+storage = helpers.lazy_import("src.utils.storage")
+bcrypt = helpers.lazy_import("bcrypt")
+
+# The feature defining each command.
+FEATURES = {
+    # Have all features listed here.
+    "add": add,
+    "search": search,
+    "passwd": passwd,
+    "remove": remove,
+    "get": get,
+    "import": importer,
+    "export": export,
+    "update": update,
+    "batch": batch,
+    "agent": agent,
+    "calibrate": calibrate,
+    "convert": convert,
+    "generate": generate
+}
 
 def main():
-    parser = build_cli()
-    cli_namespace = parser.parse_args()
-    constants.MASTER_PASSWORD = verify_identity(cli_namespace.cmd)
+    start_tracing(sys.argv[1:])
+    try:
+        with profiling.span("parse arguments"):
+            parser = build_cli(sys.argv[1:])
+            cli_namespace = parser.parse_args()
+
+        if (
+            cli_namespace.cmd == "agent" or constants.AGENT_SOCKET_VARIABLE in os.environ
+        ) and agent.forward(cli_namespace):
+            return
+
+        if uses_vault(cli_namespace):
+            with profiling.span("verify identity"):
+                constants.MASTER_PASSWORD = verify_identity(cli_namespace.cmd)
+
+        if cli_namespace.interactive_mode or not cli_namespace.cmd:
+            storage.enable_cache(defer_writes=cli_namespace.defer_writes)
+            with profiling.span(str(cli_namespace.cmd)):
+                run_command(cli_namespace)
+            interactive_mode(build_cli())
+
+        else:
+            with profiling.span(cli_namespace.cmd):
+                run_command(cli_namespace)
+
+    finally:
+        profiling.stop()
+
+def start_tracing(argv: list[str]) -> None:
+    """
+    Turn tracing on if asked for with '--profile' or the environment
+    variable `constants.TRACE_VARIABLE` (see `profiling`).
+
+    This runs before the arguments are parsed, so parsing is timed too.
+    """
+    setting = "table" if "--profile" in argv else os.environ.get(constants.TRACE_VARIABLE)
+    if not setting:
+        return
 
-    if cli_namespace.interactive_mode or not cli_namespace.cmd:
-        run_command(cli_namespace)
-        interactive_mode(parser)
+    try:
+        profiling.start(setting)
+    except ValueError as error:
+        print(f"{constants.TRACE_VARIABLE}: {error}", file=sys.stderr)
 
-    else:
-        run_command(cli_namespace)
+def uses_vault(cli_namespace) -> bool:
+    """
+    Return whether the command uses the vault, and so needs the master
+    password. Only `generate` without `-s` doesn't.
+    """
+    return not (
+        cli_namespace.cmd == "generate" and cli_namespace.service is None
+        and not cli_namespace.interactive_mode
+    )
 
-def build_cli():
+def build_cli(argv: list[str] | None = None):
     """
-    Setup all CLI commands and options.
+    Setup CLI commands and options.
+
+    If the command line arguments `argv` are given, only the command they
+    run gets its options; the other commands are listed without loading
+    their features. Otherwise every command is set up, so any command can
+    be parsed.
 
     Return the top level parser got by `argparse.ArgumentParser()`.
     """
     parser = argparse.ArgumentParser(prog="KeyStash")
     parser.add_argument("-i", "--interactive",
         dest="interactive_mode", action="store_true")
+    parser.add_argument("--defer-writes",
+        dest="defer_writes", action="store_true",
+        help="In interactive mode, save changes to the vault only on 'sync' or exit.")
+    parser.add_argument("--profile",
+        dest="profile", action="store_true",
+        help=f"Print the time each phase of the command took to stderr. See also ${constants.TRACE_VARIABLE}.")
 
     subparsers = parser.add_subparsers(dest="cmd")
 
-    build_cli_functions = [
-        # Have all features listed here.
-        add.build_cli,
-        search.build_cli,
-        passwd.build_cli,
-        remove.build_cli,
-        get.build_cli
-    ]
-    for build_cli in build_cli_functions:
-        build_cli(subparsers)
+    # The top level options take no values, so the command is the first
+    # argument that isn't an option.
+    command = None
+    if argv is not None:
+        command = next((argument for argument in argv if not argument.startswith("-")), None)
+
+    for name, feature in FEATURES.items():
+        if argv is None or name == command:
+            feature.build_cli(subparsers)
+        else:
+            subparsers.add_parser(name)
 
     return parser
 
 def interactive_mode(parser):
     """
     Continuously prompt the user for commands and execute them.
+
+    'sync' saves changes deferred by '--defer-writes'. Deferred changes are
+    also saved when the session ends.
     """
-    while True:
-        command = input("(keystash) ").strip()
+    try:
+        while True:
+            command = input("(keystash) ").strip()
 
-        if not command: continue
-        elif command in ("exit", "quit"):
-            sys.exit()
+            if not command: continue
+            elif command in ("exit", "quit"):
+                sys.exit()
+            elif command == "sync":
+                if storage.sync():
+                    print("Changes saved to the vault.")
+                continue
 
-        try:
-            cli_namespace = parser.parse_args(command.split(" "))
-            run_command(cli_namespace)
-        except SystemExit: # Prevent exiting when argparse gets an invalid command/switch.
-            continue
+            try:
+                cli_namespace = parser.parse_args(command.split(" "))
+                with profiling.span(cli_namespace.cmd):
+                    run_command(cli_namespace)
+            except SystemExit: # Prevent exiting when argparse gets an invalid command/switch.
+                continue
+
+    finally:
+        storage.sync()
 
 def run_command(cli_namespace):
     """
@@ -65,14 +167,17 @@ def run_command(cli_namespace):
         add.add(
             service=cli_namespace.service,
             username=cli_namespace.username,
-            email=cli_namespace.email
+            email=cli_namespace.email,
+            password=cli_namespace.password
         )
 
     elif cli_namespace.cmd == "search":
         search.search(
             service=cli_namespace.service,
             username=cli_namespace.username,
-            email=cli_namespace.email
+            email=cli_namespace.email,
+            mode=cli_namespace.mode,
+            limit=cli_namespace.limit
         )
 
     elif cli_namespace.cmd == "passwd":
@@ -84,10 +189,70 @@ def run_command(cli_namespace):
     elif cli_namespace.cmd == "get":
         get.get(int(cli_namespace.id))
 
+    elif cli_namespace.cmd == "update":
+        update.update(
+            int(cli_namespace.id),
+            service=cli_namespace.service,
+            username=cli_namespace.username,
+            email=cli_namespace.email,
+            password=cli_namespace.password
+        )
+
+    elif cli_namespace.cmd == "batch":
+        batch.batch(cli_namespace.file, build_cli(), cli_namespace.all_or_nothing)
+
+    elif cli_namespace.cmd == "agent":
+        agent.agent(cli_namespace.socket, cli_namespace.timeout, cli_namespace.foreground)
+
+    elif cli_namespace.cmd == "calibrate":
+        calibrate.calibrate(
+            kdf_name=cli_namespace.kdf,
+            target=cli_namespace.time,
+            memory=cli_namespace.memory,
+            dry_run=cli_namespace.dry_run
+        )
+
+    elif cli_namespace.cmd == "convert":
+        convert.convert(cli_namespace.format)
+
+    elif cli_namespace.cmd == "generate":
+        generate.generate(
+            count=cli_namespace.count,
+            length=cli_namespace.length,
+            classes=cli_namespace.classes,
+            minimums=dict(cli_namespace.minimums),
+            exclude_ambiguous=cli_namespace.exclude_ambiguous,
+            exclude=cli_namespace.exclude,
+            words=cli_namespace.words,
+            wordlist=cli_namespace.wordlist,
+            separator=cli_namespace.separator,
+            service=cli_namespace.service,
+            username=cli_namespace.username,
+            email=cli_namespace.email
+        )
+
+    elif cli_namespace.cmd == "import":
+        importer.import_credentials(cli_namespace.file, cli_namespace.format)
+
+    elif cli_namespace.cmd == "export":
+        export.export(
+            cli_namespace.file,
+            format=cli_namespace.format,
+            fields=cli_namespace.fields,
+            service=cli_namespace.service,
+            username=cli_namespace.username,
+            email=cli_namespace.email
+        )
+
 def verify_identity(cmd: None | str) -> str:
     """
     Verify user identity by prompting for the master password.
 
+    The password is checked by unwrapping the vault's data key, which runs
+    the key derivation once (see `storage.unlock()`). Master passwords set
+    before the vault checked them are checked against their bcrypt hash in
+    'constants.HASH' once, then the hash is removed.
+
     Parameters:
         cmd:
             The cli command passed in by the user.
@@ -95,25 +260,35 @@ def verify_identity(cmd: None | str) -> str:
     Return the password if the user is verified, exit otherwise.
     Exit if the master password is not set and 'cmd' != "passwd".
     """
-    if constants.HASH.exists():
-        password_hash = constants.HASH.read_text().strip()
-        for _ in range(3):
-            password = getpass("Enter master password: ").strip()
+    if not storage.exists() and not constants.HASH.exists():
+        if cmd != "passwd": # Allow the user to use only 'passwd' when the master password isn't set.
+            print("Master password not set.")
+            print("Use 'keystash passwd' to set the master password.")
+            sys.exit()
+        return None
+
+    for _ in range(3):
+        password = getpass("Enter master password: ").strip()
+        constants.MASTER_PASSWORD = password
 
-            if bcrypt.checkpw(
+        if storage.exists():
+            verified = storage.unlock()
+        else:
+            verified = bcrypt.checkpw(
                 password.encode("utf-8"),
-                password_hash.encode("utf-8")
-            ):
-                return password
+                constants.HASH.read_text().strip().encode("utf-8")
+            )
+            if verified:
+                storage.set_master_password(password)
 
-            print("Incorrect master password!")
+        if verified:
+            constants.HASH.unlink(missing_ok=True)
+            return password
 
-        sys.exit()
+        print("Incorrect master password!")
 
-    elif cmd != "passwd": # Allow the user to use only 'passwd' when constants.HASH doesn't exist.
-        print("Master password not set.")
-        print("Use 'keystash passwd' to set the master password.")
-        sys.exit()
+    constants.MASTER_PASSWORD = None
+    sys.exit()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,116 @@
+"""
+Encrypted portable archive of credentials, written by `keystash export`.
+
+An archive can be read anywhere with the master password it was written
+with, without the vault. It is stored in the following binary format:
+
+    ARCHIVE_MAGIC
+    <4-byte header length><header>
+    <4-byte length><1-byte last batch flag><sealed batch>
+    ...
+
+The header holds the KDF parameters and the data key wrapped by the key
+derived from the master password, like the vault header (see `storage`):
+
+    {"kdf": {...}, "salt": ..., "wrapped_key": ...}
+
+Archives written before scrypt was used hold PBKDF2 "iterations" instead
+of "kdf", and can still be read.
+
+Each batch holds up to `BATCH_SIZE` credentials as JSON lines, sealed with
+the data key. Batches are authenticated with the magic, the header and
+their position, and the last batch is marked as such, so batches can't be
+reordered, dropped, or cut off the end without the archive being rejected.
+"""
+from src.utils import constants, helpers
+import base64, json, os
+
+crypto_utils = helpers.lazy_import("src.utils.crypto_utils")
+
+ARCHIVE_MAGIC = b"KSARCHIVE1\n"
+BATCH_SIZE = 256
+
+def write(file, credentials) -> int:
+    """
+    Write the given credentials (any iterable) as an archive to a file
+    opened in binary mode. Credentials are encrypted a batch at a time.
+
+    Return the number of credentials written.
+    """
+    salt = os.urandom(16)
+    kdf = crypto_utils.default_kdf()
+    data_key = crypto_utils.generate_data_key()
+    header = _encode_header({
+        "kdf": kdf,
+        "salt": base64.b64encode(salt).decode("utf-8"),
+        "wrapped_key": base64.b64encode(
+            crypto_utils.wrap_key(data_key, salt, kdf)
+        ).decode("utf-8")
+    })
+    file.write(ARCHIVE_MAGIC + len(header).to_bytes(4, "big") + header)
+
+    count = 0
+    number = 0
+    batch = []
+    for credential in credentials:
+        if len(batch) == BATCH_SIZE:
+            _write_batch(file, batch, number, False, data_key, header)
+            number += 1
+            batch = []
+
+        batch.append(credential)
+        count += 1
+
+    _write_batch(file, batch, number, True, data_key, header)
+
+    return count
+
+def read(file):
+    """
+    Yield the credentials in an archive opened in binary mode.
+
+    Raise ValueError if the file isn't an archive or was cut short, and
+    cryptography's InvalidTag if it was tampered with.
+    """
+    if file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+        raise ValueError("Not a keystash archive.")
+
+    header = file.read(int.from_bytes(file.read(4), "big"))
+    fields = json.loads(header)
+    data_key = crypto_utils.unwrap_key(
+        base64.b64decode(fields["wrapped_key"]),
+        base64.b64decode(fields["salt"]),
+        crypto_utils.header_kdf(fields)
+    )
+
+    number = 0
+    while True:
+        length = file.read(4)
+        if len(length) < 4:
+            raise ValueError("The archive is incomplete.")
+
+        last = file.read(1) == b"\x01"
+        sealed = file.read(int.from_bytes(length, "big"))
+        lines = crypto_utils.unseal(
+            data_key, sealed, _associated_data(header, number, last)
+        )
+
+        for line in lines.splitlines():
+            yield json.loads(line)
+
+        if last:
+            return
+        number += 1
+
+def _write_batch(file, batch: list, number: int, last: bool, data_key: bytes, header: bytes) -> None:
+    lines = "".join(json.dumps(credential) + "\n" for credential in batch)
+    sealed = crypto_utils.seal(
+        data_key, lines.encode("utf-8"), _associated_data(header, number, last)
+    )
+    file.write(len(sealed).to_bytes(4, "big") + (b"\x01" if last else b"\x00") + sealed)
+
+def _encode_header(header: dict) -> bytes:
+    return json.dumps(header, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+def _associated_data(header: bytes, number: int, last: bool) -> bytes:
+    return ARCHIVE_MAGIC + header + number.to_bytes(8, "big") + (b"last" if last else b"more")
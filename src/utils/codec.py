@@ -0,0 +1,377 @@
+"""
+Encodings of the records stored in a vault container (see `container`):
+index chunks, frames, and field index buckets.
+
+Two formats are supported, chosen per vault by the "format" field of its
+header (see `storage`):
+
+    json    The records as JSON.
+    binary  A compact columnar encoding (below).
+
+Decoding doesn't need to be told the format: binary records start with
+`VERSION`, a byte JSON text never starts with, so containers written in
+either format can always be read.
+
+Binary records are made of columns rather than rows. A column of N
+integers is one byte giving the width W (1, 2, 4 or 8) of the widest
+value, followed by N little-endian W-byte integers, which `array` decodes
+in one call. Counts are varints. Strings are kept in a per-record string
+dictionary, so a service, username or email repeated across the
+credentials of an index chunk, and every field name, is stored once:
+
+    strings:  <varint count><1-byte encoding><varint length><data>
+
+where the data is the UTF-8 strings separated by NUL bytes, or a JSON
+array if a string contains a NUL byte (encoding 1).
+
+    index chunk:  VERSION<varint entries><strings>
+                  <varint fields><column: string number of each field name>
+                  <column: ID deltas><1-byte offsets layout><column: offsets>
+                  <column: lengths>
+                  <column: value codes of each entry, for each field>
+                  <varint length><JSON array of other values>
+    frame:        VERSION 0x00 <UTF-8 password>
+                  VERSION 0x01 <JSON object>    (frames holding anything else)
+    field bucket: VERSION<varint entries><strings><column: value codes>
+                  <column: ID counts><column: IDs>
+                  <varint length><JSON array of other values>
+
+Entries of index chunks are sorted by ID, so IDs are stored as deltas,
+mostly one byte each. Frames are usually written in ID order too, and
+their offsets are then stored as deltas (`ASCENDING_OFFSETS`); otherwise
+as they are (`ABSOLUTE_OFFSETS`).
+
+A value code is `ABSENT` (the credential has no such field), `NULL`,
+`SAME_ID` (the value is the ID of the entry), a string number plus
+`FIRST_STRING`, or, for values of other types, a position in the trailing
+JSON array after the strings.
+"""
+import array, itertools, json, operator, sys
+
+FORMATS = ("json", "binary")
+
+VERSION = b"\x01"
+
+# Value codes.
+ABSENT = 0
+NULL = 1
+SAME_ID = 2
+FIRST_STRING = 3
+
+# Frame layouts.
+PASSWORD_FRAME = 0
+JSON_FRAME = 1
+
+# Offsets layouts.
+ASCENDING_OFFSETS = 0
+ABSOLUTE_OFFSETS = 1
+
+# Fields of the credentials keystash writes, decoded without `dict(zip())`.
+CREDENTIAL_FIELDS = ["service", "username", "email", "id"]
+
+# array typecode of each integer width.
+_TYPECODES = {array.array(code).itemsize: code for code in "QLIHB"}
+_BIG_ENDIAN = sys.byteorder == "big"
+
+_ABSENT = object()	# Decoded value of fields a credential doesn't have.
+
+def encode_index(entries: list, format: str) -> bytes:
+    """
+    Encode the entries of an index chunk: [[id, offset, length, metadata], ...]
+    sorted by ID.
+    """
+    if format == "json":
+        return json.dumps(entries).encode("utf-8")
+    _check(format)
+
+    ids = [entry[0] for entry in entries]
+    fields = list(dict.fromkeys(key for entry in entries for key in entry[3]))
+    strings, extras = {}, []
+    for field in fields:
+        strings.setdefault(field, len(strings))
+
+    columns = []
+    for field in fields:
+        values = [entry[3].get(field, _ABSENT) for entry in entries]
+        columns.append(_codes(values, ids, strings, extras))
+
+    offsets = [entry[1] for entry in entries]
+    if all(offset <= next_offset for offset, next_offset in zip(offsets, offsets[1:])):
+        offsets_layout = ASCENDING_OFFSETS
+        offsets = [offset - previous for offset, previous in zip(offsets, [0, *offsets])]
+    else:
+        offsets_layout = ABSOLUTE_OFFSETS
+
+    return b"".join((
+        VERSION,
+        _varint(len(entries)),
+        _encode_strings(strings),
+        _varint(len(fields)),
+        _column([strings[field] for field in fields]),
+        _column([id - previous_id for id, previous_id in zip(ids, [0, *ids])]),
+        bytes((offsets_layout,)),
+        _column(offsets),
+        _column([entry[2] for entry in entries]),
+        *(_column(_finish(codes, len(strings))) for codes in columns),
+        _encode_extras(extras)
+    ))
+
+def decode_index(data: bytes) -> list:
+    """
+    Decode the entries of an index chunk encoded by `encode_index()`.
+    """
+    if data[:1] != VERSION:
+        return json.loads(data)
+
+    count, position = _read_varint(data, 1)
+    strings, position = _decode_strings(data, position)
+    field_count, position = _read_varint(data, position)
+    field_numbers, position = _read_column(data, position, field_count)
+    id_deltas, position = _read_column(data, position, count)
+    offsets_layout = data[position]
+    offsets, position = _read_column(data, position + 1, count)
+    lengths, position = _read_column(data, position, count)
+
+    ids = list(itertools.accumulate(id_deltas))
+    if offsets_layout == ASCENDING_OFFSETS:
+        offsets = list(itertools.accumulate(offsets))
+
+    columns = []
+    for _ in range(field_count):
+        codes, position = _read_column(data, position, count)
+        columns.append(codes)
+    values = [_ABSENT, None, None, *strings, *_decode_extras(data, position)]
+
+    metadata = _rows(
+        [strings[number] for number in field_numbers], columns, values, ids, count
+    )
+
+    return list(map(list, zip(ids, offsets, lengths, metadata)))
+
+def encode_frame(secrets: dict, format: str) -> bytes:
+    """
+    Encode the secret fields of a credential stored in a frame.
+    """
+    if format == "json":
+        return json.dumps(secrets).encode("utf-8")
+    _check(format)
+
+    if list(secrets) == ["password"] and type(secrets["password"]) is str:
+        return VERSION + bytes((PASSWORD_FRAME,)) + secrets["password"].encode("utf-8")
+
+    return VERSION + bytes((JSON_FRAME,)) + json.dumps(secrets).encode("utf-8")
+
+def decode_frame(data: bytes) -> dict:
+    """
+    Decode the secret fields encoded by `encode_frame()`.
+    """
+    if data[:1] != VERSION:
+        return json.loads(data)
+
+    if data[1] == PASSWORD_FRAME:
+        return {"password": data[2:].decode("utf-8")}
+
+    return json.loads(data[2:])
+
+def encode_bucket(entries: list, format: str) -> bytes:
+    """
+    Encode a bucket of a field index: [[value, [id, ...]], ...] with the IDs
+    of each value sorted.
+    """
+    if format == "json":
+        return json.dumps(entries).encode("utf-8")
+    _check(format)
+
+    strings, extras = {}, []
+    codes = _codes([value for value, _ in entries], None, strings, extras)
+
+    return b"".join((
+        VERSION,
+        _varint(len(entries)),
+        _encode_strings(strings),
+        _column(_finish(codes, len(strings))),
+        _column([len(ids) for _, ids in entries]),
+        _column([id for _, ids in entries for id in ids]),
+        _encode_extras(extras)
+    ))
+
+def decode_bucket(data: bytes) -> list:
+    """
+    Decode a bucket of a field index encoded by `encode_bucket()`.
+    """
+    if data[:1] != VERSION:
+        return json.loads(data)
+
+    count, position = _read_varint(data, 1)
+    strings, position = _decode_strings(data, position)
+    codes, position = _read_column(data, position, count)
+    counts, position = _read_column(data, position, count)
+    ids, position = _read_column(data, position, sum(counts))
+    values = [_ABSENT, None, None, *strings, *_decode_extras(data, position)]
+
+    remaining = iter(ids)
+    return [
+        [value, [next(remaining)] if id_count == 1 else list(itertools.islice(remaining, id_count))]
+        for value, id_count in zip(_lookup(values, codes), counts)
+    ]
+
+def _check(format: str) -> None:
+    if format not in FORMATS:
+        raise ValueError(f"Unknown record format: {format!r}.")
+
+def _codes(values: list, ids: list | None, strings: dict, extras: list) -> list:
+    """
+    Return the value code of each value, adding strings to the string
+    dictionary and other values to `extras`. Codes of extras are negative
+    until `_finish()` knows how many strings there are.
+    """
+    codes = []
+    for position, value in enumerate(values):
+        if value is _ABSENT:
+            codes.append(ABSENT)
+        elif value is None:
+            codes.append(NULL)
+        elif type(value) is str:
+            codes.append(FIRST_STRING + strings.setdefault(value, len(strings)))
+        elif ids is not None and type(value) is int and value == ids[position]:
+            codes.append(SAME_ID)
+        else:
+            extras.append(value)
+            codes.append(-len(extras))
+
+    return codes
+
+def _finish(codes: list, string_count: int) -> list:
+    extras_start = FIRST_STRING + string_count - 1
+    return [code if code >= 0 else extras_start - code for code in codes]
+
+def _rows(fields: list, columns: list, values: list, ids: list, count: int) -> list:
+    """
+    Return the dicts holding the value of each field of each entry, given
+    the column of value codes of each field.
+    """
+    if not fields:
+        return [{} for _ in range(count)]
+
+    decoded = []
+    absent = False
+    for codes in columns:
+        if codes.count(SAME_ID) == count:
+            column = ids
+        else:
+            column = _lookup(values, codes)
+            if SAME_ID in codes:
+                column = [
+                    id if code == SAME_ID else value
+                    for code, id, value in zip(codes, ids, column)
+                ]
+        absent = absent or ABSENT in codes
+        decoded.append(column)
+
+    if absent:
+        return [
+            {field: value for field, value in zip(fields, row) if value is not _ABSENT}
+            for row in zip(*decoded)
+        ]
+
+    if fields == CREDENTIAL_FIELDS:
+        return [
+            {"service": service, "username": username, "email": email, "id": id}
+            for service, username, email, id in zip(*decoded)
+        ]
+
+    return [dict(zip(fields, row)) for row in zip(*decoded)]
+
+def _lookup(values: list, codes: list):
+    """
+    Return the values with the given codes.
+    """
+    if len(codes) > 1:
+        return operator.itemgetter(*codes)(values)
+
+    return [values[code] for code in codes]
+
+def _column(values: list) -> bytes:
+    """
+    Encode non-negative integers as a column of the narrowest width that
+    fits them.
+    """
+    largest = max(values, default=0)
+    width = next(width for width in (1, 2, 4, 8) if largest < 1 << (8 * width))
+    column = array.array(_TYPECODES[width], values)
+    if _BIG_ENDIAN:
+        column.byteswap()
+
+    return bytes((width,)) + column.tobytes()
+
+def _read_column(data: bytes, position: int, count: int) -> tuple[list, int]:
+    width = data[position]
+    end = position + 1 + count * width
+    column = array.array(_TYPECODES[width])
+    column.frombytes(data[position + 1:end])
+    if _BIG_ENDIAN:
+        column.byteswap()
+
+    return column.tolist(), end
+
+def _encode_strings(strings: dict) -> bytes:
+    """
+    Encode the strings of a string dictionary, in the order of their numbers.
+    """
+    if not strings:
+        return _varint(0)
+
+    if any("\0" in string for string in strings):
+        encoding, blob = 1, json.dumps(list(strings)).encode("utf-8")
+    else:
+        encoding, blob = 0, "\0".join(strings).encode("utf-8")
+
+    return _varint(len(strings)) + bytes((encoding,)) + _varint(len(blob)) + blob
+
+def _decode_strings(data: bytes, position: int) -> tuple[list, int]:
+    count, position = _read_varint(data, position)
+    if not count:
+        return [], position
+
+    encoding = data[position]
+    length, position = _read_varint(data, position + 1)
+    blob = data[position:position + length]
+    if encoding == 1:
+        strings = json.loads(blob)
+    else:
+        strings = blob.decode("utf-8").split("\0")
+
+    return strings, position + length
+
+def _encode_extras(extras: list) -> bytes:
+    if not extras:
+        return _varint(0)
+
+    blob = json.dumps(extras).encode("utf-8")
+    return _varint(len(blob)) + blob
+
+def _decode_extras(data: bytes, position: int) -> list:
+    length, position = _read_varint(data, position)
+    if not length:
+        return []
+
+    return json.loads(data[position:position + length])
+
+def _varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+
+    return bytes(encoded)
+
+def _read_varint(data: bytes, position: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
@@ -5,4 +5,34 @@ MASTER_PASSWORD = None	# Will contain the master password provided by the user.
 #DATA_DIR = pathlib.Path("/mnt/data/keystash/test_data") # Only for testing to avoid modifying data from an existing keystash installation.
 DATA_DIR = pathlib.Path().home() / ".local/share/keystash"
 VAULT = DATA_DIR / "vault"
-HASH = DATA_DIR / "hash"
+HASH = DATA_DIR / "hash"	# bcrypt hash of the master password, from before the vault checked it. Removed on first unlock.
+LOCK = DATA_DIR / "lock"
+
+# Key derivation (see `crypto_utils`).
+SCRYPT_N = 2 ** 16	# CPU and memory cost. Each derivation uses 128 * SCRYPT_R * SCRYPT_N bytes (64 MiB).
+SCRYPT_R = 8	# Block size.
+SCRYPT_P = 1	# Parallelism.
+PBKDF2_ITERATIONS = 390000	# Only for vaults from before scrypt was used.
+
+# KDF calibration (see `src.features.calibrate`).
+CALIBRATION_TIME = 0.25	# Seconds deriving the key should take by default.
+CALIBRATION_MEMORY = 64	# MiB deriving the key may use by default.
+
+# Derived key cache (see `crypto_utils.generate_key`).
+KEY_CACHE_SIZE = 8	# Maximum number of derived keys kept in memory.
+KEY_CACHE_TIMEOUT = 15 * 60	# Seconds a cached key may stay unused before it is dropped.
+
+# Vault container (see `container`).
+CRYPTO_THREADS = 0	# Threads encrypting and decrypting the parts of the vault. 0 for one per CPU, 1 for none.
+
+# Journal of changes to the vault (see `storage`).
+JOURNAL = DATA_DIR / "journal"
+JOURNAL_COMPACTION_SIZE = 1024 * 1024	# Bytes. The vault is compacted once the journal grows past this.
+RECORD_FORMAT = "binary"	# Format of the records of new vaults, "json" or "binary" (see `codec`).
+
+# Agent (see `src.features.agent`).
+AGENT_SOCKET_VARIABLE = "KEYSTASH_AGENT_SOCK"	# Environment variable holding the path of the agent's socket.
+AGENT_IDLE_TIMEOUT = 15 * 60	# Seconds without a request after which the agent locks itself.
+
+# Tracing (see `profiling`).
+TRACE_VARIABLE = "KEYSTASH_TRACE"	# Environment variable turning tracing on, with its options.
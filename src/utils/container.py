@@ -0,0 +1,522 @@
+"""
+Framed vault container.
+
+The body of the vault file (everything after the header, see `storage`)
+stores the secret fields (`SECRET_FIELDS`) of every credential in its own
+encrypted frame, followed by an encrypted index mapping credential IDs to
+frame offsets. The index also holds the rest of each credential (service,
+username, email, ID...), so listing and searching credentials never
+decrypts a password:
+
+    <frames and index chunks>
+    <directory>
+    <trailer>
+
+    frame:        <4-byte length><sealed secret fields>
+    index chunk:  <4-byte length><sealed [[id, offset, length, metadata], ...]>
+    field bucket: <4-byte length><sealed [[value, [id, ...]], ...]>
+    directory:    <4-byte length><sealed {
+                      "version": DIRECTORY_VERSION,
+                      "chunks": [[first id, last id, offset, length], ...],
+                      "fields": {field: [[offset, length], ...], ...}
+                  }>
+    trailer:      <8-byte directory offset>TRAILER_MAGIC
+
+Index chunks hold up to `INDEX_CHUNK_SIZE` entries sorted by ID, and the
+directory lists the ID range covered by each chunk, in ID order. Looking up
+a credential decrypts the directory, one chunk and one frame, no matter how
+many credentials the vault holds.
+
+The container also keeps a hash index on each of `helpers.INDEXED_FIELDS`,
+mapping every value of the field to the sorted IDs of the credentials
+holding it. The values of a field are spread over buckets of about
+`FIELD_BUCKET_SIZE` values by a hash of the value, so looking up a value
+decrypts one bucket (see `lookup()`).
+
+Credentials are read as `model.Credential` objects, and written from any
+mapping. They are read and written as streams: reading holds a few index
+chunks and their credentials in memory at a time (see below) and yields
+credentials in ID order, and writing encrypts credentials as they arrive.
+As long as the credentials arrive sorted by ID (as they do when they come
+from a container), index chunks are written as soon as they fill up. Only
+the field indexes, one entry per credential, are held in memory until the
+end of the write.
+
+Frames, index chunks and field buckets are encoded in the record format
+given to `write()`, JSON or binary (see `codec`); reading works with
+either. The directory is always JSON.
+
+Every sealed part is authenticated with the associated data of the vault
+and its role in the container, so parts can't be moved around: frames
+with their credential ID, index chunks with the ID range the directory
+gives them, and field buckets with their field and number. The directory,
+itself authenticated with the vault header, thus fixes the order and
+contents of every part. Index chunks of containers written before
+`DIRECTORY_VERSION` 2 (directories without a version) aren't bound to
+their ID range.
+
+Parts are sealed and unsealed in a thread pool of `constants.CRYPTO_THREADS`
+threads, as AES-GCM runs without holding the GIL: reading decrypts and
+decodes each index chunk with its frames in a thread, and writing encrypts
+the frames of `INDEX_CHUNK_SIZE` credentials at a time. Results are
+consumed in order, at most a few tasks per thread ahead, so streaming
+still holds a bounded number of credentials in memory. Parts are read
+with `os.pread()`, which doesn't move the file position, so threads can
+share the file. With one thread (or one CPU), everything runs in the
+calling thread.
+
+A container is written once and never modified; changes to the vault are
+kept in a journal until the vault is rewritten (see `journal`).
+
+Offsets are relative to the start of the file, and all functions expect a
+file opened in binary mode ("rb" for reading, "w+b" for writing).
+"""
+from src.utils import codec, constants, helpers, model, profiling
+import bisect, collections, concurrent.futures, hashlib, itertools, json, os
+
+crypto_utils = helpers.lazy_import("src.utils.crypto_utils")
+
+TRAILER_MAGIC = b"KSTRAILR"
+TRAILER_SIZE = 8 + len(TRAILER_MAGIC)
+INDEX_CHUNK_SIZE = 256
+FIELD_BUCKET_SIZE = 256
+DIRECTORY_VERSION = 2	# 2: index chunks are bound to their ID range.
+LOOKAHEAD = 2	# Tasks per thread submitted ahead of the one being consumed.
+
+# Credential fields stored in frames. All other fields are metadata.
+SECRET_FIELDS = ("password",)
+
+_pool = None	# Thread pool sealing and unsealing parts, created on first use.
+_pool_workers = 0
+
+@profiling.traced
+def write(file, body_offset: int, credentials, data_key: bytes, associated_data: bytes, format: str = "json") -> None:
+    """
+    Write the given credentials (any iterable) as a new container starting
+    at `body_offset`, with records in the given format (see `codec`).
+    Anything already in the file after `body_offset` is discarded.
+    """
+    file.seek(body_offset)
+    file.truncate()
+
+    chunks = []
+    pending = []	# Index entries not written to a chunk yet.
+    fields = {field: {} for field in helpers.INDEXED_FIELDS}
+    ascending = True
+    last_id = None
+
+    credentials = iter(credentials)
+    batches = iter(lambda: list(itertools.islice(credentials, INDEX_CHUNK_SIZE)), [])
+    sealed_batches = _map(
+        lambda batch: _seal_frames(batch, data_key, associated_data, format), batches
+    )
+
+    for batch in sealed_batches:
+        for credential, metadata, sealed in batch:
+            id = credential["id"]
+            offset, length = _append(file, sealed)
+            pending.append([id, offset, length, metadata])
+            for field, values in fields.items():
+                values.setdefault(credential.get(field), []).append(id)
+
+            if last_id is not None and id <= last_id:
+                ascending = False
+            last_id = id
+
+            if ascending and len(pending) == INDEX_CHUNK_SIZE:
+                chunks.append(_write_chunk(file, pending, data_key, associated_data, format))
+                pending = []
+
+    if not ascending:
+        # Chunks written early may overlap with the pending entries, so
+        # reindex everything.
+        file.flush()
+        for chunk in chunks:
+            pending.extend(_read_chunk(file, chunk, DIRECTORY_VERSION, data_key, associated_data))
+
+        pending.sort(key=lambda entry: entry[0])
+        chunks = []
+        for values in fields.values():
+            for ids in values.values():
+                ids.sort()
+
+    sealed_chunks = _map(
+        lambda entries: (entries, _seal_chunk(entries, data_key, associated_data, format)),
+        (pending[start:start + INDEX_CHUNK_SIZE] for start in range(0, len(pending), INDEX_CHUNK_SIZE))
+    )
+    for entries, sealed in sealed_chunks:
+        chunks.append(_append_chunk(file, entries, sealed))
+
+    _write_directory(
+        file,
+        {
+            "version": DIRECTORY_VERSION,
+            "chunks": chunks,
+            "fields": {
+                field: _write_field_index(
+                    file, field, values, data_key, associated_data, format
+                )
+                for field, values in fields.items()
+            }
+        },
+        data_key, associated_data
+    )
+
+def iter_credentials(file, data_key: bytes, associated_data: bytes):
+    """
+    Yield every credential in the container, in ID order.
+    """
+    directory = _read_directory(file, data_key, associated_data)
+    version = directory.get("version", 1)
+
+    for credentials in _map(
+        lambda chunk: _read_chunk_credentials(file, chunk, version, data_key, associated_data),
+        directory["chunks"]
+    ):
+        yield from credentials
+
+def iter_metadata(file, data_key: bytes, associated_data: bytes):
+    """
+    Yield every credential in the container without its secret
+    fields, in ID order. Only the index is decrypted.
+    """
+    directory = _read_directory(file, data_key, associated_data)
+    version = directory.get("version", 1)
+
+    for entries in _map(
+        lambda chunk: _read_chunk(file, chunk, version, data_key, associated_data),
+        directory["chunks"]
+    ):
+        for entry in entries:
+            yield model.Credential(entry[3])
+
+@profiling.traced
+def find(file, id: int, data_key: bytes, associated_data: bytes) -> model.Credential | None:
+    """
+    Return the credential with the given ID, or None if it doesn't exist.
+    """
+    directory = _read_directory(file, data_key, associated_data)
+    location = _locate(file, directory, id, data_key, associated_data)
+    if location is None:
+        return None
+
+    _, entries, position = location
+    _, offset, length, metadata = entries[position]
+
+    return model.Credential(
+        {**metadata, **_read_frame(file, id, offset, length, data_key, associated_data)}
+    )
+
+@profiling.traced
+def lookup(file, field: str, value, data_key: bytes, associated_data: bytes) -> list | None:
+    """
+    Return the sorted IDs of the credentials whose `field` is `value`.
+
+    Return None if the field isn't indexed, as in containers written before
+    the field indexes existed.
+    """
+    buckets = _read_directory(file, data_key, associated_data).get("fields", {}).get(field)
+    if buckets is None:
+        return None
+
+    number = _bucket(value, len(buckets))
+    offset, length = buckets[number]
+    entries = codec.decode_bucket(crypto_utils.unseal(
+        data_key, _pread(file, offset + 4, length),
+        _field_associated_data(associated_data, field, number)
+    ))
+
+    for entry_value, ids in entries:
+        if entry_value == value:
+            return ids
+
+    return []
+
+def iter_metadata_of(file, ids: list, data_key: bytes, associated_data: bytes):
+    """
+    Yield the credentials with the given IDs (sorted) without their secret
+    fields, in ID order. IDs not in the container are skipped. Only the
+    index chunks holding the IDs are decrypted.
+    """
+    directory = _read_directory(file, data_key, associated_data)
+    chunks, version = directory["chunks"], directory.get("version", 1)
+    firsts = [chunk[0] for chunk in chunks]
+    current, entries, entry_ids = None, [], []
+
+    for id in ids:
+        chunk_position = bisect.bisect_right(firsts, id) - 1
+        if chunk_position < 0 or id > chunks[chunk_position][1]:
+            continue
+
+        if chunk_position != current:
+            current = chunk_position
+            entries = _read_chunk(file, chunks[chunk_position], version, data_key, associated_data)
+            entry_ids = [entry[0] for entry in entries]
+
+        position = bisect.bisect_left(entry_ids, id)
+        if position < len(entries) and entry_ids[position] == id:
+            yield model.Credential(entries[position][3])
+
+@profiling.traced
+def last_id(file, data_key: bytes, associated_data: bytes) -> int | None:
+    """
+    Return the largest credential ID in the container, or None if it's
+    empty. Only the directory is decrypted.
+    """
+    chunks = _read_directory(file, data_key, associated_data)["chunks"]
+    return chunks[-1][1] if chunks else None
+
+def _locate(file, directory: dict, id: int, data_key: bytes, associated_data: bytes) -> tuple | None:
+    """
+    Find the index entry of the credential with the given ID.
+
+    Return (chunk position in the directory, chunk entries, entry position
+    in the chunk), or None if there is no such credential.
+    """
+    chunks = directory["chunks"]
+    chunk_position = bisect.bisect_right([chunk[0] for chunk in chunks], id) - 1
+    if chunk_position < 0 or id > chunks[chunk_position][1]:
+        return None
+
+    entries = _read_chunk(
+        file, chunks[chunk_position], directory.get("version", 1), data_key, associated_data
+    )
+    position = bisect.bisect_left([entry[0] for entry in entries], id)
+    if position == len(entries) or entries[position][0] != id:
+        return None
+
+    return chunk_position, entries, position
+
+def _read_chunk_credentials(file, chunk: list, version: int, data_key: bytes, associated_data: bytes) -> list:
+    """
+    Return the credentials of an index chunk, with the secret fields of
+    their frames.
+    """
+    entries = _read_chunk(file, chunk, version, data_key, associated_data)
+
+    return [
+        model.Credential({**metadata, **codec.decode_frame(crypto_utils.unseal(
+            data_key, sealed, _frame_associated_data(associated_data, id)
+        ))})
+        for (id, _, _, metadata), sealed in zip(entries, _read_frames(file, entries))
+    ]
+
+def _read_frames(file, entries: list) -> list:
+    """
+    Return the sealed frames of the given index entries. Frames written one
+    after the other, as they usually are, are read in one call.
+    """
+    if not entries:
+        return []
+
+    start = entries[0][1]
+    end = start
+    for _, offset, length, _ in entries:
+        if offset != end:
+            return [_pread(file, offset + 4, length) for _, offset, length, _ in entries]
+        end = offset + 4 + length
+
+    data = _pread(file, start, end - start)
+    return [
+        data[offset - start + 4:offset - start + 4 + length]
+        for _, offset, length, _ in entries
+    ]
+
+def _read_frame(file, id: int, offset: int, length: int, data_key: bytes, associated_data: bytes) -> dict:
+    """
+    Return the secret fields stored in a frame.
+    """
+    return codec.decode_frame(crypto_utils.unseal(
+        data_key, _pread(file, offset + 4, length), _frame_associated_data(associated_data, id)
+    ))
+
+def _seal_frames(credentials: list, data_key: bytes, associated_data: bytes, format: str) -> list:
+    """
+    Split each credential into its metadata and its sealed frame.
+    Return [(credential, metadata, sealed frame), ...].
+    """
+    sealed_frames = []
+    for credential in credentials:
+        metadata, secrets = {}, {}
+        for key, value in credential.items():
+            (secrets if key in SECRET_FIELDS else metadata)[key] = value
+
+        sealed_frames.append((credential, metadata, crypto_utils.seal(
+            data_key,
+            codec.encode_frame(secrets, format),
+            _frame_associated_data(associated_data, credential["id"])
+        )))
+
+    return sealed_frames
+
+def _write_chunk(file, entries: list, data_key: bytes, associated_data: bytes, format: str) -> list:
+    """
+    Append an index chunk and return its directory entry.
+    """
+    return _append_chunk(file, entries, _seal_chunk(entries, data_key, associated_data, format))
+
+def _seal_chunk(entries: list, data_key: bytes, associated_data: bytes, format: str) -> bytes:
+    return crypto_utils.seal(
+        data_key,
+        codec.encode_index(entries, format),
+        _index_associated_data(associated_data, entries[0][0], entries[-1][0], DIRECTORY_VERSION)
+    )
+
+def _append_chunk(file, entries: list, sealed: bytes) -> list:
+    offset, length = _append(file, sealed)
+    return [entries[0][0], entries[-1][0], offset, length]
+
+def _read_chunk(file, chunk: list, version: int, data_key: bytes, associated_data: bytes) -> list:
+    """
+    Return the entries of an index chunk listed by a directory of the given
+    version.
+    """
+    first, last, offset, length = chunk
+
+    return codec.decode_index(crypto_utils.unseal(
+        data_key, _pread(file, offset + 4, length),
+        _index_associated_data(associated_data, first, last, version)
+    ))
+
+def _write_field_index(file, field: str, values: dict, data_key: bytes, associated_data: bytes, format: str) -> list:
+    """
+    Append the buckets of the hash index on a field, given a dict mapping
+    each value to its IDs. Return the directory entry of the field.
+    """
+    count = max(1, -(-len(values) // FIELD_BUCKET_SIZE))
+    buckets = [[] for _ in range(count)]
+    for value, ids in values.items():
+        buckets[_bucket(value, count)].append([value, ids])
+
+    locations = []
+    for number, entries in enumerate(buckets):
+        sealed = crypto_utils.seal(
+            data_key,
+            codec.encode_bucket(entries, format),
+            _field_associated_data(associated_data, field, number)
+        )
+        locations.append(list(_append(file, sealed)))
+
+    return locations
+
+def _bucket(value, count: int) -> int:
+    """
+    Return the bucket of a field value. The hash is stable across runs,
+    unlike `hash()`.
+    """
+    digest = hashlib.blake2b(json.dumps(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+def _write_directory(file, directory: dict, data_key: bytes, associated_data: bytes) -> None:
+    """
+    Append the directory followed by the trailer pointing to it.
+    """
+    sealed = crypto_utils.seal(
+        data_key,
+        json.dumps(directory).encode("utf-8"),
+        associated_data + b"directory"
+    )
+    offset, _ = _append(file, sealed)
+    file.write(offset.to_bytes(8, "big") + TRAILER_MAGIC)
+
+def _read_directory(file, data_key: bytes, associated_data: bytes) -> dict:
+    offset, length = _read_trailer(file)
+
+    return json.loads(crypto_utils.unseal(
+        data_key, _pread(file, offset + 4, length), associated_data + b"directory"
+    ))
+
+def _read_trailer(file) -> tuple[int, int]:
+    """
+    Return the offset and length of the directory.
+    """
+    file.seek(-TRAILER_SIZE, 2)
+    trailer = file.read(TRAILER_SIZE)
+    if trailer[8:] != TRAILER_MAGIC:
+        raise ValueError("The vault is damaged: trailer not found.")
+
+    offset = int.from_bytes(trailer[:8], "big")
+    length = int.from_bytes(_pread(file, offset, 4), "big")
+
+    return offset, length
+
+def _pread(file, offset: int, length: int) -> bytes:
+    """
+    Read `length` bytes at `offset` without moving the file position, so
+    threads can read the file at the same time.
+    """
+    return os.pread(file.fileno(), length, offset)
+
+def _append(file, data: bytes) -> tuple[int, int]:
+    """
+    Write a length-prefixed part at the end of the file.
+    Return the offset of the part and the length of the data.
+    """
+    file.seek(0, 2)
+    offset = file.tell()
+    file.write(len(data).to_bytes(4, "big") + data)
+
+    return offset, len(data)
+
+def _frame_associated_data(associated_data: bytes, id: int) -> bytes:
+    return associated_data + b"frame" + str(id).encode("utf-8")
+
+def _index_associated_data(associated_data: bytes, first: int, last: int, version: int) -> bytes:
+    if version < 2:
+        return associated_data + b"index"
+
+    return associated_data + b"index" + f"{first}-{last}".encode("utf-8")
+
+def _field_associated_data(associated_data: bytes, field: str, number: int) -> bytes:
+    return associated_data + b"field" + f"{field}:{number}".encode("utf-8")
+
+def _map(function, items):
+    """
+    Yield `function(item)` for each item, in order.
+
+    With more than one thread (see `constants.CRYPTO_THREADS`), the calls
+    run in the thread pool, at most `LOOKAHEAD` per thread ahead of the
+    result being consumed. Calls not started when the generator is closed
+    are cancelled, and running ones are waited for, so none outlives the
+    file it reads.
+    """
+    workers = constants.CRYPTO_THREADS or os.cpu_count() or 1
+    if workers == 1:
+        yield from map(function, items)
+        return
+
+    pool = _thread_pool(workers)
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(function, item))
+            if len(pending) > LOOKAHEAD * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        concurrent.futures.wait(pending)
+
+def _thread_pool(workers: int) -> concurrent.futures.ThreadPoolExecutor:
+    global _pool, _pool_workers
+
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="keystash-crypto")
+        _pool_workers = workers
+
+    return _pool
+
+def _forget_thread_pool() -> None:
+    """
+    Forget the thread pool in a forked child (the agent), which has none of
+    its threads.
+    """
+    global _pool, _pool_workers
+    _pool, _pool_workers = None, 0
+
+os.register_at_fork(after_in_child=_forget_thread_pool)
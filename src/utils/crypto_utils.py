@@ -5,31 +5,99 @@ This module provides cryptographic utilities for secure data handling.
 It implements password-based key derivation and symmetric encryption
 using the Python `cryptography` library.
 
+Vaults use envelope encryption: a random data key encrypts the vault
+contents, and a key derived from the master password encrypts ("wraps")
+the data key. Once the data key is unwrapped, writing the vault costs only
+symmetric encryption.
+
 Functions:
-    generate_key(master_password: bytes, salt: bytes) -> bytes
-        Derives a Fernet-compatible key from a master password and salt.
+    generate_key(salt: bytes, kdf: dict | None) -> bytes
+        Derives a Fernet-compatible key from the master password and salt.
+        Derived keys are cached for the session (see below).
+
+    default_kdf() -> dict
+        Returns the KDF parameters new vaults use.
+
+    header_kdf(header: dict) -> dict
+        Returns the KDF parameters stored in a vault or archive header.
+
+    derive(kdf: dict, password: bytes, salt: bytes) -> bytes
+        Runs a KDF from `KDFS` without the key cache. Used to time KDFs.
+
+    clear_key_cache() -> None
+        Overwrites and drops every cached key.
+
+    generate_data_key() -> bytes
+        Returns a new random 256-bit data key.
+
+    wrap_key(data_key: bytes, salt: bytes, kdf: dict | None) -> bytes
+        Encrypts a data key with the key derived from the master password.
+
+    unwrap_key(wrapped_key: bytes, salt: bytes, kdf: dict | None) -> bytes
+        Reverses `wrap_key()`. Since the wrapped key is authenticated, this
+        is also how the master password is checked.
+
+    seal(data_key: bytes, contents: bytes, associated_data: bytes) -> bytes
+        Encrypts data with AES-GCM under a fresh random nonce.
+
+    unseal(data_key: bytes, sealed_contents: bytes, associated_data: bytes) -> bytes
+        Reverses `seal()`.
 
-    encrypt(contents: bytes, master_password: str | bytes) -> tuple[bytes, bytes]
-        Encrypts data using a key derived from a master password and returns
-        both the salt and the encrypted ciphertext.
+    decrypt(encrypted_contents: bytes, salt: bytes) -> bytes
+        Decrypts ciphertext written by the original (pre envelope
+        encryption) vault format and returns the data.
 
-    decrypt(encrypted_contents: bytes, master_password: str | bytes, salt: bytes) -> bytes
-        Decrypts ciphertext using the provided master password and salt and
-        returns the data.
+Key derivation:
+    The KDF and its parameters are stored with the salt, as a dict naming
+    one of the KDFs in `KDFS`:
+
+        {"name": "scrypt", "n": 65536, "r": 8, "p": 1}
+        {"name": "argon2id", "memory": 65536, "iterations": 3, "lanes": 1}
+        {"name": "pbkdf2-sha256", "iterations": 390000}
+
+    scrypt and Argon2id are memory-hard: every guess of the master password
+    costs memory (`128 * r * n` bytes, or `memory` KiB) as well as time.
+    New vaults use scrypt (see `default_kdf()`); `keystash calibrate` picks
+    parameters for the machine. Vaults written before scrypt was used
+    derive their key with PBKDF2. Argon2id needs a build of `cryptography`
+    whose OpenSSL supports it.
+
+Key cache:
+    Key derivation is deliberately slow, so keys derived by `generate_key`
+    are kept in a small in-process cache keyed by the salt and the KDF
+    parameters.
+    The cache holds at most `constants.KEY_CACHE_SIZE` keys, drops keys left
+    unused for `constants.KEY_CACHE_TIMEOUT` seconds, and is reset whenever
+    `constants.MASTER_PASSWORD` changes. Evicted keys are overwritten with
+    zeros before they are released.
 """
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
-from cryptography.fernet import Fernet
-from src.utils import constants
-import pathlib, base64, os
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.fernet import Fernet, InvalidToken
+from src.utils import constants, profiling
+import pathlib, base64, os, collections, hashlib, time
+
+# KDF name -> function deriving a 32-byte key from (password, salt, KDF parameters).
+KDFS = {}
+
+# (salt, KDF parameters) -> [bytearray(key), last used]
+_key_cache = collections.OrderedDict()
+# Keyed digest of the master password the cached keys were derived from.
+_key_cache_owner = None
+_key_cache_secret = os.urandom(32)
 
+@profiling.traced
 def decrypt(encrypted_contents: bytes, salt: bytes) -> bytes:
     """
     Decrypt data using a key derived from the master password and salt.
 
-    This function reverses the encryption performed by `encrypt()` by
-    regenerating the same Fernet key and decrypting the ciphertext.
+    Only vaults written before envelope encryption was introduced store
+    data encrypted directly with the password-derived key. This function
+    is used to read and upgrade them.
 
     Parameters:
         encrypted_contents (bytes): The ciphertext to decrypt.
@@ -38,51 +106,237 @@ def decrypt(encrypted_contents: bytes, salt: bytes) -> bytes:
     Returns:
         bytes: The decrypted plaintext data.
     """
-    key = generate_key(salt)
+    key = generate_key(
+        salt, {"name": "pbkdf2-sha256", "iterations": constants.PBKDF2_ITERATIONS}
+    )
     return Fernet(key).decrypt(encrypted_contents)
 
-def encrypt(contents: bytes) -> tuple[bytes, bytes]:
+def generate_data_key() -> bytes:
     """
-    Encrypt data using a key derived from the master password.
+    Return a new random 256-bit key for use with `seal()` and `unseal()`.
+    """
+    return AESGCM.generate_key(bit_length=256)
 
-    The function generates a random salt, derives a Fernet-compatible key
-    from the salt and the master password, and encrypts the given data.
-    The salt is returned alongside the ciphertext.
+@profiling.traced
+def wrap_key(data_key: bytes, salt: bytes, kdf: dict | None = None) -> bytes:
+    """
+    Encrypt a data key with the key derived from the master password.
 
     Parameters:
+        data_key (bytes): The key to wrap.
+        salt (bytes): The salt used for key derivation.
+        kdf (dict | None): KDF parameters. Defaults to `default_kdf()`.
+
+    Returns:
+        bytes: The wrapped key, a Fernet token.
+    """
+    key = generate_key(salt, kdf)
+    return Fernet(key).encrypt(data_key)
+
+@profiling.traced
+def unwrap_key(wrapped_key: bytes, salt: bytes, kdf: dict | None = None) -> bytes:
+    """
+    Decrypt a data key wrapped by `wrap_key()`.
+
+    Raises `InvalidToken` (`cryptography.fernet.InvalidToken`) if the
+    master password is wrong.
+    """
+    key = generate_key(salt, kdf)
+    return Fernet(key).decrypt(wrapped_key)
+
+def seal(data_key: bytes, contents: bytes, associated_data: bytes) -> bytes:
+    """
+    Encrypt and authenticate data with AES-GCM.
+
+    A fresh random nonce is generated for every call and returned in front
+    of the ciphertext.
+
+    Parameters:
+        data_key (bytes): A key returned by `generate_data_key()`.
         contents (bytes): The plaintext data to encrypt.
+        associated_data (bytes): Data that isn't encrypted but must not be
+            tampered with. The same value must be passed to `unseal()`.
 
     Returns:
-        tuple[bytes, bytes]: A tuple containing the salt and the encrypted data `(salt, encrypted_data)`.
+        bytes: `nonce + ciphertext`.
     """
-    salt = os.urandom(16)
-    key = generate_key(salt)
-    encrypted_contents = Fernet(key).encrypt(contents)
+    nonce = os.urandom(12)
+    return nonce + AESGCM(data_key).encrypt(nonce, contents, associated_data)
 
-    return salt, encrypted_contents
+def unseal(data_key: bytes, sealed_contents: bytes, associated_data: bytes) -> bytes:
+    """
+    Decrypt data encrypted by `seal()`.
 
-def generate_key(salt: bytes) -> bytes:
+    Raises `cryptography.exceptions.InvalidTag` if the data or the associated
+    data were modified.
+    """
+    nonce, ciphertext = sealed_contents[:12], sealed_contents[12:]
+    return AESGCM(data_key).decrypt(nonce, ciphertext, associated_data)
+
+def generate_key(salt: bytes, kdf: dict | None = None) -> bytes:
     """
     Derive a cryptographic key from the master password and salt.
 
-    This function uses the PBKDF2-HMAC key derivation function with SHA-256
-    to derive a 32-byte key from the master password and salt.
+    This function derives a 32-byte key from the master password and salt
+    with the given KDF (see "Key derivation" above). The result is cached,
+    so deriving the key for the same salt again during the session doesn't
+    rerun the KDF.
 
     Parameters:
         salt (bytes): A cryptographically secure random salt.
+        kdf (dict | None): KDF parameters. Defaults to `default_kdf()`.
 
     Returns:
         bytes: A URL-safe, Base64-encoded key for use with Fernet.
     """
-    key = PBKDF2HMAC(
+    if kdf is None:
+        kdf = default_kdf()
+
+    _prune_key_cache()
+
+    cache_key = (bytes(salt), tuple(sorted(kdf.items())))
+    entry = _key_cache.get(cache_key)
+    if entry is not None:
+        entry[1] = time.monotonic()
+        _key_cache.move_to_end(cache_key)
+        return bytes(entry[0])
+
+    key = _derive_key(salt, kdf)
+
+    _key_cache[cache_key] = [bytearray(key), time.monotonic()]
+    while len(_key_cache) > constants.KEY_CACHE_SIZE:
+        _, (evicted, _) = _key_cache.popitem(last=False)
+        _wipe(evicted)
+
+    return key
+
+def default_kdf() -> dict:
+    """
+    Return the parameters of the KDF new vaults and archives use: scrypt
+    with `constants.SCRYPT_N`, `constants.SCRYPT_R` and `constants.SCRYPT_P`.
+    """
+    return {
+        "name": "scrypt",
+        "n": constants.SCRYPT_N,
+        "r": constants.SCRYPT_R,
+        "p": constants.SCRYPT_P
+    }
+
+def header_kdf(header: dict) -> dict:
+    """
+    Return the KDF parameters in a vault or archive header. Headers written
+    before scrypt was used only hold the PBKDF2 "iterations".
+    """
+    if "kdf" in header:
+        return header["kdf"]
+
+    return {"name": "pbkdf2-sha256", "iterations": header["iterations"]}
+
+def clear_key_cache() -> None:
+    """
+    Overwrite and drop every key in the derived key cache.
+    """
+    global _key_cache_owner
+
+    while _key_cache:
+        _, (key, _) = _key_cache.popitem()
+        _wipe(key)
+
+    _key_cache_owner = None
+
+def derive(kdf: dict, password: bytes, salt: bytes) -> bytes:
+    """
+    Derive a 32-byte key from a password and salt with the KDF described by
+    `kdf`, bypassing the key cache.
+
+    Raises ValueError if the KDF isn't in `KDFS`, and
+    `cryptography.exceptions.UnsupportedAlgorithm` if `cryptography` can't
+    run it.
+    """
+    try:
+        function = KDFS[kdf["name"]]
+    except KeyError:
+        raise ValueError(f"Unknown KDF: {kdf['name']!r}.")
+
+    return function(password, salt, kdf)
+
+def _register(name: str):
+    """
+    Return a decorator adding a key derivation function to `KDFS`.
+    """
+    def register(function):
+        KDFS[name] = function
+        return function
+
+    return register
+
+@_register("pbkdf2-sha256")
+def _pbkdf2(password: bytes, salt: bytes, kdf: dict) -> bytes:
+    return PBKDF2HMAC(
         algorithm=hashes.SHA256(),
         length=32,
         salt=salt,
-        iterations=390000,
+        iterations=kdf["iterations"],
+        backend=default_backend()
+    ).derive(password)
+
+@_register("scrypt")
+def _scrypt(password: bytes, salt: bytes, kdf: dict) -> bytes:
+    return Scrypt(
+        salt=salt,
+        length=32,
+        n=kdf["n"],
+        r=kdf["r"],
+        p=kdf["p"],
         backend=default_backend()
-    ).derive(constants.MASTER_PASSWORD.encode("utf-8"))
+    ).derive(password)
+
+@_register("argon2id")
+def _argon2id(password: bytes, salt: bytes, kdf: dict) -> bytes:
+    return Argon2id(
+        salt=salt,
+        length=32,
+        iterations=kdf["iterations"],
+        lanes=kdf["lanes"],
+        memory_cost=kdf["memory"]
+    ).derive(password)
+
+@profiling.traced
+def _derive_key(salt: bytes, kdf: dict) -> bytes:
+    """
+    Run the KDF and return the URL-safe, Base64-encoded key.
+    """
+    key = derive(kdf, constants.MASTER_PASSWORD.encode("utf-8"), salt)
 
     # Make safe for use with Fernet.
     key = base64.urlsafe_b64encode(key)
 
     return key
+
+def _prune_key_cache() -> None:
+    """
+    Drop keys that have been idle for too long, and drop every key if the
+    master password changed since they were derived.
+    """
+    global _key_cache_owner
+
+    owner = hashlib.blake2b(
+        (constants.MASTER_PASSWORD or "").encode("utf-8"),
+        key=_key_cache_secret
+    ).digest()
+    if owner != _key_cache_owner:
+        clear_key_cache()
+        _key_cache_owner = owner
+        return
+
+    deadline = time.monotonic() - constants.KEY_CACHE_TIMEOUT
+    for cache_key, (key, last_used) in list(_key_cache.items()):
+        if last_used < deadline:
+            del _key_cache[cache_key]
+            _wipe(key)
+
+def _wipe(key: bytearray) -> None:
+    """
+    Overwrite key material in place.
+    """
+    key[:] = bytes(len(key))
@@ -1,15 +1,24 @@
+import bisect, importlib.util, sys
+
+# Credential fields with hash indexes (see `build_index()`).
+INDEXED_FIELDS = ("service", "username", "email")
+
 def filter_credentials(
     credentials: list[dict],
     *,
     service: str | None = "any",
     password: str | None = "any",
     username: str | None = "any",
-    email: str | None = "any"
+    email: str | None = "any",
+    index: dict | None = None
 ) -> list[dict]:
     """
     Filter credential records based on explicit matching rules.
 
-    Each record is a dict with keys: 'service', 'password', 'username', and 'email'.
+    Each record is a mapping (a dict or a `model.Credential`) with keys:
+    'service', 'password', 'username', and 'email'.
+    Records read with `storage.read_metadata()` have no 'password' key; they
+    can be filtered as long as the password rule is left as "any".
 
     For each filter field (service, password, username, email), you may provide:
         - An actual value: only credentials with the same value will match.
@@ -27,8 +36,87 @@ def filter_credentials(
             - None
             - "any"
 
+        index:
+            The index of `credentials` returned by `build_index()`. Callers
+            filtering the same list repeatedly should build it once and
+            pass it in; it is built on every call otherwise.
+
     Returns:
         A list of all credentials that satisfy all provided rules.
+
+    The rules on indexed fields (`INDEXED_FIELDS`) are answered by
+    intersecting the posting lists of their values, so only the matching
+    credentials are looked at.
+    """
+    rules = {
+        field: value
+        for field, value in (("service", service), ("username", username), ("email", email))
+        if value != "any"
+    }
+    if not rules:
+        return list(iter_filtered_credentials(credentials, password=password))
+
+    if index is None:
+        index = build_index(credentials)
+    postings = [index[field].get(value, []) for field, value in rules.items()]
+
+    return list(iter_filtered_credentials(
+        (credentials[position] for position in intersect(postings)),
+        password=password
+    ))
+
+def build_index(credentials: list[dict]) -> dict:
+    """
+    Build hash indexes on the indexed fields (`INDEXED_FIELDS`) of the
+    given credentials, for `filter_credentials()`.
+
+    Return a dict mapping each field to a dict mapping each value of the
+    field (None included) to the sorted positions of the credentials
+    holding it.
+    """
+    index = {field: {} for field in INDEXED_FIELDS}
+
+    for position, credential in enumerate(credentials):
+        for field in INDEXED_FIELDS:
+            index[field].setdefault(credential.get(field), []).append(position)
+
+    return index
+
+def intersect(postings: list[list]) -> list:
+    """
+    Return the items found in every one of the given sorted posting
+    lists, in order.
+
+    The smallest list is walked, and each of its items looked up in the
+    other lists by binary search, smallest first, so the cost depends on
+    the smallest list rather than on the largest.
+    """
+    postings = sorted(postings, key=len)
+    smallest, others = postings[0], postings[1:]
+
+    return [
+        item for item in smallest
+        if all(_contains(posting, item) for posting in others)
+    ]
+
+def _contains(posting: list, item) -> bool:
+    position = bisect.bisect_left(posting, item)
+    return position < len(posting) and posting[position] == item
+
+def iter_filtered_credentials(
+    credentials,
+    *,
+    service: str | None = "any",
+    password: str | None = "any",
+    username: str | None = "any",
+    email: str | None = "any"
+):
+    """
+    Return a generator of the credentials that satisfy the given rules.
+
+    Works like `filter_credentials()`, but `credentials` can be any iterable,
+    such as `storage.iter_metadata()`, so the whole vault never has to be
+    held in memory.
     """
     filters = {
         "service": service,
@@ -48,9 +136,34 @@ def filter_credentials(
             for key, value in filters.items()
         )
 
-    return [
+    return (
         cred
         for cred in credentials
         if matches(cred)
-    ]
+    )
+
+def lazy_import(name: str):
+    """
+    Return the module with the given name, loaded the first time one of its
+    attributes is used rather than now.
+
+    Modules loading heavy dependencies (`cryptography`, `bcrypt`...) are
+    imported this way, so commands that don't use them, and `--help`, start
+    without loading them. A module already imported is returned as it is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    # Make the module an attribute of its package, as importing it would.
+    package, _, attribute = name.rpartition(".")
+    if package:
+        setattr(sys.modules[package], attribute, module)
 
+    return module
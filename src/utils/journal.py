@@ -0,0 +1,148 @@
+"""
+Encrypted append-only journal of vault changes.
+
+Adding, updating and removing a credential appends one operation to the
+journal instead of rewriting the vault, and reading the vault replays the
+journal over it (see `storage`). The journal is stored in the following
+binary format:
+
+    JOURNAL_MAGIC<8-byte generation>
+    <4-byte length><sealed operation>
+    ...
+
+Operations are JSON objects:
+
+    {"op": "add", "credential": {...}}
+    {"op": "update", "credential": {...}}
+    {"op": "remove", "id": <credential ID>}
+
+The generation ties the journal to the version of the vault file it applies
+to. The vault's generation is incremented every time the vault is
+rewritten, so a journal left behind by an interrupted compaction is
+ignored. Each operation is authenticated with the vault's associated data,
+the generation and its offset in the journal. An operation left partially
+written by a crash is ignored, and dropped before the next append.
+
+Appending reads only what was appended since this process last appended to
+the journal: the end of the last complete operation is kept (`_ends`), and
+the whole journal is scanned again only if it was replaced.
+"""
+from src.utils import helpers, profiling
+import json, os
+
+crypto_utils = helpers.lazy_import("src.utils.crypto_utils")
+
+JOURNAL_MAGIC = b"KSJOURNAL\n"
+HEADER_SIZE = len(JOURNAL_MAGIC) + 8
+
+# End of the last complete operation of each journal appended to, as
+# {path: (header, inode, end)}.
+_ends = {}
+
+@profiling.traced
+def read(path, generation: int, data_key: bytes, associated_data: bytes) -> list:
+    """
+    Return the operations in the journal, oldest first.
+
+    Return an empty list if the journal doesn't exist or belongs to another
+    generation of the vault.
+    """
+    try:
+        with open(path, "rb") as file:
+            contents = file.read()
+    except FileNotFoundError:
+        return []
+
+    if contents[:HEADER_SIZE] != _header(generation):
+        return []
+
+    return [
+        json.loads(crypto_utils.unseal(
+            data_key,
+            contents[offset + 4:offset + 4 + length],
+            _associated_data(associated_data, generation, offset)
+        ))
+        for offset, length in _scan(contents)
+    ]
+
+def count(path, generation: int) -> int:
+    """
+    Return the number of operations in the journal without decrypting them.
+    """
+    try:
+        with open(path, "rb") as file:
+            contents = file.read()
+    except FileNotFoundError:
+        return 0
+
+    if contents[:HEADER_SIZE] != _header(generation):
+        return 0
+
+    return len(_scan(contents))
+
+@profiling.traced
+def append(path, generation: int, operation: dict, data_key: bytes, associated_data: bytes) -> int:
+    """
+    Append an operation to the journal and flush it to disk.
+
+    The journal is started over if it doesn't exist or belongs to another
+    generation of the vault. Return the size of the journal.
+
+    A new journal is only readable by the user, like the vault.
+    """
+    header = _header(generation)
+
+    with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), "r+b") as file:
+        status = os.fstat(file.fileno())
+        if file.read(HEADER_SIZE) == header:
+            start = HEADER_SIZE
+            cached = _ends.get(path)
+            if cached and cached[:2] == (header, status.st_ino) and cached[2] <= status.st_size:
+                start = cached[2]
+
+            file.seek(start)
+            records = _scan(file.read(), 0)
+            end = start + (records[-1][0] + 4 + records[-1][1] if records else 0)
+        else:
+            file.seek(0)
+            file.write(header)
+            end = HEADER_SIZE
+
+        # Drop anything after the last complete operation.
+        file.seek(end)
+        file.truncate()
+
+        sealed = crypto_utils.seal(
+            data_key,
+            # Credentials may be `model.Credential` objects.
+            json.dumps(operation, default=dict).encode("utf-8"),
+            _associated_data(associated_data, generation, end)
+        )
+        file.write(len(sealed).to_bytes(4, "big") + sealed)
+        file.flush()
+        os.fsync(file.fileno())
+
+        _ends[path] = (header, status.st_ino, file.tell())
+        return file.tell()
+
+def _scan(contents: bytes, offset: int = HEADER_SIZE) -> list:
+    """
+    Return the (offset, length) of every complete operation in the journal,
+    starting at `offset` in `contents`.
+    """
+    records = []
+    while offset + 4 <= len(contents):
+        length = int.from_bytes(contents[offset:offset + 4], "big")
+        if offset + 4 + length > len(contents):
+            break
+
+        records.append((offset, length))
+        offset += 4 + length
+
+    return records
+
+def _header(generation: int) -> bytes:
+    return JOURNAL_MAGIC + generation.to_bytes(8, "big")
+
+def _associated_data(associated_data: bytes, generation: int, offset: int) -> bytes:
+    return associated_data + b"journal" + _header(generation) + offset.to_bytes(8, "big")
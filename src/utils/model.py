@@ -0,0 +1,102 @@
+"""
+The credential record.
+
+Credentials read from the vault are `Credential` objects rather than
+dicts. A `Credential` keeps its fields in slots, about a third of the
+memory of a dict with the same keys, and its service, username and email
+are interned, so the credentials sharing a service or an email share one
+string. This matters to the session cache and the agent, which hold the
+whole vault in memory.
+
+A `Credential` is a read-only mapping with the keys of the dict it
+replaces, so code reading credentials works with both: `credential["id"]`,
+`credential.get("email")`, `credential.items()`, `{**credential, "email":
+None}`. Fields are also attributes (`credential.service`), which is faster.
+A field the credential doesn't have, such as the password of credentials
+read by `storage.iter_metadata()`, isn't in the mapping, and its attribute
+is `ABSENT`. Fields other than `FIELDS` are kept in a dict of their own.
+
+Credentials compare equal to dicts with the same items. JSON can't encode
+them, so they are converted with `dict(credential)` first, or encoded with
+`json.dumps(..., default=dict)`.
+"""
+import collections.abc, sys
+
+FIELDS = ("service", "username", "email", "id", "password")
+INTERNED_FIELDS = ("service", "username", "email")
+
+ABSENT = object()	# Attribute of the fields a credential doesn't have.
+
+_FIELD_SET = frozenset(FIELDS)
+
+class Credential(collections.abc.Mapping):
+    """
+    A credential: a read-only mapping of its fields (see above).
+    """
+    __slots__ = (*FIELDS, "_extra")
+
+    def __init__(self, fields: collections.abc.Mapping):
+        get = fields.get
+        self.service = _intern(get("service", ABSENT))
+        self.username = _intern(get("username", ABSENT))
+        self.email = _intern(get("email", ABSENT))
+        self.id = get("id", ABSENT)
+        self.password = get("password", ABSENT)
+        self._extra = None
+        if not fields.keys() <= _FIELD_SET:
+            self._extra = {
+                key: value for key, value in fields.items() if key not in _FIELD_SET
+            }
+
+    @classmethod
+    def of(cls, fields: collections.abc.Mapping) -> "Credential":
+        """
+        Return `fields` if it is a Credential, or a Credential holding them.
+        """
+        return fields if type(fields) is cls else cls(fields)
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is not ABSENT:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            return default if value is ABSENT else value
+
+        return default if self._extra is None else self._extra.get(key, default)
+
+    def __contains__(self, key) -> bool:
+        if key in _FIELD_SET:
+            return getattr(self, key) is not ABSENT
+
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for field in FIELDS:
+            if getattr(self, field) is not ABSENT:
+                yield field
+
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, collections.abc.Mapping):
+            return NotImplemented
+
+        return dict(self) == dict(other)
+
+    def __repr__(self) -> str:
+        return f"Credential({dict(self)!r})"
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
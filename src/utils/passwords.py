@@ -0,0 +1,211 @@
+"""
+Random passwords and passphrases.
+
+Passwords are drawn from character classes (`CLASSES`), with a minimum
+number of characters from each class. Every password meeting the policy
+is equally likely, and no password is ever drawn again because it misses
+a minimum. Instead, the number of characters of each class is drawn first,
+weighted by how many passwords have that many (counted once per policy),
+then the characters of each class, then their order:
+
+    passwords with counts k1..kn = L! / (k1! ... kn!) * size1^k1 ... sizen^kn
+
+Passphrases are words drawn from a word list, such as the EFF large word
+list used with dice ("diceware").
+
+Random numbers are taken from random bytes read `RANDOM_BATCH` at a time
+from the operating system (`os.urandom`, like `secrets`), and are unbiased:
+a number below N is the low bits of a few bytes, drawn again in the rare
+case they give N or more.
+"""
+import bisect, math, os, string
+
+# Character classes and their characters.
+CLASSES = {
+    "lower": string.ascii_lowercase,
+    "upper": string.ascii_uppercase,
+    "digits": string.digits,
+    "symbols": "!@#$%^&*()-_=+[]{};:,.?/"
+}
+AMBIGUOUS = "0O1Il|"	# Characters easily mistaken for one another.
+RANDOM_BATCH = 4096	# Bytes of randomness read from the operating system at once.
+
+class Policy:
+    """
+    The passwords to generate: `length` characters from `classes` (names of
+    `CLASSES`), with at least `minimums[name]` characters of each class,
+    none of them in `exclude`.
+
+    Raise ValueError if no password meets the policy.
+    """
+    def __init__(self, length: int = 16, classes=tuple(CLASSES), minimums: dict | None = None, exclude: str = ""):
+        if length < 1:
+            raise ValueError("Passwords need at least one character.")
+        minimums = minimums or {}
+        for name in (*classes, *minimums):
+            if name not in CLASSES:
+                raise ValueError(f"Unknown character class: {name!r}.")
+        for name in minimums:
+            if name not in classes:
+                raise ValueError(f"Minimum given for a class not used: {name!r}.")
+
+        self.length = length
+        self.alphabets = [
+            "".join(char for char in CLASSES[name] if char not in exclude)
+            for name in classes
+        ]
+        self.minimums = [minimums.get(name, 0) for name in classes]
+        self.count = self._count()
+        if not self.count:
+            raise ValueError("No password meets the policy.")
+
+    def _count(self) -> int:
+        """
+        Count the passwords meeting the policy, and keep, for each class and
+        number of characters left, the cumulative number of passwords by
+        number of characters of that class (see `_class_counts()`).
+        """
+        # counts[i][left]: ways to fill `left` characters with classes i and
+        # later, meeting their minimums (as sequences of class choices
+        # weighted by the characters of each class).
+        counts = [[0] * (self.length + 1) for _ in range(len(self.alphabets) + 1)]
+        counts[-1][0] = 1
+        self._cumulative = [[None] * (self.length + 1) for _ in self.alphabets]
+
+        for position in range(len(self.alphabets) - 1, -1, -1):
+            size, minimum = len(self.alphabets[position]), self.minimums[position]
+            for left in range(self.length + 1):
+                cumulative, total = [], 0
+                for taken in range(minimum, left + 1):
+                    total += math.comb(left, taken) * size ** taken * counts[position + 1][left - taken]
+                    cumulative.append(total)
+                counts[position][left] = total
+                self._cumulative[position][left] = cumulative
+
+        return counts[0][self.length]
+
+    def entropy(self) -> float:
+        """
+        Return the entropy of a password, in bits.
+        """
+        return math.log2(self.count)
+
+    def _class_counts(self, random: "RandomSource") -> list:
+        """
+        Draw the number of characters of each class, each set of counts as
+        likely as the passwords having it.
+        """
+        counts, left = [], self.length
+        for position, minimum in enumerate(self.minimums):
+            cumulative = self._cumulative[position][left]
+            taken = minimum + bisect.bisect_right(cumulative, random.below(cumulative[-1]))
+            counts.append(taken)
+            left -= taken
+
+        return counts
+
+class RandomSource:
+    """
+    Unbiased random numbers from random bytes read in batches.
+    """
+    def __init__(self, batch: int = RANDOM_BATCH):
+        self._batch = batch
+        self._buffer = b""
+        self._position = 0
+
+    def read(self, size: int) -> bytes:
+        """
+        Return `size` random bytes.
+        """
+        if self._position + size > len(self._buffer):
+            self._buffer = self._buffer[self._position:] + os.urandom(max(self._batch, size))
+            self._position = 0
+
+        data = self._buffer[self._position:self._position + size]
+        self._position += size
+        return data
+
+    def below(self, limit: int) -> int:
+        """
+        Return a random integer from 0 to `limit` - 1.
+        """
+        bits = (limit - 1).bit_length()
+        size, mask = (bits + 7) // 8, (1 << bits) - 1
+        while True:
+            value = int.from_bytes(self.read(size), "little") & mask
+            if value < limit:
+                return value
+
+    def indices(self, limit: int, count: int) -> list:
+        """
+        Return `count` random integers from 0 to `limit` - 1 (at most 256),
+        one byte each.
+        """
+        if limit == 1:
+            return [0] * count
+
+        mask = (1 << (limit - 1).bit_length()) - 1
+        indices = []
+        while len(indices) < count:
+            needed = count - len(indices)
+            # Ask for enough bytes that few are missing after dropping those
+            # out of range.
+            data = self.read(needed * (mask + 1) // limit + 1)
+            indices.extend(byte & mask for byte in data if byte & mask < limit)
+
+        return indices[:count]
+
+    def shuffle(self, items: list) -> None:
+        """
+        Shuffle `items` in place, every order equally likely.
+
+        One number below len(items)! is drawn, and its digits in the
+        factorial number system give the swaps of a Fisher-Yates shuffle.
+        """
+        number = self.below(math.factorial(len(items)))
+        for last in range(len(items) - 1, 0, -1):
+            number, other = divmod(number, last + 1)
+            items[last], items[other] = items[other], items[last]
+
+def generate_passwords(count: int, policy: Policy, random: RandomSource | None = None):
+    """
+    Yield `count` random passwords meeting `policy`.
+    """
+    random = random or RandomSource()
+
+    for _ in range(count):
+        characters = []
+        for alphabet, taken in zip(policy.alphabets, policy._class_counts(random)):
+            if taken:
+                characters.extend(alphabet[index] for index in random.indices(len(alphabet), taken))
+        random.shuffle(characters)
+
+        yield "".join(characters)
+
+def generate_passphrases(count: int, words: int, wordlist: list, separator: str = "-", random: RandomSource | None = None):
+    """
+    Yield `count` random passphrases of `words` words from `wordlist`
+    (without duplicates, see `read_wordlist()`), joined with `separator`.
+    """
+    if not wordlist:
+        raise ValueError("The word list is empty.")
+    random = random or RandomSource()
+
+    for _ in range(count):
+        yield separator.join(wordlist[random.below(len(wordlist))] for _ in range(words))
+
+def passphrase_entropy(words: int, wordlist: list) -> float:
+    """
+    Return the entropy of a passphrase, in bits.
+    """
+    return words * math.log2(len(wordlist))
+
+def read_wordlist(path) -> list:
+    """
+    Return the words in a word list file: one word per line, optionally
+    after dice rolls ("16655	clause"), as in the diceware word lists.
+    Duplicate words, which would be drawn more often, are dropped.
+    """
+    with open(path, encoding="utf-8") as file:
+        words = (line.split()[-1] for line in file if line.strip())
+        return list(dict.fromkeys(words))
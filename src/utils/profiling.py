@@ -0,0 +1,207 @@
+"""
+Time the phases of a command.
+
+Phases are marked with spans, either around a block:
+
+    with profiling.span("parse arguments"):
+        ...
+
+or around every call of a function, named after its module and name:
+
+    @profiling.traced
+    def read_vault(): ...
+
+Spans nest, so a phase's time includes the phases it calls. Tracing is
+off unless `start()` is called: `keystash --profile`, or the environment
+variable `constants.TRACE_VARIABLE`. With tracing off, a span costs a
+check of a global, so spans are kept off code run once per credential.
+
+The environment variable holds comma-separated options:
+
+    table           Print the time of each phase, nested. The default.
+    json            Write Chrome trace events instead (chrome://tracing,
+                    Perfetto).
+    file=PATH       Write the table or the trace to PATH instead of stderr.
+    cprofile=PATH   Also profile every function call with cProfile, and
+                    save the stats to PATH (read with `python -m pstats`).
+    tracemalloc=PATH
+                    Also trace memory allocations, save a snapshot to PATH
+                    (read with `tracemalloc.Snapshot.load()`), and show the
+                    peak memory.
+
+For example: KEYSTASH_TRACE=json,file=trace.json keystash get 101
+"""
+import contextlib, functools, json, os, sys, threading, time
+
+_enabled = False
+_options = {}
+_events = []	# (stack of span names, start, duration, thread ID)
+_local = threading.local()
+_started = 0.0
+_profiler = None
+
+OPTIONS = ("file", "cprofile", "tracemalloc")
+FORMATS = ("table", "json")
+
+def start(setting: str) -> None:
+    """
+    Turn tracing on with the options in `setting` (see above).
+
+    Raise ValueError if an option is unknown.
+    """
+    global _enabled, _options, _events, _started, _profiler
+
+    options = {"format": "table"}
+    for option in filter(None, (option.strip() for option in setting.split(","))):
+        key, equals, value = option.partition("=")
+        if not equals and key in FORMATS:
+            options["format"] = key
+        elif not equals and key in ("1", "on", "true", "yes"):
+            continue
+        elif equals and key in OPTIONS and value:
+            options[key] = value
+        else:
+            raise ValueError(f"Unknown trace option: {option!r}.")
+
+    _options = options
+    _events = []
+    _enabled = True
+    _started = time.perf_counter()
+
+    if "tracemalloc" in options:
+        import tracemalloc
+        tracemalloc.start()
+
+    if "cprofile" in options:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def stop() -> None:
+    """
+    Turn tracing off and write the report and dumps asked for by `start()`.
+    Do nothing if tracing is off.
+    """
+    global _enabled, _events, _profiler
+
+    if not _enabled:
+        return
+
+    _enabled = False
+    elapsed = time.perf_counter() - _started
+
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_options["cprofile"])
+        _profiler = None
+
+    peak = None
+    if "tracemalloc" in _options:
+        import tracemalloc
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.take_snapshot().dump(_options["tracemalloc"])
+        tracemalloc.stop()
+
+    if _options["format"] == "json":
+        report = json.dumps(trace_events()) + "\n"
+    else:
+        report = table(elapsed, peak)
+    _events = []
+
+    if "file" in _options:
+        with open(_options["file"], "w", encoding="utf-8") as file:
+            file.write(report)
+    else:
+        sys.stderr.write(report)
+
+def span(name: str):
+    """
+    Return a context manager timing the block it wraps as the phase `name`.
+    """
+    if not _enabled:
+        return _NO_SPAN
+
+    return _span(name)
+
+def traced(function):
+    """
+    Decorate a function to time every call as a phase named after its
+    module and name. Not for generators: only creating them is timed.
+    """
+    name = f"{function.__module__.rpartition('.')[2]}.{function.__name__}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+
+        with _span(name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+def table(elapsed: float, peak: int | None = None) -> str:
+    """
+    Return the recorded phases as a table: one row per nested phase, in
+    the order they first started, with their number of calls, their total
+    time, and their time outside nested phases.
+    """
+    phases = {}
+    for stack, start, duration, _ in sorted(_events, key=lambda event: event[1]):
+        phase = phases.setdefault(stack, [0, 0.0, 0.0])
+        phase[0] += 1
+        phase[1] += duration
+        phase[2] += duration
+
+    for stack, phase in phases.items():
+        parent = phases.get(stack[:-1])
+        if parent is not None:
+            parent[2] -= phase[1]
+
+    width = max([len("Phase"), *(2 * (len(stack) - 1) + len(stack[-1]) for stack in phases)])
+    lines = [f"{'Phase':<{width}}  {'Calls':>7}  {'Total (ms)':>11}  {'Self (ms)':>11}"]
+    for stack, (calls, total, own) in phases.items():
+        name = "  " * (len(stack) - 1) + stack[-1]
+        lines.append(f"{name:<{width}}  {calls:>7}  {total * 1000:>11.2f}  {own * 1000:>11.2f}")
+
+    lines.append(f"Total: {elapsed * 1000:.2f} ms")
+    if peak is not None:
+        lines.append(f"Peak memory traced: {peak / 1024:.1f} KiB")
+
+    return "\n".join(lines) + "\n"
+
+def trace_events() -> dict:
+    """
+    Return the recorded phases as Chrome trace events.
+    """
+    pid = os.getpid()
+    return {
+        "traceEvents": [
+            {
+                "name": stack[-1],
+                "ph": "X",
+                "ts": round((start - _started) * 1e6, 3),
+                "dur": round(duration * 1e6, 3),
+                "pid": pid,
+                "tid": thread
+            }
+            for stack, start, duration, thread in sorted(_events, key=lambda event: event[1])
+        ],
+        "displayTimeUnit": "ms"
+    }
+
+@contextlib.contextmanager
+def _span(name: str):
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+
+    stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _events.append((tuple(stack), start, time.perf_counter() - start, threading.get_ident()))
+        stack.pop()
+
+_NO_SPAN = contextlib.nullcontext()
@@ -1,73 +1,1519 @@
 """
-This module provides functions for reading and writing files with support
-for symmetric encryption and decryption.
+This module provides functions for reading and writing the vault with
+support for symmetric encryption and decryption.
 
-Encrypted data is stored in a text-safe format using Base64 encoding to
-ensure compatibility across different storage systems.
-The file contents are stored as a single Base64-encoded record
-in the following format:
+The vault uses envelope encryption (see `crypto_utils`) and is stored in
+the following binary format:
+
+    VAULT_MAGIC
+    <4-byte big-endian header length><header, padded with spaces>
+    <body>
+
+The header is a JSON object holding everything needed to unlock the vault:
+
+    {
+        "format": <format of the records in the body, "json" or "binary">,
+        "generation": <incremented every time the vault file is rewritten>,
+        "kdf": <parameters of the KDF deriving the key from the password>,
+        "next_id": <lowest ID the next credential added can get>,
+        "salt": <base64(KDF salt)>,
+        "unbound": <header fields not authenticated with the body>,
+        "version": <number of changes made to the vault>,
+        "wrapped_key": <base64(data key wrapped by the password-derived key)>
+    }
+
+The wrapped key is authenticated, so unwrapping it is how the master
+password is checked (see `unlock()`): an unlock runs the KDF once. The KDF
+and its parameters are chosen per vault (see `set_kdf()`) and kept when
+the vault is rewritten. Headers written before scrypt was used hold PBKDF2
+"iterations" instead of "kdf" (see `crypto_utils.header_kdf()`), and are
+rewritten with the default KDF on unlock.
+
+The body is a framed container (see `container`) holding the password of
+each credential in its own frame sealed with the data key, and the other
+fields in a separately sealed index. A single credential can be read
+without decrypting the whole vault, and credentials can be listed without
+decrypting any password. The magic and the header, except the fields
+listed in its "unbound" field, are authenticated along with every part of
+the body and the journal.
+
+The fields wrapping the data key and the version are unbound
+(`UNBOUND_FIELDS`), so the master password can be changed by rewriting
+the header alone: the new header is written to a temporary file followed
+by a copy of the body, which replaces the vault file (see `_rewrap()`).
+`HEADER_SPACE` spare bytes after the header leave room for a longer new
+header. Vaults written before "unbound" existed authenticate the whole
+header, and are sealed again in full the first time their key is
+wrapped again.
+
+The records of the container are encoded in the header's "format" (see
+`codec`): new vaults use `constants.RECORD_FORMAT`. Vaults written before
+the binary format existed have no "format" and stay JSON until converted
+with `set_format()`.
+
+Adding, updating and removing a credential doesn't rewrite the vault file.
+The change is appended to an encrypted journal next to it (see `journal`),
+and reads replay the journal over the vault file. Once the journal grows
+past `constants.JOURNAL_COMPACTION_SIZE`, the vault is compacted in the
+background: the changes are written into a new vault file, which replaces
+the old one with an atomic rename, and the journal is discarded.
+
+Credential IDs are handed out by a monotonic counter starting at
+`FIRST_ID`, so an ID is never reused, even after its credential is
+removed. The next ID is the largest of the header's "next_id", one past
+the last ID in the container's index, and one past every ID in the
+journal, which takes no scan of the vault.
+
+Vaults written by earlier versions are stored as a single text record,
 
     <base64(salt)>:<base64(ciphertext)>
+
+and are upgraded to the current format the first time they are read.
+
+Concurrency:
+    Several keystash processes can use the vault at once. Readers hold a
+    shared `fcntl` lock on `constants.LOCK` while they open the vault file
+    and read the journal, so they never block each other. Writers hold the
+    exclusive lock only to commit: appending to the journal, or renaming a
+    new vault file into place.
+
+    The version of the vault is the version in the header plus the number
+    of operations in the journal, so every change increments it. A new vault
+    file is encrypted before taking the exclusive lock, and only put in
+    place if the version is still the one it was based on. Otherwise the
+    vault is read again, and the changes are merged into it credential by
+    credential (see `sync()`).
+
+Credentials are returned as `model.Credential` objects, read-only
+mappings taking a fraction of the memory of dicts. Functions taking
+credentials accept any mapping.
+
+Session cache:
+    Long running sessions (interactive mode) can call `enable_cache()` to
+    keep the decrypted credentials in memory. The vault is only read again
+    when the inode, modification time, or size of the vault file or the
+    journal changes. With `defer_writes=True`, writes only update the cache
+    until `sync()` is called.
 """
-from src.utils import crypto_utils, constants
-import base64, json, pathlib
+from src.utils import codec, constants, container, journal, helpers, model, profiling
+import base64, contextlib, fcntl, heapq, itertools, json, os, pathlib, tempfile, threading
+
+crypto_utils = helpers.lazy_import("src.utils.crypto_utils")
+
+VAULT_MAGIC = b"KEYSTASH2\n"
+FIRST_ID = 100
+
+# Header fields left out of the associated data of new vault files.
+UNBOUND_FIELDS = ("kdf", "salt", "version", "wrapped_key")
+HEADER_SPACE = 64	# Spare bytes after the header of new vault files.
+COPY_SIZE = 1024 * 1024	# Bytes copied at a time when only the header changes.
+
+# Session cache state (see `enable_cache()`).
+_cache_enabled = False
+_defer_writes = False
+_cached_credentials = None
+_cached_version = None
+_cached_next_id = None
+_cached_indexes = {}	# Indexes of the cached credentials by the function building them (see `read_indexed_metadata()`).
+_cached_stat = None	# (inode, mtime, size) of the vault file and the journal when cached.
+_cache_dirty = False	# True if the cache holds writes not yet saved to the vault file.
+_base = None	# (version, credentials) of the vault the deferred writes were made on.
+
+# Lock mode held by each thread (see `_lock()`).
+_lock_state = threading.local()
+_compaction_thread = None
+
+def exists() -> bool:
+    """
+    Return True if the vault exists, and so the master password is set.
+    """
+    return constants.VAULT.exists()
+
+@profiling.traced
+def unlock() -> bool:
+    """
+    Check `constants.MASTER_PASSWORD` against the vault by unwrapping its
+    data key. Return False if the password is wrong or the vault doesn't
+    exist.
+
+    This runs the KDF once, and the derived key is cached (see
+    `crypto_utils.generate_key()`), so reading and writing the vault
+    afterwards doesn't run it again. A vault from before KDF parameters
+    were stored is rewritten with the default KDF.
+    """
+    try:
+        opened = _open_vault()
+    except crypto_utils.InvalidToken:
+        return False
+
+    if opened is None:
+        return False
+
+    file, header, *_ = opened
+    file.close()
+
+    if "kdf" not in header:
+        with _lock(exclusive=True):
+            _rewrap(constants.MASTER_PASSWORD)
+
+    return True
+
+@profiling.traced
+def set_master_password(password: str, progress=None) -> None:
+    """
+    Make `password` the master password, creating an empty vault if there
+    is none. Otherwise `constants.MASTER_PASSWORD` must hold the current
+    master password.
+
+    The data key of the vault stays the same; it is wrapped again with a
+    key derived from the new password with the vault's KDF, and the vault
+    file is replaced once the new one is verified (see `_rewrap()`).
+    `progress`, if given, is called as `progress(done, total)` as the new
+    vault file is written.
+    """
+    with _lock(exclusive=True):
+        if not exists():
+            constants.MASTER_PASSWORD = password
+            _commit([])
+            return
+
+        _rewrap(password, progress=progress)
+
+@profiling.traced
+def kdf() -> dict | None:
+    """
+    Return the parameters of the KDF deriving the vault's key from the
+    master password, or None if the vault doesn't exist.
+    """
+    opened = _open_vault()
+    if opened is None:
+        return None
+
+    file, header, *_ = opened
+    file.close()
+
+    return crypto_utils.header_kdf(header)
+
+@profiling.traced
+def set_kdf(kdf: dict) -> None:
+    """
+    Derive the vault's key from the master password with the KDF described
+    by `kdf` (see `crypto_utils`) from now on. The data key is kept.
+    """
+    with _lock(exclusive=True):
+        _rewrap(constants.MASTER_PASSWORD, kdf)
+
+@profiling.traced
+def record_format() -> str | None:
+    """
+    Return the format of the records of the vault (see `codec`), or None if
+    the vault doesn't exist.
+    """
+    opened = _open_vault()
+    if opened is None:
+        return None
 
-# Ensure the data directory exists.
-constants.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    file, header, *_ = opened
+    file.close()
 
+    return header.get("format", "json")
+
+@profiling.traced
+def set_format(format: str) -> None:
+    """
+    Rewrite the vault with its records in `format`, "json" or "binary"
+    (see `codec`). The key isn't derived again.
+
+    Raise ValueError if the format is unknown.
+    """
+    if format not in codec.FORMATS:
+        raise ValueError(f"Unknown record format: {format!r}.")
+
+    with _lock(exclusive=True):
+        _rewrite(lambda header, data_key: {"format": format})
+
+def enable_cache(defer_writes: bool = False) -> None:
+    """
+    Keep the decrypted vault in memory between calls to `read_vault()`.
+
+    Parameters:
+        defer_writes:
+            If True, `write_vault()` and the functions changing a single
+            credential only update the cache. The changes are saved to the
+            vault file by `sync()`.
+    """
+    global _cache_enabled, _defer_writes
+
+    _cache_enabled = True
+    _defer_writes = defer_writes
+
+def disable_cache() -> None:
+    """
+    Drop the session cache. Writes deferred since the last `sync()` are lost.
+    """
+    global _cache_enabled, _defer_writes, _cached_credentials, _cached_version
+    global _cached_next_id, _cached_indexes, _cached_stat, _cache_dirty, _base
+
+    _cache_enabled = _defer_writes = _cache_dirty = False
+    _cached_credentials = _cached_version = _cached_next_id = _cached_stat = _base = None
+    _cached_indexes = {}
+
+def cache_state() -> dict:
+    """
+    Return the session cache settings and contents, including writes not
+    yet saved, so that `restore_cache()` can undo the changes made since.
+    """
+    return {
+        "enabled": _cache_enabled,
+        "defer_writes": _defer_writes,
+        # The cache is changed in place, so keep a copy of the list.
+        "credentials": None if _cached_credentials is None else list(_cached_credentials),
+        "version": _cached_version,
+        "next_id": _cached_next_id,
+        "stat": _cached_stat,
+        "dirty": _cache_dirty,
+        "base": _base
+    }
+
+def restore_cache(state: dict) -> None:
+    """
+    Put the session cache back as it was when `cache_state()` returned
+    `state`. Writes deferred since then are lost.
+    """
+    global _cache_enabled, _defer_writes, _cached_credentials, _cached_version
+    global _cached_next_id, _cached_indexes, _cached_stat, _cache_dirty, _base
+
+    _cache_enabled = state["enabled"]
+    _defer_writes = state["defer_writes"]
+    _cached_credentials = None if state["credentials"] is None else list(state["credentials"])
+    _cached_version = state["version"]
+    _cached_next_id = state["next_id"]
+    _cached_stat = state["stat"]
+    _cache_dirty = state["dirty"]
+    _base = state["base"]
+    _cached_indexes = {}
+
+@profiling.traced
+def sync() -> bool:
+    """
+    Save deferred writes to the vault file.
+
+    If another process changed the vault since the cache was read, the
+    deferred changes are merged into the current vault: credentials added,
+    updated or removed in this session are added, updated or removed, and
+    the changes made by the other process are kept. A credential added
+    under an ID that was taken in the meantime gets the next ID.
+
+    Return True if there was anything to save.
+    """
+    global _cache_dirty, _base
+
+    if not _cache_dirty:
+        return False
+
+    credentials, version, next_id = _commit(_cached_credentials, _base, _cached_next_id)
+    _cache_dirty = False
+    _base = None
+    _update_cache(credentials, version, next_id)
+
+    return True
+
+@profiling.traced
 def read_vault() -> list:
     """
     Read, decrypt, and return vault contents. Return an empty list if the vault
     doesn't exist.
 
-    The function expects the vault contents to follow the format produced by
-    `write_vault()`:
+    Vaults in the original `<base64(salt)>:<base64(ciphertext)>` format are
+    rewritten in the current format before returning.
+
+    When the session cache is enabled, the cached credentials are returned
+    unless the vault changed since they were cached.
+    """
+    if _cache_enabled:
+        # Callers modify the list they get, so never hand out the cache itself.
+        return list(_load_cache())
+
+    return _read_vault_file()[0]
+
+@profiling.traced
+def write_vault(contents) -> None:
+    """
+    Encrypt, then write the given contents to the vault file.
+
+    Credentials are encrypted one at a time as they are written, so
+    `contents` can be a generator, for example one built on `iter_vault()`.
+    The new vault is written to a temporary file which then replaces the
+    vault file.
+
+    When the session cache is enabled, the contents are taken to be the
+    cached credentials with some changes made to them, and are merged with
+    changes made by other processes as by `sync()`. The cache is updated as
+    well. If writes are deferred, only the cache is updated.
+
+    Parameters:
+        contents:
+            An iterable optionally containing credential dictionaries.
+    """
+    global _cached_credentials, _cached_indexes, _cache_dirty, _base
+
+    if not _cache_enabled:
+        _commit(contents)
+        return
+
+    contents = list(contents)
+    if _cached_credentials is None:
+        base = None
+    elif _cache_dirty:
+        base = _base
+    else:
+        base = (_cached_version, _cached_credentials)
+
+    if _defer_writes:
+        _cached_credentials = list(map(model.Credential.of, contents))
+        _cached_indexes = {}
+        _cache_dirty = True
+        _base = base
+        return
+
+    contents, version, next_id = _commit(contents, base, _cached_next_id)
+    _cache_dirty = False
+    _base = None
+    _update_cache(contents, version, next_id)
+
+def iter_vault():
+    """
+    Yield every credential in the vault, in ID order.
+
+    Credentials are decrypted one at a time, so memory use doesn't depend
+    on the size of the vault. When the session cache is enabled, the
+    cached credentials are used.
+    """
+    if _cache_enabled:
+        yield from read_vault()
+        return
+
+    opened = _open_vault()
+    if opened is None:
+        return
+
+    file, header, data_key, changes, _ = opened
+    with file:
+        yield from _apply_changes(
+            container.iter_credentials(file, data_key, _associated_data(header)),
+            changes
+        )
+
+def iter_metadata():
+    """
+    Yield every credential in the vault without its secret fields
+    (see `container.SECRET_FIELDS`), in ID order. Only the index of the
+    vault is decrypted, one chunk at a time.
+
+    When the session cache is enabled, the cached credentials are yielded
+    as they are, secret fields included, since they are already in memory.
+    """
+    if _cache_enabled:
+        yield from read_vault()
+        return
+
+    opened = _open_vault()
+    if opened is None:
+        return
+
+    file, header, data_key, changes, _ = opened
+    with file:
+        yield from _iter_metadata(file, header, data_key, changes)
+
+@profiling.traced
+def read_metadata() -> list:
+    """
+    Return every credential in the vault without its secret fields.
+    See `iter_metadata()`.
+    """
+    return list(iter_metadata())
+
+@profiling.traced
+def read_indexed_metadata(build_index) -> tuple[list, object]:
+    """
+    Return every credential in the vault without its secret fields (see
+    `read_metadata()`), and the index `build_index` builds from that list.
+
+    When the session cache is enabled, the index is built once and reused
+    until the vault changes, so repeated searches don't rebuild it.
+    """
+    if not _cache_enabled:
+        credentials = read_metadata()
+        return credentials, build_index(credentials)
+
+    credentials = read_vault()
+    if build_index not in _cached_indexes:
+        _cached_indexes[build_index] = build_index(credentials)
+
+    return credentials, _cached_indexes[build_index]
+
+def search_metadata(
+    *,
+    service: str | None = "any",
+    username: str | None = "any",
+    email: str | None = "any"
+):
+    """
+    Yield the credentials matching the given rules (see
+    `helpers.filter_credentials()`) without their secret fields, in ID
+    order.
+
+    The rules are answered from the hash indexes of the vault (see
+    `container.lookup()`), so only the index chunks holding matching
+    credentials are decrypted. When the session cache is enabled, the
+    cached credentials are filtered with an index built once per load.
+    """
+    rules = {"service": service, "username": username, "email": email}
+
+    if _cache_enabled:
+        credentials, index = read_indexed_metadata(helpers.build_index)
+        yield from helpers.filter_credentials(credentials, **rules, index=index)
+        return
+
+    opened = _open_vault()
+    if opened is None:
+        return
+
+    file, header, data_key, changes, _ = opened
+    associated_data = _associated_data(header)
+    with file:
+        postings = [
+            container.lookup(file, field, value, data_key, associated_data)
+            for field, value in rules.items()
+            if value != "any"
+        ]
+        if not postings or None in postings:
+            # Nothing to look up, or a vault written without field indexes.
+            yield from helpers.iter_filtered_credentials(
+                _iter_metadata(file, header, data_key, changes), **rules
+            )
+            return
+
+        # Credentials changed in the journal are matched separately.
+        ids = [id for id in helpers.intersect(postings) if id not in changes]
+        changed = helpers.filter_credentials(
+            [
+                _strip_secrets(credential)
+                for credential in changes.values() if credential is not None
+            ],
+            **rules
+        )
+
+        yield from heapq.merge(
+            container.iter_metadata_of(file, ids, data_key, associated_data),
+            sorted(changed, key=lambda credential: credential["id"]),
+            key=lambda credential: credential["id"]
+        )
+
+@profiling.traced
+def get_credential(id: int) -> model.Credential | None:
+    """
+    Return the credential with the given ID, or None if it doesn't exist.
+
+    Only the frame holding the credential is decrypted, unless the session
+    cache is enabled, in which case the cache is used.
+    """
+    if _cache_enabled:
+        credentials = _load_cache()
+        position = _position(credentials, id)
+        if position < len(credentials) and credentials[position]["id"] == id:
+            return credentials[position]
+
+        return None
+
+    opened = _open_vault()
+    if opened is None:
+        return None
+
+    file, header, data_key, changes, _ = opened
+    with file:
+        if id in changes:
+            return changes[id]
+
+        return container.find(file, id, data_key, _associated_data(header))
+
+@profiling.traced
+def add_credential(credential: dict) -> int:
+    """
+    Add a credential to the vault. Only the new credential is encrypted and
+    written to disk.
+
+    A credential without an "id" key gets the next ID from the counter
+    (see the module docstring), as does one whose ID is already taken.
+    Return the ID the credential was added under.
+    """
+    operation = _change({"op": "add", "credential": credential})
+    return operation["credential"]["id"]
+
+@profiling.traced
+def add_credentials(credentials) -> range:
+    """
+    Add many credentials with a single vault write. The credentials get
+    consecutive IDs from the counter, replacing any IDs they have.
+
+    The new vault file is written without holding the lock, like
+    `sync()`, and written again if another process changed the vault
+    meanwhile. When writes are deferred, only the cache is updated.
+
+    Return the IDs given to the credentials.
+    """
+    global _cached_credentials, _cached_next_id, _cached_indexes, _cache_dirty, _base
+
+    credentials = list(credentials)
+
+    if _cache_enabled and _defer_writes:
+        cached = read_vault()
+        first = _cached_next_id
+        if not _cache_dirty:
+            _base = (_cached_version, _cached_credentials)
+        _cached_credentials = cached + [
+            model.Credential({**credential, "id": id})
+            for id, credential in enumerate(credentials, first)
+        ]
+        _cached_next_id = first + len(credentials)
+        _cached_indexes = {}
+        _cache_dirty = True
+        return range(first, first + len(credentials))
+
+    while True:
+        opened = _open_vault()
+        if opened is None:
+            _create_vault()
+            continue
+
+        file, header, data_key, changes, version = opened
+        associated_data = _associated_data(header)
+        with file:
+            first = _next_id(header, changes, container.last_id(file, data_key, associated_data))
+            # The new IDs come after every existing ID, so the credentials
+            # still arrive in ID order.
+            contents = itertools.chain(
+                _apply_changes(container.iter_credentials(file, data_key, associated_data), changes),
+                (
+                    {**credential, "id": id}
+                    for id, credential in enumerate(credentials, first)
+                )
+            )
+            temporary = _write_temporary(
+                contents,
+                {
+                    **header,
+                    "generation": header["generation"] + 1,
+                    "next_id": first + len(credentials),
+                    "version": version + 1
+                },
+                data_key
+            )
+
+        with _lock(exclusive=True):
+            if _version() == version:
+                _replace(temporary)
+                return range(first, first + len(credentials))
+
+        temporary.unlink()
+
+@profiling.traced
+def update_credential(credential: dict) -> bool:
+    """
+    Replace the credential with the same ID as the given one.
+
+    Return False if no credential with that ID exists.
+    """
+    return _change({"op": "update", "credential": credential}) is not None
+
+@profiling.traced
+def remove_credential(id: int) -> bool:
+    """
+    Remove the credential with the given ID from the vault.
+
+    Return False if no credential with the given ID exists.
+    """
+    return _change({"op": "remove", "id": id}) is not None
+
+@profiling.traced
+def compact() -> None:
+    """
+    Write the changes in the journal into a new vault file and discard the
+    journal.
+    """
+    while True:
+        opened = _open_vault()
+        if opened is None:
+            return
+
+        file, header, data_key, changes, version = opened
+        with file:
+            if not changes:
+                return
+
+            # Compaction doesn't change the contents, so it keeps the version.
+            associated_data = _associated_data(header)
+            temporary = _write_temporary(
+                _apply_changes(
+                    container.iter_credentials(file, data_key, associated_data),
+                    changes
+                ),
+                {
+                    **header,
+                    "generation": header["generation"] + 1,
+                    "next_id": _next_id(
+                        header, changes, container.last_id(file, data_key, associated_data)
+                    ),
+                    "version": version
+                },
+                data_key
+            )
+
+        with _lock(exclusive=True):
+            if _version() == version:
+                _replace(temporary)
+                return
+
+        # Changes were appended to the journal meanwhile; start over.
+        temporary.unlink()
+
+def _change(operation: dict) -> dict | None:
+    """
+    Apply a journal operation: append it to the journal, or to the session
+    cache if writes are deferred.
+
+    The operation is checked against the vault under the exclusive lock
+    (see `_resolve()`). Return the operation applied, or None if it was
+    rejected.
+    """
+    global _cached_credentials, _cached_version, _cached_stat, _cache_dirty, _base
+
+    if _cache_enabled and _defer_writes:
+        credentials = _load_cache()
+
+        def exists(id):
+            position = _position(credentials, id)
+            return position < len(credentials) and credentials[position]["id"] == id
+
+        operation = _resolve(operation, exists, lambda: _cached_next_id)
+        if operation is None:
+            return None
+
+        if not _cache_dirty:
+            # The base keeps the list it was read as; changes go to a copy.
+            _base = (_cached_version, _cached_credentials)
+            _cached_credentials = list(_cached_credentials)
+
+        _apply_to_cache(operation)
+        _cache_dirty = True
+        return operation
+
+    with _lock(exclusive=True):
+        opened = _open_vault()
+        if opened is None:
+            # The journal needs a vault file to belong to.
+            _create_vault()
+            opened = _open_vault()
+
+        file, header, data_key, changes, version = opened
+        associated_data = _associated_data(header)
+        with file:
+            def exists(id):
+                if id in changes:
+                    return changes[id] is not None
+                return container.find(file, id, data_key, associated_data) is not None
+
+            def next_id():
+                return _next_id(
+                    header, changes, container.last_id(file, data_key, associated_data)
+                )
+
+            operation = _resolve(operation, exists, next_id)
+            if operation is None:
+                return None
+
+            journal_size = journal.append(
+                constants.JOURNAL, header["generation"], operation,
+                data_key, associated_data
+            )
+
+        if _cache_enabled and not _cache_dirty and _cached_version == version:
+            _apply_to_cache(operation)
+            _cached_version = version + 1
+            _cached_stat = _vault_stat()
+
+    if journal_size > constants.JOURNAL_COMPACTION_SIZE:
+        _start_compaction()
+
+    return operation
+
+def _resolve(operation: dict, exists, next_id) -> dict | None:
+    """
+    Check a journal operation against the current contents of the vault.
+
+    `exists` is a function telling whether a credential ID is in use, and
+    `next_id` a function returning the next ID from the counter. An added
+    credential without an ID, or whose ID is in use, gets the next ID.
+    Updating or removing a credential that doesn't exist is rejected.
+
+    Return the operation to apply, or None if it is rejected.
+    """
+    if operation["op"] == "add":
+        credential = operation["credential"]
+        if "id" not in credential or exists(credential["id"]):
+            credential = {**credential, "id": next_id()}
+            return {"op": "add", "credential": credential}
+
+        return operation
+
+    id = operation["id"] if operation["op"] == "remove" else operation["credential"]["id"]
+    return operation if exists(id) else None
+
+def _next_id(header: dict, changes: dict, last_id: int | None) -> int:
+    """
+    Return the next credential ID from the counter, given the changes in
+    the journal and the last ID in the container.
+
+    Vaults written before the counter existed have no "next_id" in their
+    header, and continue after their largest ID.
+    """
+    return max(
+        header.get("next_id", FIRST_ID),
+        FIRST_ID if last_id is None else last_id + 1,
+        max(changes, default=FIRST_ID - 1) + 1
+    )
 
-        <base64(salt)>:<base64(ciphertext)>
+def _diff(base: list, contents: list) -> list:
     """
+    Return the journal operations turning the `base` credentials into
+    `contents`.
+    """
+    base = {credential["id"]: credential for credential in base}
+    operations = []
+    ids = set()
+
+    for credential in contents:
+        ids.add(credential["id"])
+        if credential["id"] not in base:
+            operations.append({"op": "add", "credential": credential})
+        elif base[credential["id"]] != credential:
+            operations.append({"op": "update", "credential": credential})
+
+    operations.extend({"op": "remove", "id": id} for id in base if id not in ids)
+
+    return operations
+
+def _merge(credentials: list, operations: list, next_id: int) -> tuple[list, int]:
+    """
+    Apply journal operations to the given credentials, checking each one
+    against them (see `_resolve()`). Added credentials needing an ID are
+    numbered from `next_id`.
+
+    Return the credentials in ID order and the next ID.
+    """
+    current = {credential["id"]: credential for credential in credentials}
+
+    for operation in operations:
+        operation = _resolve(operation, current.__contains__, lambda: next_id)
+        if operation is None:
+            continue
+
+        if operation["op"] == "remove":
+            del current[operation["id"]]
+        else:
+            id = operation["credential"]["id"]
+            current[id] = operation["credential"]
+            next_id = max(next_id, id + 1)
+
+    return sorted(current.values(), key=lambda credential: credential["id"]), next_id
+
+@profiling.traced
+def _commit(contents, base: tuple | None = None, next_id: int | None = None) -> tuple:
+    """
+    Replace the contents of the vault.
+
+    `base` is the (version, credentials) of the vault the contents were made
+    from. The new vault file is written without holding the lock, and put in
+    place only if the vault is still at that version. Otherwise the changes
+    from `base` to `contents` are merged into the current vault, and the
+    write is tried again.
+
+    Without a `base`, the contents replace whatever is in the vault, and the
+    exclusive lock is held for the whole write so no other change can be
+    lost silently.
+
+    `next_id` is the next ID of the ID counter the contents were made with,
+    if it is ahead of the vault's.
+
+    Return the contents written, and the new version and next ID of the
+    vault.
+    """
+    if base is None:
+        with _lock(exclusive=True):
+            header, data_key, version = _next_header()
+            header["next_id"] = max(header["next_id"], next_id or FIRST_ID)
+            _replace(_write_temporary(contents, header, data_key))
+
+        return contents, version, header["next_id"]
+
+    operations = None
+    base_version = base[0]
+
+    while True:
+        opened = _open_vault()
+        if opened is None:
+            current, version, vault_next_id = [], 0, FIRST_ID
+            header, data_key = _create_header()
+        else:
+            file, header, data_key, changes, version = opened
+            associated_data = _associated_data(header)
+            with file:
+                vault_next_id = _next_id(
+                    header, changes, container.last_id(file, data_key, associated_data)
+                )
+                current = None
+                if version != base_version:
+                    current = list(_apply_changes(
+                        container.iter_credentials(file, data_key, associated_data),
+                        changes
+                    ))
+
+        if version != base_version:
+            # Another process changed the vault: merge our changes into it.
+            if operations is None:
+                operations = _diff(base[1], contents)
+            contents, vault_next_id = _merge(current, operations, vault_next_id)
+            base_version = version
+
+        header = {
+            **header,
+            "generation": header["generation"] + 1,
+            "next_id": max(vault_next_id, next_id or FIRST_ID),
+            "version": version + 1
+        }
+        temporary = _write_temporary(contents, header, data_key)
+
+        with _lock(exclusive=True):
+            if _version() == version:
+                _replace(temporary)
+                return contents, version + 1, header["next_id"]
+
+        temporary.unlink()
+
+def _create_vault() -> None:
+    """
+    Write an empty vault, unless another process wrote one first.
+    """
+    with _lock(exclusive=True):
+        if not constants.VAULT.exists():
+            _commit([])
+
+@profiling.traced
+def _rewrap(password: str, kdf: dict | None = None, progress=None) -> None:
+    """
+    Wrap the vault's data key with a key derived from `password` with a new
+    salt, and make it the master password. The caller must hold the
+    exclusive lock.
+
+    The key is derived with `kdf`, or by default with the KDF of the vault,
+    unless the vault predates stored KDF parameters.
+
+    When the key wrap isn't authenticated with the body, and the new header
+    fits in the space of the current one, the new vault file is the new
+    header followed by a copy of the body: nothing is decrypted, memory use
+    doesn't depend on the size of the vault, and the journal stays valid.
+    Otherwise the vault is sealed again in full (see `_rewrite()`). Either
+    way, the new file is checked to open with the new password before it
+    replaces the vault file, and the vault is left as it was if anything
+    fails or the process is interrupted.
+
+    `progress` is called as `progress(done, total)`, in bytes when the body
+    is copied, in credentials when it is sealed again.
+    """
+    current_password = constants.MASTER_PASSWORD
+
+    def wrap(header, data_key):
+        constants.MASTER_PASSWORD = password
+        return _wrap_data_key(data_key, kdf or header.get("kdf"))
+
     try:
-        contents = constants.VAULT.read_text()
-        salt, encrypted_content = contents.split(":")
-    # Return an empty list if the vault doesn't exist.
+        file, header, data_key, _, _ = _open_vault()
+        with file:
+            if set(UNBOUND_FIELDS) <= set(header.get("unbound", ())):
+                new_header = {
+                    **header, "version": header["version"] + 1, **wrap(header, data_key)
+                }
+                new_header.pop("iterations", None)
+                temporary = _copy_temporary(file, new_header, progress)
+            else:
+                temporary = None
+
+        if temporary is None:
+            # The vault is opened with the current password again.
+            constants.MASTER_PASSWORD = current_password
+            _rewrite(wrap, progress)
+            return
+
+        try:
+            _verify(temporary, data_key)
+        except BaseException:
+            temporary.unlink(missing_ok=True)
+            raise
+
+        # The body and the generation are unchanged, so the journal is kept.
+        os.replace(temporary, constants.VAULT)
+
+    except BaseException:
+        constants.MASTER_PASSWORD = current_password
+        raise
+
+def _rewrite(fields, progress=None) -> None:
+    """
+    Rewrite the vault with the header fields returned by `fields(header,
+    data key)` changed, and the journal folded into the new vault file.
+    The caller must hold the exclusive lock.
+
+    The header is authenticated along with the whole body, so every part
+    of the vault is sealed again. The new vault file is verified before it
+    replaces the vault file. `progress` is called as `progress(done,
+    total)` with the number of credentials written.
+    """
+    file, header, data_key, changes, version = _open_vault()
+    associated_data = _associated_data(header)
+
+    with file:
+        next_id = _next_id(header, changes, container.last_id(file, data_key, associated_data))
+        new_header = {
+            **header,
+            "generation": header["generation"] + 1,
+            "next_id": next_id,
+            "version": version,
+            **fields(header, data_key)
+        }
+        if "kdf" in new_header:
+            # PBKDF2 parameters of vaults from before "kdf" existed.
+            new_header.pop("iterations", None)
+
+        contents = _apply_changes(
+            container.iter_credentials(file, data_key, associated_data), changes
+        )
+        written = 0
+        if progress is not None:
+            total = sum(1 for _ in _iter_metadata(file, header, data_key, changes))
+            contents = _report(contents, progress, total)
+
+        def count(credentials):
+            nonlocal written
+            for written, credential in enumerate(credentials, 1):
+                yield credential
+
+        temporary = _write_temporary(count(contents), new_header, data_key)
+
+    try:
+        _verify(temporary, data_key, written)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+
+    _replace(temporary)
+
+def _report(credentials, progress, total: int):
+    """
+    Yield the given credentials, calling `progress(done, total)` after each.
+    """
+    progress(0, total)
+    for done, credential in enumerate(credentials, 1):
+        yield credential
+        progress(done, total)
+
+def _verify(temporary: pathlib.Path, data_key: bytes, count: int | None = None) -> None:
+    """
+    Check that a new vault file opens with `constants.MASTER_PASSWORD` to
+    `data_key`, and that its body is authenticated with its header. If
+    `count` is given, also check that it holds that many credentials.
+
+    Raise ValueError if it doesn't.
+    """
+    with temporary.open("rb") as file:
+        header = _read_header(file)
+        if _unwrap_data_key(header) != data_key:
+            raise ValueError("The new vault file doesn't hold the vault's key.")
+
+        # Decrypting the directory checks the binding to the header.
+        associated_data = _associated_data(header)
+        container.last_id(file, data_key, associated_data)
+
+        if count is not None:
+            found = sum(1 for _ in container.iter_metadata(file, data_key, associated_data))
+            if found != count:
+                raise ValueError(f"The new vault file holds {found} credentials, not {count}.")
+
+def _start_compaction() -> None:
+    """
+    Run `compact()` in a background thread, unless it's already running.
+
+    The thread isn't a daemon thread, so the program waits for compaction to
+    finish before exiting.
+    """
+    global _compaction_thread
+
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return
+
+    _compaction_thread = threading.Thread(target=compact, name="keystash-compaction")
+    _compaction_thread.start()
+
+def _replay(operations: list) -> dict:
+    """
+    Return the changes made by the given journal operations, as a dict
+    mapping the ID of every changed credential to the credential, or to
+    None if it was removed.
+    """
+    changes = {}
+    for operation in operations:
+        if operation["op"] == "remove":
+            changes[operation["id"]] = None
+        else:
+            credential = model.Credential.of(operation["credential"])
+            changes[credential["id"]] = credential
+
+    return changes
+
+def _apply_changes(credentials, changes: dict):
+    """
+    Return a generator of the given credentials (sorted by ID) with the
+    changes from `_replay()` applied, in ID order.
+    """
+    unchanged = (
+        credential for credential in credentials
+        if credential["id"] not in changes
+    )
+    changed = sorted(
+        (credential for credential in changes.values() if credential is not None),
+        key=lambda credential: credential["id"]
+    )
+
+    return heapq.merge(unchanged, changed, key=lambda credential: credential["id"])
+
+def _iter_metadata(file, header: dict, data_key: bytes, changes: dict):
+    """
+    Yield every credential in the open vault file without its secret
+    fields, with the changes from the journal applied.
+    """
+    yield from _apply_changes(
+        container.iter_metadata(file, data_key, _associated_data(header)),
+        {
+            id: _strip_secrets(credential) if credential is not None else None
+            for id, credential in changes.items()
+        }
+    )
+
+def _strip_secrets(credential) -> model.Credential:
+    return model.Credential({
+        key: value for key, value in credential.items()
+        if key not in container.SECRET_FIELDS
+    })
+
+@contextlib.contextmanager
+def _lock(exclusive: bool = False):
+    """
+    Hold the vault lock: shared for reading, or exclusive for changing the
+    vault.
+
+    The lock is a `fcntl.flock` lock on `constants.LOCK`, so it works across
+    processes as well as threads. A thread already holding the lock keeps
+    it; a shared lock can't be upgraded to an exclusive one.
+    """
+    held = getattr(_lock_state, "mode", None)
+    if held is not None:
+        if exclusive and held != fcntl.LOCK_EX:
+            raise RuntimeError("Can't upgrade a shared vault lock.")
+        yield
+        return
+
+    mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    # Every use of the vault takes the lock first, so the data directory is
+    # created here rather than when the module is imported.
+    constants.LOCK.parent.mkdir(parents=True, exist_ok=True)
+    with constants.LOCK.open("a") as file:
+        # Closing the file releases the lock.
+        fcntl.flock(file.fileno(), mode)
+        _lock_state.mode = mode
+        try:
+            yield
+        finally:
+            _lock_state.mode = None
+
+@profiling.traced
+def _open_vault() -> tuple | None:
+    """
+    Open the vault file, read its header and the journal, and unwrap the
+    data key. Vaults in the original format are upgraded first.
+
+    Return (file, header, data key, changes, version), where changes are
+    the changes in the journal (see `_replay()`). Return None if the vault
+    doesn't exist.
+
+    The open file keeps reading the same vault file even if it is replaced,
+    so the lock is only held until the journal is read.
+    """
+    while True:
+        with _lock():
+            try:
+                file = constants.VAULT.open("rb")
+            except FileNotFoundError:
+                return None
+
+            try:
+                header = _read_header(file)
+                if header is not None:
+                    data_key = _unwrap_data_key(header)
+                    operations = journal.read(
+                        constants.JOURNAL, header["generation"],
+                        data_key, _associated_data(header)
+                    )
+                    return (
+                        file, header, data_key, _replay(operations),
+                        header["version"] + len(operations)
+                    )
+
+            except BaseException:
+                file.close()
+                raise
+
+            file.close()
+
+        _upgrade_legacy_vault()
+
+def _version() -> int:
+    """
+    Return the version of the vault without decrypting anything. The caller
+    must hold the lock.
+    """
+    try:
+        with constants.VAULT.open("rb") as file:
+            header = _read_header(file)
     except FileNotFoundError:
-        return []
-
-    # Convert salt and contents from printable ASCII string to
-    # their original binary form.
-    # `str.encode` changes the string to a bytes object and
-    # `base64.b64decode` changes the bytes object from a printable
-    # bytes string to the original binary.
-    salt = base64.b64decode(
-        salt.encode("utf-8")
+        return 0
+
+    if header is None:
+        return 0
+
+    return header["version"] + journal.count(constants.JOURNAL, header["generation"])
+
+@profiling.traced
+def _read_vault_file() -> tuple[list, int, int]:
+    """
+    Read, decrypt, and return the contents of the vault, its version and
+    the next credential ID.
+    """
+    opened = _open_vault()
+    # Return an empty list if the vault doesn't exist.
+    if opened is None:
+        return [], 0, FIRST_ID
+
+    file, header, data_key, changes, version = opened
+    with file:
+        credentials = list(_apply_changes(
+            container.iter_credentials(file, data_key, _associated_data(header)),
+            changes
+        ))
+
+    last_id = credentials[-1]["id"] if credentials else None
+    return credentials, version, _next_id(header, changes, last_id)
+
+def _next_header() -> tuple[dict, bytes, int]:
+    """
+    Return the header and data key for the next vault file, and its
+    version. The caller must hold the exclusive lock.
+
+    The header of an existing vault is reused, so only the data key is
+    needed; the password-derived key is derived once per session at most.
+    A new header and data key are created when the vault doesn't exist yet.
+    """
+    opened = _open_vault()
+    if opened is None:
+        header, data_key = _create_header()
+        return {**header, "version": 1}, data_key, 1
+
+    file, header, data_key, changes, version = opened
+    with file:
+        next_id = _next_id(
+            header, changes,
+            container.last_id(file, data_key, _associated_data(header))
+        )
+
+    header = {
+        **header,
+        "generation": header["generation"] + 1,
+        "next_id": next_id,
+        "version": version + 1
+    }
+
+    return header, data_key, version + 1
+
+@profiling.traced
+def _write_temporary(contents, header: dict, data_key: bytes) -> pathlib.Path:
+    """
+    Write a new vault file, the header followed by the contents sealed with
+    the data key, next to the vault file. Return its path.
+
+    The header gets the "unbound" fields of new vault files
+    (`UNBOUND_FIELDS`), so the caller's header dict is left as it is.
+    """
+    header = {**header, "unbound": list(UNBOUND_FIELDS)}
+    encoded_header = _encode_header(header)
+
+    def write(file):
+        file.write(VAULT_MAGIC + (len(encoded_header) + HEADER_SPACE).to_bytes(4, "big"))
+        file.write(encoded_header + b" " * HEADER_SPACE)
+        container.write(
+            file, file.tell(), contents, data_key, _associated_data(header),
+            header.get("format", "json")
+        )
+
+    return _temporary(write)
+
+@profiling.traced
+def _copy_temporary(source, header: dict, progress=None) -> pathlib.Path | None:
+    """
+    Write a new vault file, the header followed by a copy of the body of the
+    open vault file `source`, next to the vault file. The new header takes
+    the space of the current one. Return its path, or None if the header
+    doesn't fit.
+    """
+    source.seek(len(VAULT_MAGIC))
+    space = int.from_bytes(source.read(4), "big")
+    body = len(VAULT_MAGIC) + 4 + space
+    encoded_header = _encode_header(header)
+    if len(encoded_header) > space:
+        return None
+
+    total = source.seek(0, 2) - body
+
+    def write(file):
+        file.write(VAULT_MAGIC + space.to_bytes(4, "big") + encoded_header.ljust(space))
+        source.seek(body)
+        done = 0
+        while chunk := source.read(COPY_SIZE):
+            file.write(chunk)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, total)
+
+    return _temporary(write)
+
+def _temporary(write) -> pathlib.Path:
+    """
+    Create a file next to the vault file, fill it with `write(file)`, and
+    flush it to disk. Return its path.
+
+    The file is removed if writing fails.
+    """
+    descriptor, name = tempfile.mkstemp(
+        prefix=constants.VAULT.name + ".", suffix=".tmp", dir=constants.VAULT.parent
     )
-    encrypted_content = base64.b64decode(
-        encrypted_content.encode("utf-8")
+    temporary = pathlib.Path(name)
+
+    try:
+        with open(descriptor, "w+b") as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+
+    return temporary
+
+@profiling.traced
+def _replace(temporary: pathlib.Path) -> None:
+    """
+    Put a new vault file in place of the vault file and discard the journal.
+    The caller must hold the exclusive lock.
+
+    The rename is atomic, so readers see either the old or the new vault.
+    """
+    os.replace(temporary, constants.VAULT)
+    constants.JOURNAL.unlink(missing_ok=True)
+
+def _stat(path: pathlib.Path) -> tuple | None:
+    """
+    Return the (inode, modification time, size) of a file, or None if it
+    doesn't exist.
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def _vault_stat() -> tuple:
+    return _stat(constants.VAULT), _stat(constants.JOURNAL)
+
+def _apply_to_cache(operation: dict) -> None:
+    """
+    Apply a journal operation to the cached credentials. The cache is in
+    ID order, so the credential is found by binary search and changed in
+    place.
+    """
+    global _cached_next_id, _cached_indexes
+
+    if operation["op"] == "remove":
+        id = operation["id"]
+    else:
+        id = operation["credential"]["id"]
+
+    position = _position(_cached_credentials, id)
+    if operation["op"] == "remove":
+        del _cached_credentials[position]
+    elif operation["op"] == "update":
+        _cached_credentials[position] = model.Credential.of(operation["credential"])
+    else:
+        _cached_credentials.insert(position, model.Credential.of(operation["credential"]))
+        _cached_next_id = max(_cached_next_id, id + 1)
+
+    _cached_indexes = {}
+
+@profiling.traced
+def _load_cache() -> list:
+    """
+    Return the cached credentials, reading the vault first if it changed
+    since they were cached. The list returned is the cache itself.
+    """
+    if not _cache_dirty and (
+        _cached_credentials is None or _cached_stat != _vault_stat()
+    ):
+        _update_cache(*_read_vault_file())
+
+    return _cached_credentials
+
+def _position(credentials: list, id: int) -> int:
+    """
+    Return the position of the credential with the given ID in a list
+    sorted by ID, or the position it would be inserted at.
+    """
+    low, high = 0, len(credentials)
+    while low < high:
+        middle = (low + high) // 2
+        if credentials[middle]["id"] < id:
+            low = middle + 1
+        else:
+            high = middle
+
+    return low
+
+def _update_cache(credentials, version: int, next_id: int) -> None:
+    """
+    Cache the given credentials as the current contents of the vault.
+    """
+    global _cached_credentials, _cached_version, _cached_next_id, _cached_indexes, _cached_stat
+
+    _cached_credentials = list(map(model.Credential.of, credentials))
+    _cached_indexes = {}
+    _cached_version = version
+    _cached_next_id = max(
+        [next_id, *(credential["id"] + 1 for credential in _cached_credentials[-1:])]
     )
+    _cached_stat = _vault_stat()
 
-    contents = crypto_utils.decrypt(
-        encrypted_content, salt
-    ).decode("utf-8")
+def _create_header() -> tuple[dict, bytes]:
+    """
+    Create a header for a new vault.
 
-    return json.loads(contents)
+    Return the header and the new (unwrapped) data key.
+    """
+    data_key = crypto_utils.generate_data_key()
+    header = {
+        "format": constants.RECORD_FORMAT,
+        "generation": 0,
+        "next_id": FIRST_ID,
+        "version": 0,
+        **_wrap_data_key(data_key)
+    }
 
-def write_vault(contents: list) -> None:
+    return header, data_key
+
+def _wrap_data_key(data_key: bytes, kdf: dict | None = None) -> dict:
     """
-    Encrypt, then write the given contents to the vault file.
+    Wrap a data key with a key derived from the master password with a new
+    salt and `kdf`, by default `crypto_utils.default_kdf()`. Return the
+    header fields holding it.
+    """
+    salt = os.urandom(16)
+    if kdf is None:
+        kdf = crypto_utils.default_kdf()
+    wrapped_key = crypto_utils.wrap_key(data_key, salt, kdf)
 
-    Parameters:
-        contents:
-            A list optionally containing credential dictionaries.
+    return {
+        "kdf": kdf,
+        "salt": base64.b64encode(salt).decode("utf-8"),
+        "wrapped_key": base64.b64encode(wrapped_key).decode("utf-8")
+    }
+
+def _unwrap_data_key(header: dict) -> bytes:
+    """
+    Return the data key stored in the header.
+    """
+    return crypto_utils.unwrap_key(
+        base64.b64decode(header["wrapped_key"]),
+        base64.b64decode(header["salt"]),
+        crypto_utils.header_kdf(header)
+    )
 
-    Format:
-        <base64(salt)>:<base64(ciphertext)>
+def _read_header(file) -> dict | None:
     """
-    # Encrypt.
-    contents = json.dumps(contents)
-    salt, encrypted_contents = crypto_utils.encrypt(contents.encode("utf-8"))
+    Read the header from the start of the open vault file.
+
+    Return None if the vault is in the original format.
+    """
+    file.seek(0)
+    if file.read(len(VAULT_MAGIC)) != VAULT_MAGIC:
+        return None
+
+    length = int.from_bytes(file.read(4), "big")
+    return json.loads(file.read(length))
+
+def _encode_header(header: dict) -> bytes:
+    return json.dumps(header, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+def _associated_data(header: dict) -> bytes:
+    """
+    Return the associated data authenticating the body and the journal:
+    the magic and the header without its unbound fields.
+    """
+    unbound = header.get("unbound", ())
+    return VAULT_MAGIC + _encode_header(
+        {key: value for key, value in header.items() if key not in unbound}
+    )
+
+@profiling.traced
+def _upgrade_legacy_vault() -> None:
+    """
+    Rewrite a vault in the original format in the current format.
+    """
+    with _lock(exclusive=True):
+        try:
+            contents = constants.VAULT.read_bytes()
+        except FileNotFoundError:
+            return
+
+        if contents.startswith(VAULT_MAGIC):
+            # Another process upgraded it first.
+            return
+
+        salt, encrypted_content = contents.decode("utf-8").split(":")
+
+        # Convert salt and contents from printable ASCII string to
+        # their original binary form.
+        salt = base64.b64decode(salt.encode("utf-8"))
+        encrypted_content = base64.b64decode(encrypted_content.encode("utf-8"))
 
-    # Make salt and encrypted data safe for writing to file.
-    salt = base64.b64encode(salt).decode("utf-8")
-    encrypted_contents = base64.b64encode(encrypted_contents).decode("utf-8")
+        credentials = json.loads(
+            crypto_utils.decrypt(encrypted_content, salt).decode("utf-8")
+        )
 
-    final_content = f"{salt}:{encrypted_contents}"
-    constants.VAULT.write_text(final_content)
+        header, data_key = _create_header()
+        _replace(_write_temporary(credentials, header, data_key))
@@ -0,0 +1,194 @@
+"""
+Trigram index for substring and fuzzy search.
+
+Values are normalised (case folded, with runs of whitespace collapsed) and
+split into trigrams: the three-character substrings of the value padded
+with two spaces in front and one behind, so "git" gives "  g", " gi",
+"git" and "it ". The index maps every trigram to the distinct values of a
+field containing it, and every value to the positions of the credentials
+holding it.
+
+Substring search looks up the trigrams of the query and intersects their
+value sets, smallest first, so only values holding every trigram of the
+query are compared with it. Fuzzy search counts the trigrams each value
+shares with the query, and scores the value by the similarity of the two
+trigram sets:
+
+    shared / (query trigrams + value trigrams - shared)
+
+Only the best `limit` credentials are kept, with a heap, so results are
+never fully sorted.
+"""
+from src.utils import helpers
+import collections, heapq
+
+# Fuzzy matches less similar than this are dropped.
+FUZZY_THRESHOLD = 0.3
+
+def normalise(value: str) -> str:
+    return " ".join(value.casefold().split())
+
+def trigrams(value: str) -> set:
+    """
+    Return the trigrams of a normalised value.
+    """
+    padded = f"  {value} "
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+def build_index(credentials: list[dict]) -> dict:
+    """
+    Build the trigram index of the indexed fields (`helpers.INDEXED_FIELDS`)
+    of the given credentials.
+
+    Return a dict mapping each field to:
+
+        {
+            "values": {value: [position, ...]},
+            "trigrams": {trigram: {value, ...}},
+            "sizes": {value: number of trigrams}
+        }
+
+    where values are normalised. Fields that are None aren't indexed.
+    """
+    index = {
+        field: {"values": {}, "trigrams": collections.defaultdict(set), "sizes": {}}
+        for field in helpers.INDEXED_FIELDS
+    }
+
+    for position, credential in enumerate(credentials):
+        for field in helpers.INDEXED_FIELDS:
+            if credential.get(field) is None:
+                continue
+
+            value = normalise(credential[field])
+            field_index = index[field]
+            if value not in field_index["values"]:
+                field_index["values"][value] = []
+                value_trigrams = trigrams(value)
+                field_index["sizes"][value] = len(value_trigrams)
+                for trigram in value_trigrams:
+                    field_index["trigrams"][trigram].add(value)
+
+            field_index["values"][value].append(position)
+
+    return index
+
+def search(
+    credentials: list[dict],
+    index: dict,
+    *,
+    fuzzy: bool = False,
+    limit: int = 10,
+    service: str | None = "any",
+    username: str | None = "any",
+    email: str | None = "any"
+) -> list[dict]:
+    """
+    Return up to `limit` credentials whose fields contain (or, if `fuzzy`
+    is True, resemble) the given values, closest matches first.
+
+    Matching ignores case. A field left as "any" is ignored; a field set to
+    None matches no credential, since it can't contain anything.
+
+    Each field is scored from 0 to 1: exact matches score 1, values starting
+    with the query score more than values containing it elsewhere, and
+    shorter values score more than longer ones. Fuzzy search also keeps
+    values whose trigram similarity reaches `FUZZY_THRESHOLD`, scored by
+    their similarity. A credential's score is the average score of the
+    fields searched, and credentials with the same score are returned in
+    vault order.
+
+    Parameters:
+        credentials:
+            The credentials the index was built from.
+
+        index:
+            The index returned by `build_index()`.
+    """
+    queries = {
+        field: value
+        for field, value in (("service", service), ("username", username), ("email", email))
+        if value != "any"
+    }
+    if not queries:
+        return credentials[:limit]
+
+    field_scores = {}
+    for field, query in queries.items():
+        if query is None:
+            return []
+
+        field_scores[field] = _score_values(index[field], normalise(query), fuzzy)
+
+    # Look at the credentials holding the fewest matching values first.
+    fields = sorted(field_scores, key=lambda field: len(field_scores[field]))
+    first, others = fields[0], fields[1:]
+
+    def scored():
+        for value, score in field_scores[first].items():
+            for position in index[first]["values"][value]:
+                total = score
+                for field in others:
+                    other_value = credentials[position].get(field)
+                    other_score = (
+                        0 if other_value is None
+                        else field_scores[field].get(normalise(other_value), 0)
+                    )
+                    if not other_score:
+                        break
+                    total += other_score
+                else:
+                    yield total / len(fields), -position
+
+    return [
+        credentials[-position]
+        for _, position in heapq.nlargest(limit, scored())
+    ]
+
+def _score_values(field_index: dict, query: str, fuzzy: bool) -> dict:
+    """
+    Return the score of every value of a field matching the query.
+    """
+    scores = {}
+
+    if len(query) >= 3:
+        # A value holding the query holds all of its inner trigrams.
+        inner = [
+            field_index["trigrams"].get(query[position:position + 3], set())
+            for position in range(len(query) - 2)
+        ]
+        inner.sort(key=len)
+        candidates = set(inner[0]).intersection(*inner[1:])
+    else:
+        candidates = field_index["values"]
+
+    for value in candidates:
+        if query in value:
+            scores[value] = _substring_score(value, query)
+
+    if fuzzy:
+        query_trigrams = trigrams(query)
+        shared = collections.Counter()
+        for trigram in query_trigrams:
+            shared.update(field_index["trigrams"].get(trigram, ()))
+
+        for value, count in shared.items():
+            similarity = count / (len(query_trigrams) + field_index["sizes"][value] - count)
+            if similarity >= FUZZY_THRESHOLD:
+                scores[value] = max(scores.get(value, 0), similarity)
+
+    return scores
+
+def _substring_score(value: str, query: str) -> float:
+    """
+    Score a value containing the query: 1 for an exact match, more than 0.5
+    for a prefix match, and at most 0.5 otherwise.
+    """
+    if value == query:
+        return 1.0
+
+    coverage = len(query) / len(value)
+    if value.startswith(query):
+        return 0.5 + 0.5 * coverage
+
+    return 0.5 * coverage
@@ -0,0 +1,30 @@
+# Fixtures shared by all tests.
+from src.utils import constants, crypto_utils
+import pytest
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, mocker):
+    """
+    Keep every test away from the real data directory.
+    Return the temporary data directory used instead.
+    """
+    mocker.patch.object(constants, "DATA_DIR", tmp_path)
+    mocker.patch.object(constants, "VAULT", tmp_path / "vault")
+    mocker.patch.object(constants, "HASH", tmp_path / "hash")
+    mocker.patch.object(constants, "JOURNAL", tmp_path / "journal")
+    mocker.patch.object(constants, "LOCK", tmp_path / "lock")
+
+    return tmp_path
+
+@pytest.fixture
+def unlocked(mocker):
+    """
+    Set a master password and a cheap KDF, and start with an empty key cache.
+    Return the master password.
+    """
+    mocker.patch.object(constants, "MASTER_PASSWORD", "master_password")
+    mocker.patch.object(constants, "SCRYPT_N", 2 ** 4)
+    mocker.patch.object(constants, "PBKDF2_ITERATIONS", 1000)
+    crypto_utils.clear_key_cache()
+    yield constants.MASTER_PASSWORD
+    crypto_utils.clear_key_cache()
@@ -0,0 +1,77 @@
+# Unit tests for `benchmarks`.
+from benchmarks import synthetic, vault
+from src.utils import constants
+
+class TestSynthetic:
+    """Unit tests for 'synthetic.generate'."""
+    def test_deterministic(self):
+        """Assert that the same arguments generate the same credentials."""
+        first = list(synthetic.generate(100, seed=1))
+
+        assert first == list(synthetic.generate(100, seed=1))
+        assert first != list(synthetic.generate(100, seed=2))
+        assert [credential["id"] for credential in first] == list(range(101, 201))
+
+    def test_field_sizes(self):
+        """Assert that fields get the number of characters asked for."""
+        for credential in synthetic.generate(50, field_sizes={"password": 64, "service": 5}):
+            assert len(credential["password"]) == 64
+            assert len(credential["service"]) == 5
+            if credential["email"] is not None:
+                assert len(credential["email"]) == synthetic.FIELD_SIZES["email"]
+
+class TestVault:
+    """Unit tests for 'benchmarks.vault'."""
+    def test_measure(self):
+        """
+        Assert that every stage is measured, and that keystash is pointed
+        back to its data directory afterwards.
+        """
+        vault_path = constants.VAULT
+        kdf = vault.parse_kdf("pbkdf2-sha256:iterations=1000")
+
+        results = vault.measure(10, kdf, 0, synthetic.FIELD_SIZES, 1, 3)
+
+        assert list(results) == list(vault.STAGES)
+        assert all(result["seconds"] >= 0 and result["peak_bytes"] >= 0 for result in results.values())
+        assert constants.VAULT == vault_path
+        assert not vault_path.exists()
+
+    def test_formats(self):
+        """Assert that the binary format serializes and writes fewer bytes than JSON."""
+        kdf = vault.parse_kdf("pbkdf2-sha256:iterations=1000")
+        format = constants.RECORD_FORMAT
+
+        json_results = vault.measure(300, kdf, 0, synthetic.FIELD_SIZES, 1, 1, "json")
+        binary_results = vault.measure(300, kdf, 0, synthetic.FIELD_SIZES, 1, 1, "binary")
+
+        for stage in ("serialize", "write"):
+            assert binary_results[stage]["bytes"] < json_results[stage]["bytes"]
+        assert constants.RECORD_FORMAT == format
+
+    def test_threads(self):
+        """Assert that the number of threads is set for the scenario only."""
+        kdf = vault.parse_kdf("pbkdf2-sha256:iterations=1000")
+        threads = constants.CRYPTO_THREADS
+
+        results = vault.measure(300, kdf, 0, synthetic.FIELD_SIZES, 1, 1, threads=3)
+
+        assert list(results) == list(vault.STAGES)
+        assert constants.CRYPTO_THREADS == threads
+        assert vault.scenario_name(300, kdf, "binary", 3).endswith(", binary, 3 threads")
+
+    def test_compare(self):
+        """Assert that only growth beyond the tolerance and the noise is reported."""
+        baseline = {"scenarios": {"10 records": {
+            "read": {"seconds": 0.1, "peak_bytes": 1024 ** 2},
+            "get": {"seconds": 0.0001, "peak_bytes": 1024}
+        }}}
+        results = {"scenarios": {"10 records": {
+            "read": {"seconds": 0.15, "peak_bytes": 1024 ** 2},
+            "get": {"seconds": 0.0005, "peak_bytes": 4096}
+        }, "new scenario": {"read": {"seconds": 1, "peak_bytes": 0}}}}
+
+        regressions = vault.compare(results, baseline, 20)
+
+        assert len(regressions) == 1
+        assert regressions[0].startswith("10 records, read: 0.15 s")
@@ -6,29 +6,17 @@ def test_add(mocker):
     """
     Assert that `add.add` adds the new credentials to the vault.
     """
-    vault_contents = [
-        {
-            "service": "service1",
-            "username": "username1",
-            "email": "email1",
-            "password": "password1",
-            "id": 101
-        }
-    ]
     new_credential = {
         "service": "service2",
         "username": "username2",
         "email": "email2",
-        "password": "password2",
-        "id": 102
+        "password": "password2"
     }
-    expected_output = vault_contents[:]
-    expected_output.append(new_credential)
 
-    mocker.patch("src.features.add.get_unique_id", return_value=new_credential["id"])
     mocker.patch("src.features.add.get_password", return_value=new_credential["password"])
-    mocker.patch("src.features.add.storage.read_vault", return_value=vault_contents)
-    write_vault_mock = mocker.patch("src.features.add.storage.write_vault")
+    add_credential_mock = mocker.patch(
+        "src.features.add.storage.add_credential", return_value=102
+    )
 
     add.add(
         new_credential["service"],
@@ -36,7 +24,7 @@ def test_add(mocker):
         new_credential["email"]
     )
 
-    write_vault_mock.assert_called_with(expected_output)
+    add_credential_mock.assert_called_with(new_credential)
 
 def test_generate_password():
     """
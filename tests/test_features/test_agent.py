@@ -0,0 +1,184 @@
+# Unit tests for `src.features.agent`.
+from src.features import agent
+from src.utils import constants, crypto_utils, storage
+from src import main
+import pytest, pathlib, stat, tempfile, threading
+
+CREDENTIALS = [
+    {"service": "github.com", "password": "password1", "username": "octocat", "email": None, "id": 100},
+    {"service": "example.org", "password": "password2", "username": None, "email": "a@b.c", "id": 101}
+]
+
+def parse(*arguments):
+    return main.build_cli().parse_args(arguments)
+
+@pytest.fixture
+def socket_path(monkeypatch):
+    # Socket paths are limited to about 100 bytes, so stay out of tmp_path.
+    with tempfile.TemporaryDirectory(prefix="keystash-") as directory:
+        path = pathlib.Path(directory) / "agent.sock"
+        monkeypatch.setenv(constants.AGENT_SOCKET_VARIABLE, str(path))
+        yield path
+
+@pytest.fixture
+def running_agent(unlocked, socket_path):
+    """Serve the vault from an agent running in a thread."""
+    storage.write_vault(CREDENTIALS)
+    storage.enable_cache()
+    storage.read_vault()
+
+    server = agent.listen(socket_path)
+    thread = threading.Thread(target=agent.serve, args=(server, 30))
+    thread.start()
+    yield thread
+
+    if thread.is_alive():
+        agent.call({"op": "lock"})
+    thread.join()
+    server.server_close()
+    storage.disable_cache()
+
+def test_socket_permissions(running_agent, socket_path):
+    """Assert that only the user can connect to the agent."""
+    assert stat.S_IMODE(socket_path.stat().st_mode) == 0o600
+
+def test_forward(running_agent, mocker, capsys):
+    """Assert that commands run through the agent, with the usual output."""
+    copy_mock = mocker.patch("src.features.agent.pyperclip.copy")
+
+    assert agent.forward(parse("get", "100"))
+    copy_mock.assert_called_once_with("password1")
+
+    assert agent.forward(parse("add", "-s", "gitlab.com", "-p", "password3"))
+    assert agent.forward(parse("update", "101", "-u", "someone"))
+    mocker.patch("builtins.input", return_value="y")
+    assert agent.forward(parse("remove", "100"))
+    assert agent.forward(parse("search", "-m", "substring", "-s", "git"))
+
+    output = capsys.readouterr().out
+    assert "Credential saved successfully!" in output
+    assert "Credential updated successfully!" in output
+    assert "Credential removed successfully." in output
+    assert "Service: gitlab.com" in output and "password3" not in output
+    assert [credential["id"] for credential in storage.read_vault()] == [101, 102]
+    assert storage.get_credential(101)["username"] == "someone"
+
+def test_not_forwarded(running_agent, socket_path, monkeypatch):
+    """
+    Assert that other commands, interactive mode, and shells without the
+    environment variable don't use the agent.
+    """
+    assert not agent.forward(parse("passwd"))
+    assert not agent.forward(parse("-i", "get", "100"))
+
+    monkeypatch.delenv(constants.AGENT_SOCKET_VARIABLE)
+    assert not agent.forward(parse("get", "100"))
+    monkeypatch.setenv(constants.AGENT_SOCKET_VARIABLE, str(socket_path))
+
+def test_no_agent(socket_path, capsys):
+    """Assert that commands run by themselves if the agent is gone."""
+    assert not agent.forward(parse("get", "100"))
+    assert "No agent is listening" in capsys.readouterr().err
+
+def test_concurrent_clients(running_agent):
+    """Assert that concurrent clients are all served."""
+    results = []
+
+    def client():
+        for _ in range(10):
+            results.append(agent.call({"op": "get", "id": 101})["password"])
+
+    clients = [threading.Thread(target=client) for _ in range(8)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    assert results == ["password2"] * 80
+
+def test_errors(running_agent):
+    with pytest.raises(ValueError, match="Unknown operation"):
+        agent.call({"op": "frobnicate"})
+
+def test_unexpected_error(running_agent, mocker, capsys):
+    """
+    Assert that any error running a request is answered, and reported by
+    the client without a traceback.
+    """
+    run = agent._run
+
+    def fail_get(request):
+        if request["op"] == "get":
+            raise OSError("disk full")
+        return run(request)
+
+    mocker.patch("src.features.agent._run", side_effect=fail_get)
+
+    with pytest.raises(ValueError, match="disk full"):
+        agent.call({"op": "get", "id": 100})
+
+    with pytest.raises(SystemExit) as exit_info:
+        agent.forward(parse("get", "100"))
+    assert exit_info.value.code == 1
+    assert "Agent: disk full" in capsys.readouterr().err
+
+def test_locked_between_requests(running_agent, unlocked, mocker, capsys):
+    """Assert that an agent locking itself after the ping is reported."""
+    call = agent.call
+
+    def lock_after_ping(request):
+        result = call(request)
+        if request["op"] == "ping":
+            constants.MASTER_PASSWORD = None
+        return result
+
+    mocker.patch("src.features.agent.call", side_effect=lock_after_ping)
+
+    try:
+        with pytest.raises(SystemExit):
+            agent.forward(parse("get", "100"))
+    finally:
+        constants.MASTER_PASSWORD = unlocked
+    assert "Agent: The agent is locked." in capsys.readouterr().err
+
+def test_invalid_id(running_agent, capsys):
+    """Assert that an invalid ID is reported as such, not as the agent's error."""
+    with pytest.raises(SystemExit) as exit_info:
+        agent.forward(parse("remove", "abc"))
+
+    assert exit_info.value.code == 1
+    assert capsys.readouterr().err == "Invalid ID: 'abc'.\n"
+
+def test_kill_error(running_agent, mocker, capsys):
+    """Assert that an error answered to 'agent -k' is reported without a traceback."""
+    call = agent.call
+    call_mock = mocker.patch("src.features.agent.call", side_effect=ValueError("The agent is locked."))
+
+    with pytest.raises(SystemExit) as exit_info:
+        agent.forward(parse("agent", "-k"))
+    call_mock.side_effect = call	# Let the fixture lock the agent.
+
+    assert exit_info.value.code == 1
+    assert "Agent: The agent is locked." in capsys.readouterr().err
+
+def test_kill(running_agent, capsys):
+    """Assert that 'agent -k' locks the agent, which then exits."""
+    assert agent.forward(parse("agent", "-k"))
+    running_agent.join(timeout=5)
+
+    assert not running_agent.is_alive()
+    assert constants.MASTER_PASSWORD is None
+    assert "Agent locked." in capsys.readouterr().out
+
+def test_idle_lock(unlocked, socket_path, mocker):
+    """Assert that the agent locks itself once idle, forgetting its secrets."""
+    clear_key_cache_spy = mocker.spy(crypto_utils, "clear_key_cache")
+    storage.enable_cache()
+    server = agent.listen(socket_path)
+
+    agent.serve(server, 0.2)
+    server.server_close()
+
+    assert constants.MASTER_PASSWORD is None
+    assert clear_key_cache_spy.called
+    assert not storage._cache_enabled
@@ -0,0 +1,116 @@
+# Unit tests for `src.features.batch`.
+from src.features import batch
+from src.utils import storage
+from src import main
+import pytest, io, json
+
+@pytest.fixture
+def vault(unlocked):
+    storage.write_vault([
+        {"service": "github.com", "password": "password1", "username": "octocat", "email": None, "id": 100},
+        {"service": "example.org", "password": "password2", "username": None, "email": "a@b.c", "id": 101}
+    ])
+    yield
+    storage.disable_cache()
+
+def run(mocker, script: str, all_or_nothing: bool = False):
+    """Run a script from stdin and return its exit status."""
+    mocker.patch("sys.stdin", io.StringIO(script))
+    try:
+        batch.batch("-", main.build_cli(), all_or_nothing)
+    except SystemExit as exit:
+        return exit.code
+    return 0
+
+def test_batch(vault, mocker, capsys):
+    """
+    Assert that every command of a script runs, and that the vault is
+    written once, at the end.
+    """
+    commit_spy = mocker.spy(storage, "_commit")
+    status = run(mocker, """
+        # Provision a service.
+        add -s "gitlab.com" -u octocat -p 'pass word'
+        update 100 -e octocat@github.com
+        remove 101
+        get 102
+        search -u octocat
+    """)
+
+    output = capsys.readouterr().out.splitlines()
+    assert status == 0
+    assert output[:4] == [
+        "Added credential 102.", "Updated credential 100.", "Removed credential 101.", "pass word"
+    ]
+    assert [json.loads(line)["id"] for line in output[4:]] == [100, 102]
+    assert commit_spy.call_count == 1
+
+    storage.disable_cache()
+    assert storage.read_vault() == [
+        {"service": "github.com", "password": "password1", "username": "octocat",
+         "email": "octocat@github.com", "id": 100},
+        {"service": "gitlab.com", "password": "pass word", "username": "octocat",
+         "email": None, "id": 102}
+    ]
+
+def test_failures(vault, mocker, capsys):
+    """
+    Assert that failing lines are reported with their line number, and
+    that the other commands are saved.
+    """
+    status = run(mocker, "remove 999\nadd -s gitlab.com\nfrobnicate\npasswd\nget abc\n")
+
+    errors = capsys.readouterr().err.splitlines()
+    assert status == 1
+    assert errors[0] == "Line 1: No credential with ID 999 found."
+    assert errors[1].startswith("Line 3: ") and "invalid choice" in errors[1]
+    assert errors[2].startswith("Line 4: Only")
+    assert errors[3] == "Line 5: Invalid ID: 'abc'."
+    assert errors[4] == "4 of 5 commands failed."
+
+    storage.disable_cache()
+    gitlab = storage.get_credential(102)
+    assert gitlab["service"] == "gitlab.com" and gitlab["password"]
+
+def test_all_or_nothing(vault, mocker, capsys):
+    """Assert that nothing is saved with --all-or-nothing if a line fails."""
+    status = run(mocker, "add -s gitlab.com\nremove 999\n", all_or_nothing=True)
+
+    assert status == 1
+    assert "Nothing was saved." in capsys.readouterr().err
+    assert storage.get_credential(102) is None
+
+def test_interactive_session(vault, mocker, capsys):
+    """
+    Assert that a script run in an interactive session deferring writes
+    leaves the session deferring writes, and that --all-or-nothing only
+    drops the script's changes.
+    """
+    storage.enable_cache(defer_writes=True)
+    storage.add_credential({"service": "pending.org", "password": "password3", "username": None, "email": None})
+    commit_spy = mocker.spy(storage, "_commit")
+
+    assert run(mocker, "add -s gitlab.com -p pass\nremove 999\n", all_or_nothing=True) == 1
+    assert run(mocker, "update 100 -e octocat@github.com\n") == 0
+    assert commit_spy.call_count == 0
+    assert storage._cache_enabled and storage._defer_writes
+
+    storage.sync()
+    storage.disable_cache()
+    assert [(credential["id"], credential["service"], credential["email"]) for credential in storage.read_vault()] == [
+        (100, "github.com", "octocat@github.com"), (101, "example.org", "a@b.c"), (102, "pending.org", None)
+    ]
+
+def test_session_without_deferred_writes(vault, mocker):
+    """
+    Assert that a script run in a session not deferring writes saves its
+    changes and leaves the cache on, without deferred writes.
+    """
+    storage.enable_cache()
+
+    assert run(mocker, "add -s gitlab.com -p pass\n") == 0
+    assert storage._cache_enabled and not storage._defer_writes
+    assert not storage._cache_dirty
+
+    storage.disable_cache()
+    assert storage.get_credential(102)["service"] == "gitlab.com"
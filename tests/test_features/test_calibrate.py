@@ -0,0 +1,80 @@
+# Unit tests for `src.features.calibrate`.
+from src.features import calibrate
+from src.utils import storage
+import pytest
+
+@pytest.fixture
+def vault(unlocked):
+    """Write an empty vault with the default KDF."""
+    storage.write_vault([])
+
+class TestTune:
+    """Unit tests for 'calibrate.tune'."""
+    @pytest.mark.parametrize("name", list(calibrate.MINIMUMS))
+    def test_minimums(self, name, mocker):
+        """
+        Assert that a target no parameters can meet gives the minimum
+        parameters.
+        """
+        mocker.patch("src.features.calibrate.measure", return_value=10.0)
+
+        kdf, seconds = calibrate.tune(name, 0.1, 64 * calibrate.MIB)
+
+        assert kdf["name"] == name
+        assert seconds == 10.0
+        for key, value in calibrate.MINIMUMS[name].items():
+            assert kdf[key] == value
+
+    def test_scrypt_memory_budget(self, mocker):
+        """
+        Assert that scrypt uses the largest memory within the budget, then
+        repeats blocks to fill the target.
+        """
+        mocker.patch("src.features.calibrate.measure", return_value=0.1)
+
+        kdf, _ = calibrate.tune("scrypt", 0.35, 100 * calibrate.MIB)
+
+        assert kdf == {"name": "scrypt", "n": 2 ** 16, "r": 8, "p": 3}
+        assert calibrate.memory_used(kdf) <= 100 * calibrate.MIB
+
+    def test_scales_iterations(self, mocker):
+        """Assert that iterations scale with the time a derivation takes."""
+        mocker.patch("src.features.calibrate.measure", return_value=0.05)
+
+        pbkdf2, _ = calibrate.tune("pbkdf2-sha256", 0.5, calibrate.MIB)
+        argon2id, _ = calibrate.tune("argon2id", 0.5, 32 * calibrate.MIB)
+
+        assert pbkdf2["iterations"] == 3100000
+        assert argon2id == {"name": "argon2id", "memory": 32 * 1024, "iterations": 20, "lanes": 1}
+
+class TestCalibrate:
+    """Unit tests for 'calibrate.calibrate'."""
+    def test_dry_run(self, vault, mocker, capsys):
+        """Assert that a dry run shows the parameters without changing the vault."""
+        set_kdf_mock = mocker.spy(storage, "set_kdf")
+
+        calibrate.calibrate("scrypt", 0.01, 1, dry_run=True)
+
+        set_kdf_mock.assert_not_called()
+        assert "Vault not changed." in capsys.readouterr().out
+
+    def test_apply(self, vault, mocker, capsys):
+        """Assert that the calibrated parameters are applied to the vault."""
+        kdf = {"name": "pbkdf2-sha256", "iterations": 1000}
+        mocker.patch("src.features.calibrate.tune", return_value=(kdf, 0.01))
+
+        calibrate.calibrate("pbkdf2-sha256")
+
+        assert storage.kdf() == kdf
+        assert storage.unlock()
+        assert "Vault updated." in capsys.readouterr().out
+
+    def test_unsupported(self, vault, mocker, capsys):
+        """Assert that a KDF cryptography can't run is reported."""
+        from cryptography.exceptions import UnsupportedAlgorithm
+        mocker.patch("src.utils.crypto_utils.derive", side_effect=UnsupportedAlgorithm("argon2id"))
+
+        with pytest.raises(SystemExit):
+            calibrate.calibrate("argon2id")
+
+        assert "isn't supported" in capsys.readouterr().out
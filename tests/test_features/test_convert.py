@@ -0,0 +1,23 @@
+# Unit tests for `src.features.convert`.
+from src.features import convert
+from src.utils import storage
+
+class TestConvert:
+    """Unit tests for 'convert.convert'."""
+    def test_convert(self, unlocked, mocker, capsys):
+        """Assert that the vault is converted, and only when its format changes."""
+        mocker.patch("src.utils.constants.RECORD_FORMAT", "json")
+        storage.write_vault([])
+        set_format_spy = mocker.spy(storage, "set_format")
+
+        convert.convert()
+        assert "stored as json" in capsys.readouterr().out
+
+        convert.convert("binary")
+        set_format_spy.assert_called_once_with("binary")
+        assert storage.record_format() == "binary"
+        assert "Vault converted to binary." in capsys.readouterr().out
+
+        convert.convert("binary")
+        set_format_spy.assert_called_once()
+        assert "already stored as binary" in capsys.readouterr().out
@@ -0,0 +1,70 @@
+# Unit tests for `src.features.export`.
+from src.features import export
+from src.utils import storage, archive
+import pytest, csv, json, stat
+
+CREDENTIALS = [
+    {"service": "github.com", "password": "password1", "username": "octocat", "email": None, "id": 100},
+    {"service": "example.org", "password": "password2", "username": None, "email": "a@b.c", "id": 101},
+    {"service": "github.com", "password": "password3", "username": "hubot", "email": None, "id": 102}
+]
+
+@pytest.fixture
+def vault(unlocked):
+    storage.write_vault(CREDENTIALS)
+
+def test_csv(vault, tmp_path):
+    """Assert that CSV exports hold every field and are private."""
+    path = tmp_path / "export.csv"
+    export.export(str(path))
+
+    with path.open(newline="") as file:
+        rows = list(csv.DictReader(file))
+
+    assert [row["password"] for row in rows] == ["password1", "password2", "password3"]
+    assert rows[1]["id"] == "101"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+def test_existing_file_mode(vault, tmp_path):
+    """Assert that exporting over a file others can read restricts it to the user."""
+    path = tmp_path / "export.csv"
+    path.write_text("old contents")
+    path.chmod(0o644)
+
+    export.export(str(path))
+
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+    assert "old contents" not in path.read_text()
+
+def test_jsonl_fields_and_filters(vault, tmp_path, mocker):
+    """
+    Assert that only the selected fields of matching credentials are
+    exported, and that passwords aren't decrypted when not exported.
+    """
+    iter_vault_spy = mocker.spy(storage, "iter_vault")
+    path = tmp_path / "export.jsonl"
+
+    export.export(str(path), format="jsonl", fields="id,service", service="github.com", email=None)
+
+    assert [json.loads(line) for line in path.read_text().splitlines()] == [
+        {"id": 100, "service": "github.com"},
+        {"id": 102, "service": "github.com"}
+    ]
+    assert not iter_vault_spy.called
+
+def test_archive(vault, tmp_path):
+    """Assert that an archive holds the credentials, encrypted."""
+    path = tmp_path / "export.ksa"
+    export.export(str(path), format="archive")
+
+    assert b"password1" not in path.read_bytes()
+    with path.open("rb") as file:
+        assert list(archive.read(file)) == [
+            {field: cred[field] for field in export.FIELDS} for cred in CREDENTIALS
+        ]
+
+def test_unknown_field(vault, tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        export.export(str(tmp_path / "export.csv"), fields="service,notes")
+
+    assert "Unknown fields: notes" in capsys.readouterr().out
@@ -0,0 +1,82 @@
+# Unit tests for `src.features.generate`.
+from src.features import generate
+from src.utils import passwords, storage
+from src import main
+import pytest
+
+class TestGenerate:
+    """Unit tests for 'generate.generate'."""
+    def test_print(self, capsys):
+        """Assert that the passwords are printed one per line, and their entropy to stderr."""
+        generate.generate(count=5, length=12, classes=["lower", "digits"], minimums={"digits": 4})
+
+        output = capsys.readouterr()
+        lines = output.out.splitlines()
+        assert len(lines) == 5
+        for password in lines:
+            assert len(password) == 12
+            assert password.isalnum() and not any(char.isupper() for char in password)
+            assert sum(char.isdigit() for char in password) >= 4
+        assert "bits" in output.err
+
+    def test_default_minimums(self, mocker):
+        """Assert that passwords have at least one character of each class by default."""
+        policy_spy = mocker.spy(passwords, "Policy")
+
+        generate.generate(classes=["upper", "symbols"], minimums={"symbols": 3}, exclude_ambiguous=True)
+
+        policy_spy.assert_called_once_with(
+            16, ["upper", "symbols"], {"upper": 1, "symbols": 3}, passwords.AMBIGUOUS
+        )
+
+    def test_invalid_policy(self, capsys):
+        """Assert that a policy no password meets is reported."""
+        with pytest.raises(SystemExit):
+            generate.generate(length=3, minimums={"digits": 4})
+        assert "No password meets the policy." in capsys.readouterr().out
+
+    def test_passphrases(self, tmp_path, capsys):
+        """Assert that passphrases need a word list, and are drawn from it."""
+        with pytest.raises(SystemExit):
+            generate.generate(words=3)
+        assert "--wordlist" in capsys.readouterr().out
+
+        wordlist = tmp_path / "words.txt"
+        wordlist.write_text("apple\nbanana\n")
+        generate.generate(count=3, words=5, wordlist=str(wordlist), separator=" ")
+
+        for passphrase in capsys.readouterr().out.splitlines():
+            assert len(passphrase.split(" ")) == 5
+            assert set(passphrase.split(" ")) <= {"apple", "banana"}
+
+    def test_store(self, unlocked, mocker, capsys):
+        """
+        Assert that passwords are stored as new credentials with a single
+        vault write, and not printed.
+        """
+        add_credentials_spy = mocker.spy(storage, "add_credentials")
+
+        generate.generate(count=3, service="ci.example.com", username="runner{n}")
+
+        add_credentials_spy.assert_called_once()
+        credentials = storage.read_vault()
+        assert [cred["username"] for cred in credentials] == ["runner1", "runner2", "runner3"]
+        assert all(cred["service"] == "ci.example.com" and cred["email"] is None for cred in credentials)
+        assert len({cred["password"] for cred in credentials}) == 3
+
+        output = capsys.readouterr().out
+        assert "Stored 3 credentials" in output
+        assert credentials[0]["password"] not in output
+
+@pytest.mark.parametrize("arguments", [
+    ("-n", "0"), ("-n", "-5"), ("-l", "0"), ("-l", "100000"), ("-w", "-1"), ("-w", "1000"), ("-l", "x")
+])
+def test_invalid_numbers(arguments, capsys):
+    """Assert that counts, lengths and word counts must be positive and bounded."""
+    with pytest.raises(SystemExit):
+        main.build_cli().parse_args(["generate", *arguments])
+    assert "expected an integer from 1 to" in capsys.readouterr().err
+
+def test_numbers():
+    cli_namespace = main.build_cli().parse_args(["generate", "-n", "3", "-l", "1024", "-w", "6"])
+    assert (cli_namespace.count, cli_namespace.length, cli_namespace.words) == (3, 1024, 6)
@@ -9,9 +9,9 @@ class TestGet:
         Verify that 'get' exits when an invalid ID is given or
         when the credentials list is empty.
         """
-        storage_read_mock = mocker.patch(
-            "src.features.get.storage.read_vault",
-            return_value = []
+        storage_get_mock = mocker.patch(
+            "src.features.get.storage.get_credential",
+            return_value = None
         )
 
         with pytest.raises(SystemExit):
@@ -26,19 +26,20 @@ class TestGet:
         ID is given.
         """
         copy_mock = mocker.patch("src.features.get.pyperclip.copy")
-        storage_read_mock = mocker.patch(
-            "src.features.get.storage.read_vault",
-            return_value = [{
+        storage_get_mock = mocker.patch(
+            "src.features.get.storage.get_credential",
+            return_value = {
                 "service": "service1",
                 "password": "StrongPassword123",
                 "username": None,
                 "email": None,
                 "id": 123
-            }]
+            }
         )
 
         get.get(123)
 
+        storage_get_mock.assert_called_once_with(123)
         copy_mock.assert_called_with("StrongPassword123")
 
         output = capsys.readouterr()
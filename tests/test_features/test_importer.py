@@ -0,0 +1,144 @@
+# Unit tests for `src.features.importer`.
+from src.features import importer
+from src.utils import archive, constants, storage
+import pytest, json
+
+CHROME_CSV = """name,url,username,password
+github.com,https://github.com/login,octocat,password1
+example.org,https://example.org,,password2
+no password,https://example.com,someone,
+"""
+
+BITWARDEN_JSON = {
+    "items": [
+        {
+            "name": "GitHub",
+            "login": {
+                "username": "octocat",
+                "password": "password1",
+                "uris": [{"uri": "https://github.com"}]
+            }
+        },
+        {"name": "Secure note", "notes": "no login"}
+    ]
+}
+
+class TestReadRecords:
+    """Unit tests for 'importer.read_records' and 'importer.to_credential'."""
+    def test_csv(self, tmp_path):
+        path = tmp_path / "export.csv"
+        path.write_text(CHROME_CSV)
+
+        credentials = [importer.to_credential(record) for record in importer.read_records(path, "csv")]
+
+        assert credentials == [
+            {"service": "github.com", "password": "password1", "username": "octocat", "email": None},
+            {"service": "example.org", "password": "password2", "username": None, "email": None},
+            None
+        ]
+
+    def test_bitwarden_json(self, tmp_path):
+        path = tmp_path / "export.json"
+        path.write_text(json.dumps(BITWARDEN_JSON))
+
+        credentials = [importer.to_credential(record) for record in importer.read_records(path, "json")]
+
+        assert credentials == [
+            {"service": "GitHub", "password": "password1", "username": "octocat", "email": None},
+            None
+        ]
+
+    def test_malformed_json_records(self, tmp_path):
+        """
+        Assert that records that aren't objects, or whose login or URIs
+        aren't, are invalid instead of failing the import.
+        """
+        path = tmp_path / "export.json"
+        path.write_text(json.dumps({"folders": [{"id": 1}], "items": [
+            "x",
+            {"name": "a", "login": "not a login"},
+            {"name": "b", "login": {"password": "p", "uris": ["http://x"]}},
+            {"name": "c", "login": {"password": "p", "uris": "http://x"}},
+            {"name": "d", "password": "p"}
+        ]}))
+
+        credentials = [importer.to_credential(record) for record in importer.read_records(path, "json")]
+
+        assert credentials == [
+            None, None, None, None,
+            {"service": "d", "password": "p", "username": None, "email": None}
+        ]
+
+    @pytest.mark.parametrize("contents", ['[{"name": "a"}', '"text"', '{"items": "text"}', '{"items": [1 2]}'])
+    def test_invalid_json(self, tmp_path, contents):
+        """Assert that malformed JSON raises ValueError."""
+        path = tmp_path / "export.json"
+        path.write_text(contents)
+
+        with pytest.raises(ValueError):
+            list(importer.read_records(path, "json"))
+
+def test_import_credentials(unlocked, tmp_path, capsys):
+    """
+    Assert that 'import_credentials' adds the new credentials with one vault
+    write and skips duplicates and invalid records.
+    """
+    storage.add_credential(
+        {"service": "github.com", "password": "old", "username": "octocat", "email": None}
+    )
+    path = tmp_path / "export.csv"
+    path.write_text(CHROME_CSV + "example.org,https://example.org,,password3\n")
+
+    importer.import_credentials(str(path))
+
+    assert [(cred["service"], cred["password"], cred["id"]) for cred in storage.read_vault()] == [
+        ("github.com", "old", 100),
+        ("example.org", "password2", 101)
+    ]
+    output = capsys.readouterr().out
+    assert "Imported 1 credentials." in output
+    assert "Skipped 2 duplicate credentials." in output
+    assert "Skipped 1 records without a service or a password." in output
+
+def test_unknown_format(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        importer.import_credentials(str(tmp_path / "export.txt"))
+
+    assert "Unknown file format" in capsys.readouterr().out
+
+def test_import_archive(unlocked, tmp_path, mocker, capsys):
+    """
+    Assert that an archive written by 'export' is imported, and that one
+    written with another master password is reported.
+    """
+    path = tmp_path / "backup.ksa"
+    with path.open("wb") as file:
+        archive.write(file, [
+            {"service": "github.com", "password": "password1", "username": "octocat", "email": None, "id": 500}
+        ])
+
+    importer.import_credentials(str(path))
+
+    assert storage.read_vault() == [
+        {"service": "github.com", "password": "password1", "username": "octocat", "email": None, "id": 100}
+    ]
+    assert "Imported 1 credentials." in capsys.readouterr().out
+
+    mocker.patch.object(constants, "MASTER_PASSWORD", "another_password")
+    with path.open("wb") as file:
+        archive.write(file, [])
+    mocker.patch.object(constants, "MASTER_PASSWORD", unlocked)
+    with pytest.raises(SystemExit):
+        importer.import_credentials(str(path), "archive")
+    assert "another master password" in capsys.readouterr().out
+
+def test_unreadable_file(unlocked, tmp_path, capsys):
+    """Assert that a malformed file is reported, and nothing is imported."""
+    path = tmp_path / "export.json"
+    path.write_text('[{"name": "a", "password": "p"}, {"name": ')
+
+    with pytest.raises(SystemExit):
+        importer.import_credentials(str(path))
+
+    assert "Can't read" in capsys.readouterr().out
+    assert storage.read_vault() == []
@@ -12,6 +12,7 @@ class TestPasswd:
         getpass_mock = mocker.patch("src.features.passwd.getpass")
         getpass_mock.side_effect = [str(i) for i in range(6)] # Return a different password with each call.
         sys_exit_mock = mocker.patch("src.features.passwd.sys.exit")
+        mocker.patch("src.features.passwd.storage.set_master_password")
 
         passwd.passwd()
 
@@ -22,21 +23,32 @@ class TestPasswd:
         """
         Assert that 'passwd', when given matching passwords:
             + Does not call 'sys.exit'.
-            + Generates the password hash.
-            + Saves the hash to disk.
+            + Sets the new master password.
         """
         getpass_mock = mocker.patch(
             "src.features.passwd.getpass",
             return_value="master_password"
         )
         sys_exit_mock = mocker.patch("src.features.passwd.sys.exit")
-        hashpw_mock = mocker.patch(
-            "src.features.passwd.bcrypt.hashpw",
-            return_value=b"password_hash"
-        )
-        hash_mock = mocker.patch("src.features.passwd.constants.HASH")
+        set_mock = mocker.patch("src.features.passwd.storage.set_master_password")
 
         passwd.passwd()
 
         assert not sys_exit_mock.called
-        hash_mock.write_text.assert_called_with("password_hash")
+        set_mock.assert_called_once_with("master_password", progress=passwd.show_progress)
+
+    def test_show_progress(self, mocker, capsys):
+        """Assert that progress is shown once per percentage, on terminals only."""
+        mocker.patch("src.features.passwd.sys.stderr.isatty", return_value=True)
+
+        for done in (0, 1, 2, 50, 100):
+            passwd.show_progress(done, 100)
+
+        assert capsys.readouterr().err == (
+            "\rWriting the vault: 0%\rWriting the vault: 1%\rWriting the vault: 2%"
+            "\rWriting the vault: 50%\rWriting the vault: 100%\n"
+        )
+
+        passwd.show_progress(1, 200)
+        passwd.show_progress(2, 200)
+        assert capsys.readouterr().err == "\rWriting the vault: 0%\rWriting the vault: 1%"
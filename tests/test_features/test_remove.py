@@ -16,7 +16,12 @@ class TestRemoveCredential:
     @pytest.fixture
     def mock_storage(self, mocker, sample_credentials):
         storage_mock = mocker.patch("src.features.remove.storage")
-        storage_mock.read_vault.return_value = sample_credentials
+        storage_mock.get_credential.side_effect = lambda id: next(
+            (cred for cred in sample_credentials if cred["id"] == id), None
+        )
+        storage_mock.remove_credential.side_effect = lambda id: sample_credentials.remove(
+            storage_mock.get_credential(id)
+        )
 
         return storage_mock
 
@@ -31,7 +36,7 @@ class TestRemoveCredential:
         assert len(sample_credentials) == 2
         assert not any(cred["id"] == 222 for cred in sample_credentials)
 
-        mock_storage.write_vault.assert_called_once_with(sample_credentials)
+        mock_storage.remove_credential.assert_called_once_with(222)
 
         captured = capsys.readouterr()
         assert "Removing the following credential:" in captured.out
@@ -50,7 +55,7 @@ class TestRemoveCredential:
 
         assert len(sample_credentials) == 2
         assert not any(cred["id"] == 111 for cred in sample_credentials)
-        mock_storage.write_vault.assert_called_once()
+        mock_storage.remove_credential.assert_called_once()
 
     def test_cancellation_with_n_confirmation(
         self, mocker, sample_credentials, mock_storage, capsys
@@ -64,7 +69,7 @@ class TestRemoveCredential:
         assert len(sample_credentials) == 3
         assert any(cred["id"] == 222 for cred in sample_credentials)
 
-        mock_storage.write_vault.assert_not_called()
+        mock_storage.remove_credential.assert_not_called()
 
         captured = capsys.readouterr()
         assert "Not removing credential." in captured.out
@@ -79,7 +84,7 @@ class TestRemoveCredential:
             remove.remove(222)
 
         assert len(sample_credentials) == 3
-        mock_storage.write_vault.assert_not_called()
+        mock_storage.remove_credential.assert_not_called()
 
     def test_invalid_confirmation_three_times(
         self, mocker, sample_credentials, mock_storage, capsys
@@ -91,7 +96,7 @@ class TestRemoveCredential:
             remove.remove(222)
 
         assert len(sample_credentials) == 3
-        mock_storage.write_vault.assert_not_called()
+        mock_storage.remove_credential.assert_not_called()
         assert input_mock.call_count == 3
 
         captured = capsys.readouterr()
@@ -106,7 +111,7 @@ class TestRemoveCredential:
         remove.remove(222)
 
         assert len(sample_credentials) == 2
-        mock_storage.write_vault.assert_called_once()
+        mock_storage.remove_credential.assert_called_once()
 
     def test_credential_not_found(
         self, mocker, sample_credentials, mock_storage, capsys
@@ -116,14 +121,14 @@ class TestRemoveCredential:
             remove.remove(9)
 
         assert len(sample_credentials) == 3
-        mock_storage.write_vault.assert_not_called()
+        mock_storage.remove_credential.assert_not_called()
 
         captured = capsys.readouterr()
         assert "No credential with id 9 found!" in captured.out
 
-    def test_empty_credentials_list(self, capsys, mock_storage):
+    def test_empty_credentials_list(self, capsys, mock_storage, sample_credentials):
         """Test behavior with empty credentials list"""
-        mock_storage.read_vault.return_value = []
+        sample_credentials.clear()
 
         with pytest.raises(SystemExit):
             remove.remove(111)
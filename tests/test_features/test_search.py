@@ -0,0 +1,13 @@
+# Unit tests for `src.features.search`.
+from src import main
+import pytest
+
+@pytest.mark.parametrize("limit", ["0", "-1", "x"])
+def test_invalid_limit(limit, capsys):
+    """Assert that a limit below 1 is rejected when parsing the arguments."""
+    with pytest.raises(SystemExit):
+        main.build_cli().parse_args(["search", "-m", "fuzzy", "-n", limit])
+    assert "expected a positive integer" in capsys.readouterr().err
+
+def test_limit():
+    assert main.build_cli().parse_args(["search", "-n", "3"]).limit == 3
@@ -0,0 +1,34 @@
+# Unit tests for `src.features.update`.
+from src.features import update
+import pytest
+
+CREDENTIAL = {"service": "github.com", "password": "password1", "username": "octocat", "email": None, "id": 100}
+
+@pytest.fixture
+def storage_mock(mocker):
+    storage_mock = mocker.patch("src.features.update.storage")
+    storage_mock.get_credential.side_effect = lambda id: CREDENTIAL if id == 100 else None
+    return storage_mock
+
+def test_update(storage_mock):
+    """Assert that only the given fields are changed."""
+    update.update(100, email="octocat@github.com")
+
+    storage_mock.update_credential.assert_called_once_with(
+        {**CREDENTIAL, "email": "octocat@github.com"}
+    )
+
+def test_update_password_prompt(storage_mock, mocker):
+    """Assert that the password is prompted for when no value is given."""
+    mocker.patch("src.features.update.add.get_password", return_value="password2")
+
+    update.update(100, password=update.PROMPT)
+
+    storage_mock.update_credential.assert_called_once_with({**CREDENTIAL, "password": "password2"})
+
+def test_update_missing(storage_mock, capsys):
+    with pytest.raises(SystemExit):
+        update.update(999, service="gitlab.com")
+
+    assert "No credential with ID 999 found!" in capsys.readouterr().out
+    storage_mock.update_credential.assert_not_called()
@@ -1,6 +1,7 @@
 # Unit tests for `src.main`.
 from src import main
-import pytest, bcrypt
+from src.utils import constants, crypto_utils, storage
+import pytest, bcrypt, os, pathlib, subprocess, sys
 
 class TestInteractiveMode:
     """Unit tests for `main.interactive_mode`."""
@@ -132,41 +133,50 @@ class TestInteractiveMode:
         assert parser.parse_args.call_count == 3
         assert mock_run_command.call_count == 2
 
+    def test_interactive_mode_sync_command(self, mocker):
+        """Test that 'sync' saves deferred writes without parsing the command."""
+        parser = mocker.Mock()
+        mocker.patch('builtins.input', side_effect=['sync', 'exit'])
+        sync_mock = mocker.patch('src.main.storage.sync', return_value=True)
+
+        with pytest.raises(SystemExit):
+            main.interactive_mode(parser)
+
+        parser.parse_args.assert_not_called()
+        # Once for 'sync' and once when the session ends.
+        assert sync_mock.call_count == 2
+
 class TestVerifyIdentity:
     """Unit tests for 'main.verify_identity'."""
-    @pytest.fixture(scope="class")
-    def password_fixture(self):
-        """Return a password string and its hash."""
+    @pytest.fixture
+    def password_fixture(self, unlocked):
+        """Create a vault with a master password and return the password."""
         password = "StrongPassword123"
-        password_hash = bcrypt.hashpw(
-            password.encode("utf-8"),
-            bcrypt.gensalt()
-        )
+        storage.set_master_password(password)
+        crypto_utils.clear_key_cache()
 
-        return password, password_hash
+        return password
 
     @pytest.fixture
-    def hash_file_mock(self, mocker, password_fixture):
-        """Mock and return 'src.main.constants.HASH'."""
-        password, password_hash = password_fixture
-        
-        mock = mocker.patch("src.main.constants.HASH")
-        mock.exists.return_value = True
-        mock.read_text.return_value = password_hash.decode("utf-8")
+    def hash_file(self, unlocked):
+        """
+        Write the bcrypt hash of a master password set before the vault
+        checked it, without a vault. Return the password.
+        """
+        password = "StrongPassword123"
+        constants.HASH.write_bytes(bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()))
 
-        return mock
+        return password
 
     def test_no_hash(self, mocker, capsys):
         """
         Assert that 'main.verify_identity' prints a message and exits when
-        'constants.HASH' doesn't exist and 'cmd' is None.
+        the master password isn't set and 'cmd' is None.
 
-        Assert that 'main.verify_identity' does not exit when 'constants.HASH'
-        doesn't exist and 'cmd' is "passwd".
+        Assert that 'main.verify_identity' does not exit when the master
+        password isn't set and 'cmd' is "passwd".
         """
         sys_exit_mock = mocker.patch("src.main.sys.exit")
-        hash_mock = mocker.patch("src.main.constants.HASH")
-        hash_mock.exists.return_value = False
 
         # cmd == "passwd"
         main.verify_identity("passwd")
@@ -178,90 +188,192 @@ class TestVerifyIdentity:
         output = capsys.readouterr()
         assert "Master password not set." in output.out
         sys_exit_mock.assert_called()
-        
-    def test_verify_identity_success_first_attempt(self, mocker, password_fixture, hash_file_mock):
-        """Test successful verification on first password attempt."""
-        password = password_fixture[0]
-        mocker.patch("src.main.getpass", return_value=password)
-        
+
+    def test_verify_identity_success_first_attempt(self, mocker, password_fixture):
+        """
+        Test successful verification on first password attempt, with a
+        single key derivation.
+        """
+        mocker.patch("src.main.getpass", return_value=password_fixture)
+        derive_spy = mocker.spy(crypto_utils, "_derive_key")
+
         result = main.verify_identity(None)
-        
-        assert result == password
-        hash_file_mock.exists.assert_called_once()
-        hash_file_mock.read_text.assert_called_once()
 
-    def test_verify_identity_success_third_attempt(self, mocker, password_fixture, hash_file_mock):
+        assert result == password_fixture
+        assert derive_spy.call_count == 1
+
+    def test_verify_identity_success_third_attempt(self, mocker, password_fixture):
         """Test successful verification on third password attempt."""
-        password = password_fixture[0]
-        mocker.patch("src.main.getpass", side_effect=["wrong1", "wrong2", password])
+        mocker.patch("src.main.getpass", side_effect=["wrong1", "wrong2", password_fixture])
         mock_print = mocker.patch("builtins.print")
-        
+
         result = main.verify_identity(None)
-        
-        assert result == password
+
+        assert result == password_fixture
         assert mock_print.call_count == 2
         mock_print.assert_any_call("Incorrect master password!")
 
-    def test_verify_identity_fails_after_three_attempts(self, mocker, hash_file_mock):
+    def test_verify_identity_fails_after_three_attempts(self, mocker, password_fixture):
         """Test that system exits after three incorrect password attempts."""
         mocker.patch("src.main.getpass", return_value="wrong_password")
         mock_print = mocker.patch("builtins.print")
-        
+
         with pytest.raises(SystemExit):
             main.verify_identity(None)
-        
+
         assert mock_print.call_count == 3
         mock_print.assert_called_with("Incorrect master password!")
 
     def test_verify_identity_no_hash_file_non_passwd_command(self, mocker):
-        """Test exit when hash file doesn't exist and command is not 'passwd'."""
-        mock_hash = mocker.patch("src.main.constants.HASH")
-        mock_hash.exists.return_value = False
-        
+        """Test exit when the master password isn't set and command is not 'passwd'."""
         mock_print = mocker.patch("builtins.print")
-        
+
         with pytest.raises(SystemExit):
             main.verify_identity(None)
-        
-        mock_hash.exists.assert_called_once()
+
         assert mock_print.call_count == 2
         mock_print.assert_any_call("Master password not set.")
         mock_print.assert_any_call("Use 'keystash passwd' to set the master password.")
 
     def test_verify_identity_no_hash_file_passwd_command(self, mocker):
-        """Test that function returns normally when hash doesn't exist but command is 'passwd'."""
-        mock_hash = mocker.patch("src.main.constants.HASH")
-        mock_hash.exists.return_value = False
-        
+        """Test that function returns normally when the master password isn't set but command is 'passwd'."""
         mock_print = mocker.patch("builtins.print")
         mock_exit = mocker.patch("src.main.sys.exit")
-        
+
         result = main.verify_identity("passwd")
-        
+
         assert result is None
-        mock_hash.exists.assert_called_once()
         mock_print.assert_not_called()
         mock_exit.assert_not_called()
 
-    def test_verify_identity_strips_whitespace(self, mocker, password_fixture, hash_file_mock):
+    def test_verify_identity_strips_whitespace(self, mocker, password_fixture):
         """Test that password whitespace is properly stripped."""
-        password, password_hash = password_fixture
-        hash_file_mock.read_text.return_value = f"  {password_hash.decode('utf-8')}  \n"
-        
-        mocker.patch("src.main.getpass", return_value=f"  {password}  ")
-        
+        mocker.patch("src.main.getpass", return_value=f"  {password_fixture}  ")
+
         result = main.verify_identity(None)
-        
-        assert result == password
 
-    def test_verify_identity_empty_password_input(self, mocker, password_fixture, hash_file_mock):
+        assert result == password_fixture
+
+    def test_verify_identity_empty_password_input(self, mocker, password_fixture):
         """Test behavior with empty password input."""
-        password, password_hash = password_fixture
-        
-        mocker.patch("src.main.getpass", side_effect=["", "", password])
+        mocker.patch("src.main.getpass", side_effect=["", "", password_fixture])
         mock_print = mocker.patch("builtins.print")
-        
+
         result = main.verify_identity(None)
-        
-        assert result == password
+
+        assert result == password_fixture
         assert mock_print.call_count == 2
+
+    def test_hash_file_migration(self, mocker, hash_file):
+        """
+        Test that a master password set before the vault checked it is
+        checked against its hash once, then the hash is replaced by a vault.
+        """
+        mocker.patch("src.main.getpass", side_effect=["wrong_password", hash_file])
+        mocker.patch("builtins.print")
+
+        result = main.verify_identity(None)
+
+        assert result == hash_file
+        assert not constants.HASH.exists()
+        assert storage.exists()
+        assert storage.unlock()
+
+    def test_hash_file_wrong_password(self, mocker, hash_file):
+        """Test that the hash is kept and no vault is created after three wrong passwords."""
+        mocker.patch("src.main.getpass", return_value="wrong_password")
+        mocker.patch("builtins.print")
+
+        with pytest.raises(SystemExit):
+            main.verify_identity(None)
+
+        assert constants.HASH.exists()
+        assert not storage.exists()
+
+    def test_stale_hash_file_removed(self, mocker, password_fixture):
+        """Test that a hash left next to a vault is removed on unlock."""
+        constants.HASH.write_text("stale hash")
+        mocker.patch("src.main.getpass", return_value=password_fixture)
+
+        assert main.verify_identity(None) == password_fixture
+        assert not constants.HASH.exists()
+
+class TestStartup:
+    """Tests of what starting `keystash` loads and touches."""
+    @pytest.mark.parametrize("arguments", [["--help"], ["get", "--help"], ["get"], ["frobnicate"]])
+    def test_no_heavy_imports(self, arguments, tmp_path):
+        """
+        Assert that help and argument errors load no crypto library and
+        don't create the data directory.
+        """
+        script = (
+            "import sys\n"
+            "sys.argv = ['keystash', *sys.argv[1:]]\n"
+            "from src import main\n"
+            "try:\n"
+            "    main.main()\n"
+            "finally:\n"
+            "    loaded = [name for name in ('bcrypt', 'cryptography', 'pyperclip')\n"
+            "              if type(sys.modules.get(name)) is type(sys)]\n"
+            "    print(loaded, file=sys.stderr)\n"
+        )
+        process = subprocess.run(
+            [sys.executable, "-c", script, *arguments],
+            cwd=pathlib.Path(main.__file__).parent.parent,
+            env={**os.environ, "HOME": str(tmp_path)},
+            capture_output=True, text=True
+        )
+
+        assert process.stderr.splitlines()[-1] == "[]"
+        assert list(tmp_path.iterdir()) == []
+
+    def test_generate_without_vault(self, tmp_path):
+        """
+        Assert that 'generate' prints passwords without a vault, a master
+        password or a crypto library.
+        """
+        script = (
+            "import sys\n"
+            "sys.argv = ['keystash', 'generate', '-n', '3']\n"
+            "from src import main\n"
+            "main.main()\n"
+            "print([name for name in ('bcrypt', 'cryptography')\n"
+            "       if type(sys.modules.get(name)) is type(sys)], file=sys.stderr)\n"
+        )
+        process = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=pathlib.Path(main.__file__).parent.parent,
+            env={**os.environ, "HOME": str(tmp_path)},
+            capture_output=True, text=True
+        )
+
+        assert len(process.stdout.splitlines()) == 3
+        assert process.stderr.splitlines()[-1] == "[]"
+        assert list(tmp_path.iterdir()) == []
+
+    def test_build_cli_for_command(self):
+        """Assert that only the command being run gets its options."""
+        parser = main.build_cli(["-i", "get", "100"])
+
+        assert parser.parse_args(["get", "100"]).id == "100"
+        with pytest.raises(SystemExit):
+            parser.parse_args(["search", "-s", "github.com"])
+        assert main.build_cli().parse_args(["search", "-s", "github.com"]).service == "github.com"
+
+
+class TestProfile:
+    """Tests of tracing a command with '--profile'."""
+    def test_profile(self, mocker, capsys):
+        """Assert that '--profile' prints the phases of the command to stderr."""
+        mocker.patch("src.main.sys.argv", ["keystash", "--profile", "get", "101"])
+        mocker.patch("src.main.verify_identity", return_value="master_password")
+        mocker.patch("src.main.constants.MASTER_PASSWORD")
+        run_command_mock = mocker.patch("src.main.run_command")
+
+        main.main()
+
+        run_command_mock.assert_called_once()
+        report = capsys.readouterr().err
+        for phase in ("parse arguments", "verify identity", "get", "Total: "):
+            assert phase in report
+        assert not main.profiling._enabled
@@ -0,0 +1,52 @@
+# Unit tests for `src.utils.archive`.
+from src.utils import archive
+from cryptography.exceptions import InvalidTag
+import pytest, io
+
+def write(credentials):
+    """Write an archive to memory and return its contents."""
+    output = io.BytesIO()
+    archive.write(output, credentials)
+    return output.getvalue()
+
+def test_round_trip(unlocked, mocker):
+    """Assert that credentials are read back across several batches."""
+    mocker.patch.object(archive, "BATCH_SIZE", 4)
+    credentials = [{"service": f"service{id}", "id": id} for id in range(10)]
+
+    assert list(archive.read(io.BytesIO(write(credentials)))) == credentials
+    assert list(archive.read(io.BytesIO(write([])))) == []
+
+def test_truncated(unlocked, mocker):
+    """Assert that an archive missing its last batch is rejected."""
+    mocker.patch.object(archive, "BATCH_SIZE", 4)
+    contents = write([{"id": id} for id in range(10)])
+
+    # Find where the last of the three batches starts.
+    offset = len(archive.ARCHIVE_MAGIC)
+    offset += 4 + int.from_bytes(contents[offset:offset + 4], "big")
+    for _ in range(2):
+        offset += 4 + 1 + int.from_bytes(contents[offset:offset + 4], "big")
+    assert contents[offset + 4] == 1
+
+    with pytest.raises(ValueError):
+        list(archive.read(io.BytesIO(contents[:offset])))
+
+def test_tampered(unlocked):
+    """Assert that a modified batch is rejected."""
+    contents = bytearray(write([{"id": 1}]))
+    contents[-1] ^= 1
+
+    with pytest.raises(InvalidTag):
+        list(archive.read(io.BytesIO(bytes(contents))))
+
+def test_wrong_password(unlocked, mocker):
+    contents = write([{"id": 1}])
+    mocker.patch("src.utils.archive.constants.MASTER_PASSWORD", "wrong_password")
+
+    with pytest.raises(Exception):
+        list(archive.read(io.BytesIO(contents)))
+
+def test_not_an_archive():
+    with pytest.raises(ValueError):
+        list(archive.read(io.BytesIO(b"not an archive")))
@@ -0,0 +1,71 @@
+# Unit tests for `src.utils.codec`.
+from src.utils import codec
+import json, pytest
+
+ENTRIES = [
+    [101, 10, 44, {"service": "github.com", "username": "alice", "email": None, "id": 101}],
+    [102, 60, 44, {"service": "github.com", "username": None, "email": "a@example.com", "id": 102}],
+    [105, 110, 45, {"service": "gitlab.com", "username": "alice", "email": "a@example.com", "id": 105}]
+]
+
+class TestIndex:
+    """Unit tests for 'codec.encode_index' and 'codec.decode_index'."""
+    @pytest.mark.parametrize("format", codec.FORMATS)
+    def test_round_trip(self, format):
+        """Assert that index chunks decode to the entries encoded."""
+        assert codec.decode_index(codec.encode_index(ENTRIES, format)) == ENTRIES
+        assert codec.decode_index(codec.encode_index([], format)) == []
+
+    def test_compact(self):
+        """Assert that repeated strings are stored once in the binary format."""
+        entries = [[id, id * 50, 44, {**ENTRIES[0][3], "id": id}] for id in range(1, 257)]
+
+        encoded = codec.encode_index(entries, "binary")
+
+        assert encoded.count(b"github.com") == 1
+        assert len(encoded) < len(codec.encode_index(entries, "json")) / 4
+
+    def test_odd_values(self):
+        """
+        Assert that missing fields, NUL characters, values of other types,
+        IDs that differ from the entry's ID, and offsets out of order round
+        trip.
+        """
+        entries = [
+            [5, 900, 3, {"service": "a\0b", "notes": [1, {"x": 2.5}], "id": 5, "count": 7}],
+            [9, 2, 3, {"service": "a\0b", "flag": True}],
+            [12, 2 ** 40, 1, {}]
+        ]
+
+        assert codec.decode_index(codec.encode_index(entries, "binary")) == entries
+
+class TestFrame:
+    """Unit tests for 'codec.encode_frame' and 'codec.decode_frame'."""
+    @pytest.mark.parametrize("secrets", [{"password": "pässword"}, {"password": None}, {}, {"password": "x", "otp": "y"}])
+    def test_round_trip(self, secrets):
+        """Assert that frames decode to the secrets encoded, in either format."""
+        for format in codec.FORMATS:
+            assert codec.decode_frame(codec.encode_frame(secrets, format)) == secrets
+
+class TestBucket:
+    """Unit tests for 'codec.encode_bucket' and 'codec.decode_bucket'."""
+    @pytest.mark.parametrize("format", codec.FORMATS)
+    def test_round_trip(self, format):
+        """Assert that field buckets decode to the entries encoded."""
+        entries = [["alice", [101, 105]], [None, [102]], ["bob", [7]], [3, [1, 2, 3]]]
+
+        assert codec.decode_bucket(codec.encode_bucket(entries, format)) == entries
+        assert codec.decode_bucket(codec.encode_bucket([], format)) == []
+
+class TestFormats:
+    """Unit tests for the record formats."""
+    def test_json_compatible(self):
+        """Assert that records written as JSON before the codec existed are decoded."""
+        assert codec.decode_index(json.dumps(ENTRIES).encode("utf-8")) == ENTRIES
+        assert codec.decode_frame(b'{"password": "hunter2"}') == {"password": "hunter2"}
+        assert codec.decode_bucket(b'[["alice", [1, 2]]]') == [["alice", [1, 2]]]
+
+    def test_unknown_format(self):
+        """Assert that an unknown format raises ValueError."""
+        with pytest.raises(ValueError):
+            codec.encode_index(ENTRIES, "xml")
@@ -0,0 +1,187 @@
+# Unit tests for `src.utils.container`.
+from src.utils import codec, container, crypto_utils
+from cryptography.exceptions import InvalidTag
+import pytest
+
+ASSOCIATED_DATA = b"header"
+HEADER = b"magic and header"
+
+def credential(id):
+    return {
+        "service": f"service{id}",
+        "password": f"password{id}",
+        "username": None,
+        "email": None,
+        "id": id
+    }
+
+class TestContainer:
+    """Unit tests for the framed vault container."""
+    @pytest.fixture
+    def data_key(self):
+        return crypto_utils.generate_data_key()
+
+    @pytest.fixture(params=codec.FORMATS)
+    def vault(self, request, tmp_path, data_key, mocker):
+        """
+        Write a container with 1000 credentials (several index chunks) after
+        a fake header, in each record format. Return the open file.
+        """
+        mocker.patch("src.utils.container.INDEX_CHUNK_SIZE", 64)
+        credentials = [credential(id) for id in range(1000, 0, -1)]
+
+        path = tmp_path / "vault"
+        with path.open("wb") as file:
+            file.write(HEADER)
+            container.write(
+                file, len(HEADER), credentials, data_key, ASSOCIATED_DATA, request.param
+            )
+
+        with path.open("r+b") as file:
+            yield file
+
+    def test_iter_credentials(self, vault, data_key):
+        """Assert that credentials are read back in ID order."""
+        credentials = list(container.iter_credentials(vault, data_key, ASSOCIATED_DATA))
+        assert credentials == [credential(id) for id in range(1, 1001)]
+
+    def test_iter_metadata(self, vault, data_key):
+        """Assert that metadata is read without the secret fields."""
+        metadata = next(container.iter_metadata(vault, data_key, ASSOCIATED_DATA))
+        assert metadata == {key: value for key, value in credential(1).items() if key != "password"}
+
+    def test_streaming_write(self, tmp_path, data_key, mocker):
+        """
+        Assert that credentials arriving in ID order are indexed as they are
+        written, and credentials arriving out of order are reindexed.
+        """
+        write_chunk_spy = mocker.spy(container, "_append_chunk")
+
+        with (tmp_path / "sorted").open("w+b") as file:
+            container.write(file, 0, (credential(id) for id in range(1, 1001)), data_key, ASSOCIATED_DATA)
+            assert write_chunk_spy.call_count == 4
+            assert container.find(file, 999, data_key, ASSOCIATED_DATA) == credential(999)
+
+        write_chunk_spy.reset_mock()
+        ids = list(range(1, 1001))
+        ids[900], ids[300] = ids[300], ids[900]
+        with (tmp_path / "unsorted").open("w+b") as file:
+            container.write(file, 0, (credential(id) for id in ids), data_key, ASSOCIATED_DATA)
+            # One chunk written before the order broke, then four after reindexing.
+            assert write_chunk_spy.call_count == 5
+            assert container.find(file, 901, data_key, ASSOCIATED_DATA) == credential(901)
+            assert container.find(file, 301, data_key, ASSOCIATED_DATA) == credential(301)
+
+    def test_find(self, vault, data_key):
+        """Assert that 'find' returns the matching credential or None."""
+        assert container.find(vault, 1, data_key, ASSOCIATED_DATA) == credential(1)
+        assert container.find(vault, 700, data_key, ASSOCIATED_DATA) == credential(700)
+        assert container.find(vault, 1000, data_key, ASSOCIATED_DATA) == credential(1000)
+        assert container.find(vault, 0, data_key, ASSOCIATED_DATA) is None
+        assert container.find(vault, 1001, data_key, ASSOCIATED_DATA) is None
+
+    def test_find_decrypts_one_frame(self, vault, data_key, mocker):
+        """
+        Assert that 'find' decrypts only the directory, one index chunk and
+        one frame.
+        """
+        unseal_spy = mocker.spy(crypto_utils, "unseal")
+        container.find(vault, 500, data_key, ASSOCIATED_DATA)
+        assert unseal_spy.call_count == 3
+
+    def test_lookup(self, vault, data_key, mocker):
+        """
+        Assert that the field indexes return the IDs holding a value, and
+        that a lookup decrypts a single bucket.
+        """
+        mocker.patch("src.utils.container.FIELD_BUCKET_SIZE", 64)
+        unseal_spy = mocker.spy(container.crypto_utils, "unseal")
+
+        assert container.lookup(vault, "service", "service500", data_key, ASSOCIATED_DATA) == [500]
+        assert unseal_spy.call_count == 2	# The directory and one bucket.
+        assert container.lookup(vault, "service", "missing", data_key, ASSOCIATED_DATA) == []
+        assert container.lookup(vault, "email", None, data_key, ASSOCIATED_DATA) == list(range(1, 1001))
+        assert container.lookup(vault, "password", "password1", data_key, ASSOCIATED_DATA) is None
+
+    def test_iter_metadata_of(self, vault, data_key, mocker):
+        """
+        Assert that only the index chunks holding the given IDs are decrypted.
+        """
+        read_chunk_spy = mocker.spy(container, "_read_chunk")
+
+        metadata = list(container.iter_metadata_of(vault, [2, 3, 500, 2000], data_key, ASSOCIATED_DATA))
+
+        assert [entry["id"] for entry in metadata] == [2, 3, 500]
+        assert read_chunk_spy.call_count == 2
+
+    def test_tampered_frame(self, vault, data_key):
+        """Assert that a modified frame is rejected."""
+        vault.seek(len(HEADER) + 40)
+        byte = vault.read(1)
+        vault.seek(len(HEADER) + 40)
+        vault.write(bytes([byte[0] ^ 1]))
+
+        with pytest.raises(InvalidTag):
+            container.find(vault, 1000, data_key, ASSOCIATED_DATA)
+
+    def test_swapped_chunks(self, vault, data_key):
+        """
+        Assert that an index chunk moved to the ID range of another chunk is
+        rejected.
+        """
+        directory = container._read_directory(vault, data_key, ASSOCIATED_DATA)
+        first, second = directory["chunks"][:2]
+        first[2:], second[2:] = second[2:], first[2:]
+        container._write_directory(vault, directory, data_key, ASSOCIATED_DATA)
+
+        with pytest.raises(InvalidTag):
+            list(container.iter_metadata(vault, data_key, ASSOCIATED_DATA))
+
+    def test_unbound_chunks(self, tmp_path, data_key, mocker):
+        """
+        Assert that containers whose index chunks aren't bound to their ID
+        range, written before directories had a version, are still read.
+        """
+        mocker.patch("src.utils.container.INDEX_CHUNK_SIZE", 64)
+        mocker.patch("src.utils.container.DIRECTORY_VERSION", 1)
+        credentials = [credential(id) for id in range(1, 201)]
+
+        with (tmp_path / "vault").open("w+b") as file:
+            container.write(file, 0, credentials, data_key, ASSOCIATED_DATA)
+            assert list(container.iter_credentials(file, data_key, ASSOCIATED_DATA)) == credentials
+            assert container.find(file, 150, data_key, ASSOCIATED_DATA) == credential(150)
+
+    @pytest.mark.parametrize("threads", [1, 4])
+    def test_threads(self, tmp_path, data_key, mocker, threads):
+        """
+        Assert that containers written and read in the thread pool are the
+        same as without it.
+        """
+        mocker.patch("src.utils.container.INDEX_CHUNK_SIZE", 64)
+        mocker.patch("src.utils.constants.CRYPTO_THREADS", threads)
+        ids = list(range(1, 1001))
+        ids[900], ids[300] = ids[300], ids[900]
+
+        with (tmp_path / "vault").open("w+b") as file:
+            container.write(file, 0, (credential(id) for id in ids), data_key, ASSOCIATED_DATA)
+            mocker.patch("src.utils.constants.CRYPTO_THREADS", 5 - threads)
+
+            credentials = list(container.iter_credentials(file, data_key, ASSOCIATED_DATA))
+            assert credentials == [credential(id) for id in range(1, 1001)]
+            metadata = list(container.iter_metadata(file, data_key, ASSOCIATED_DATA))
+            assert [entry["id"] for entry in metadata] == list(range(1, 1001))
+
+def test_map_lookahead(mocker):
+    """
+    Assert that the thread pool runs a bounded number of calls ahead of the
+    results consumed, and none after the results are abandoned.
+    """
+    mocker.patch("src.utils.constants.CRYPTO_THREADS", 2)
+    calls = []
+
+    results = container._map(lambda item: calls.append(item) or item * 2, range(100))
+    assert next(results) == 0
+    results.close()
+
+    assert len(calls) <= container.LOOKAHEAD * 2 + 1
+    assert sorted(calls) == list(range(len(calls)))
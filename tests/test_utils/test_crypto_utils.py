@@ -0,0 +1,125 @@
+# Unit tests for `src.utils.crypto_utils`.
+from src.utils import crypto_utils
+import pytest
+
+class TestKeyCache:
+    """Unit tests for the derived key cache behind 'crypto_utils.generate_key'."""
+    @pytest.fixture(autouse=True)
+    def key_cache(self, mocker):
+        """
+        Use a cheap KDF and an empty cache for every test.
+        Return a spy on 'crypto_utils._derive_key'.
+        """
+        mocker.patch("src.utils.crypto_utils.constants.MASTER_PASSWORD", "master_password")
+        mocker.patch("src.utils.crypto_utils.constants.SCRYPT_N", 2 ** 4)
+        mocker.patch("src.utils.crypto_utils.constants.KEY_CACHE_SIZE", 2)
+        mocker.patch("src.utils.crypto_utils.constants.KEY_CACHE_TIMEOUT", 60)
+        crypto_utils.clear_key_cache()
+        yield mocker.spy(crypto_utils, "_derive_key")
+        crypto_utils.clear_key_cache()
+
+    def test_cache_hit(self, key_cache):
+        """
+        Assert that deriving the key for the same salt twice runs the KDF once
+        and returns the same key.
+        """
+        first = crypto_utils.generate_key(b"salt" * 4)
+        second = crypto_utils.generate_key(b"salt" * 4)
+
+        assert first == second
+        assert key_cache.call_count == 1
+
+    def test_kdf_parameters_are_part_of_the_key(self, mocker, key_cache):
+        """
+        Assert that changing the KDF parameters derives a new key.
+        """
+        first = crypto_utils.generate_key(b"salt" * 4)
+        mocker.patch("src.utils.crypto_utils.constants.SCRYPT_N", 2 ** 5)
+        second = crypto_utils.generate_key(b"salt" * 4)
+
+        assert first != second
+        assert key_cache.call_count == 2
+
+    def test_size_limit_wipes_evicted_key(self, key_cache):
+        """
+        Assert that the least recently used key is evicted and overwritten
+        once the cache is full.
+        """
+        crypto_utils.generate_key(b"a" * 16)
+        evicted = next(iter(crypto_utils._key_cache.values()))[0]
+        crypto_utils.generate_key(b"b" * 16)
+        crypto_utils.generate_key(b"c" * 16)
+
+        assert len(crypto_utils._key_cache) == 2
+        assert evicted == bytearray(len(evicted))
+
+        crypto_utils.generate_key(b"a" * 16)
+        assert key_cache.call_count == 4
+
+    def test_idle_timeout(self, mocker, key_cache):
+        """
+        Assert that keys left unused for longer than the timeout are dropped.
+        """
+        monotonic_mock = mocker.patch("src.utils.crypto_utils.time.monotonic", return_value=100)
+        crypto_utils.generate_key(b"salt" * 4)
+
+        monotonic_mock.return_value = 150
+        crypto_utils.generate_key(b"salt" * 4)
+        assert key_cache.call_count == 1
+
+        monotonic_mock.return_value = 211
+        crypto_utils.generate_key(b"salt" * 4)
+        assert key_cache.call_count == 2
+
+    def test_master_password_change_resets_cache(self, mocker, key_cache):
+        """
+        Assert that the cache is reset when 'constants.MASTER_PASSWORD' changes.
+        """
+        first = crypto_utils.generate_key(b"salt" * 4)
+        mocker.patch("src.utils.crypto_utils.constants.MASTER_PASSWORD", "new_password")
+        second = crypto_utils.generate_key(b"salt" * 4)
+
+        assert first != second
+        assert key_cache.call_count == 2
+        assert len(crypto_utils._key_cache) == 1
+
+class TestKDF:
+    """Unit tests for the KDF parameters of 'crypto_utils'."""
+    def test_legacy_header(self):
+        """
+        Assert that headers from before scrypt was used read as PBKDF2, and
+        that headers with KDF parameters return them.
+        """
+        assert crypto_utils.header_kdf({"iterations": 390000}) == {
+            "name": "pbkdf2-sha256", "iterations": 390000
+        }
+        assert crypto_utils.header_kdf({"kdf": crypto_utils.default_kdf()}) == crypto_utils.default_kdf()
+
+    def test_unknown_kdf(self, mocker):
+        """Assert that an unknown KDF raises ValueError."""
+        mocker.patch("src.utils.crypto_utils.constants.MASTER_PASSWORD", "master_password")
+        crypto_utils.clear_key_cache()
+
+        with pytest.raises(ValueError):
+            crypto_utils.generate_key(b"salt" * 4, {"name": "rot13"})
+
+    @pytest.mark.parametrize("kdf", [
+        {"name": "pbkdf2-sha256", "iterations": 1000},
+        {"name": "scrypt", "n": 2 ** 4, "r": 8, "p": 1},
+        {"name": "argon2id", "memory": 64, "iterations": 1, "lanes": 1}
+    ])
+    def test_registered_kdfs(self, kdf):
+        """
+        Assert that every registered KDF derives a 32-byte key that depends on
+        the password, the salt and the parameters.
+        """
+        key = crypto_utils.derive(kdf, b"password", b"salt" * 4)
+
+        assert len(key) == 32
+        assert key == crypto_utils.derive(kdf, b"password", b"salt" * 4)
+        assert key != crypto_utils.derive(kdf, b"passw0rd", b"salt" * 4)
+        assert key != crypto_utils.derive(kdf, b"password", b"SALT" * 4)
+        assert key != crypto_utils.derive(
+            {**kdf, "iterations": 2} if "iterations" in kdf else {**kdf, "p": 2},
+            b"password", b"salt" * 4
+        )
@@ -1,4 +1,5 @@
 from src.utils import helpers
+import sys
 
 class TestFilterCredentials:
     # Unit tests for 'helpers.filter_credentials'.
@@ -45,3 +46,60 @@ class TestFilterCredentials:
             password=None
         )
         assert duplicates == []
+
+def test_iter_filtered_credentials():
+    """
+    Assert that 'iter_filtered_credentials' filters any iterable lazily.
+    """
+    credentials = iter(TestFilterCredentials.credentials)
+    matches = helpers.iter_filtered_credentials(credentials, service="service2")
+
+    assert next(matches) == TestFilterCredentials.credentials[1]
+    assert list(matches) == []
+
+def test_filter_credentials_with_index():
+    """
+    Assert that 'filter_credentials' gives the same results with an index,
+    including rules matching None.
+    """
+    credentials = [
+        {"service": f"service{id % 3}", "password": "password", "username": None,
+         "email": f"email{id % 2}" if id % 5 else None, "id": id}
+        for id in range(30)
+    ]
+    index = helpers.build_index(credentials)
+
+    for rules in (
+        {"service": "service1"},
+        {"service": "service1", "email": "email1"},
+        {"email": None, "username": None},
+        {"service": "missing"},
+        {"password": "password", "service": "service2"}
+    ):
+        expected = [
+            cred for cred in credentials
+            if all(cred[key] == value for key, value in rules.items())
+        ]
+        assert helpers.filter_credentials(credentials, **rules, index=index) == expected
+        assert helpers.filter_credentials(credentials, **rules) == expected
+
+def test_intersect():
+    """Assert that 'intersect' returns the items common to sorted lists."""
+    assert helpers.intersect([[1, 3, 5, 7, 9], [3, 4, 5], [0, 3, 5, 9]]) == [3, 5]
+    assert helpers.intersect([[1, 2], []]) == []
+
+def test_lazy_import(monkeypatch):
+    """
+    Assert that 'lazy_import' loads a module on first use, and returns
+    modules already imported as they are.
+    """
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+
+    colorsys = helpers.lazy_import("colorsys")
+    # A lazy module turns into a plain module once loaded.
+    assert type(colorsys) is not type(sys)
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert type(colorsys) is type(sys)
+    assert helpers.lazy_import("colorsys") is colorsys
+    assert helpers.lazy_import("bisect") is sys.modules["bisect"]
+
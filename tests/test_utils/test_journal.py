@@ -0,0 +1,96 @@
+# Unit tests for `src.utils.journal`.
+from src.utils import journal, crypto_utils
+from cryptography.exceptions import InvalidTag
+import pytest, stat
+
+ASSOCIATED_DATA = b"associated data"
+OPERATIONS = [
+    {"op": "add", "credential": {"service": "service1", "id": 101}},
+    {"op": "remove", "id": 101}
+]
+
+@pytest.fixture
+def data_key():
+    return crypto_utils.generate_data_key()
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "journal"
+
+def test_round_trip(path, data_key):
+    """Assert that appended operations are read back in order."""
+    for operation in OPERATIONS:
+        size = journal.append(path, 1, operation, data_key, ASSOCIATED_DATA)
+
+    assert size == path.stat().st_size
+    assert journal.read(path, 1, data_key, ASSOCIATED_DATA) == OPERATIONS
+    assert journal.count(path, 1) == 2
+    assert journal.count(path, 2) == 0
+
+def test_missing_journal(path, data_key):
+    """Assert that a missing journal has no operations."""
+    assert journal.read(path, 1, data_key, ASSOCIATED_DATA) == []
+
+def test_other_generation(path, data_key):
+    """
+    Assert that a journal of another generation is ignored, and started over
+    by the next append.
+    """
+    journal.append(path, 1, OPERATIONS[0], data_key, ASSOCIATED_DATA)
+
+    assert journal.read(path, 2, data_key, ASSOCIATED_DATA) == []
+
+    journal.append(path, 2, OPERATIONS[1], data_key, ASSOCIATED_DATA)
+    assert journal.read(path, 2, data_key, ASSOCIATED_DATA) == OPERATIONS[1:]
+
+def test_torn_tail(path, data_key):
+    """
+    Assert that a partially written operation is ignored, and dropped by the
+    next append.
+    """
+    journal.append(path, 1, OPERATIONS[0], data_key, ASSOCIATED_DATA)
+    with open(path, "ab") as file:
+        file.write(b"\x00\x00\x01\x00partial")
+
+    assert journal.read(path, 1, data_key, ASSOCIATED_DATA) == OPERATIONS[:1]
+
+    journal.append(path, 1, OPERATIONS[1], data_key, ASSOCIATED_DATA)
+    assert journal.read(path, 1, data_key, ASSOCIATED_DATA) == OPERATIONS
+
+def test_tampered_operation(path, data_key):
+    """Assert that a modified operation is rejected."""
+    journal.append(path, 1, OPERATIONS[0], data_key, ASSOCIATED_DATA)
+    contents = bytearray(path.read_bytes())
+    contents[-1] ^= 1
+    path.write_bytes(bytes(contents))
+
+    with pytest.raises(InvalidTag):
+        journal.read(path, 1, data_key, ASSOCIATED_DATA)
+
+def test_permissions(path, data_key):
+    """Assert that a new journal is only readable by the user."""
+    journal.append(path, 1, OPERATIONS[0], data_key, ASSOCIATED_DATA)
+
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+def test_append_reads_new_operations(path, data_key, mocker):
+    """
+    Assert that appending only reads the operations appended by other
+    processes since this one last appended.
+    """
+    scan_spy = mocker.spy(journal, "_scan")
+    journal.append(path, 1, OPERATIONS[0], data_key, ASSOCIATED_DATA)
+    ends = dict(journal._ends)
+
+    # Another process appends.
+    journal._ends.clear()
+    journal.append(path, 1, OPERATIONS[1], data_key, ASSOCIATED_DATA)
+    other_size = len(path.read_bytes()) - ends[path][2]
+
+    journal._ends.update(ends)
+    journal.append(path, 1, OPERATIONS[0], data_key, ASSOCIATED_DATA)
+    assert len(scan_spy.call_args.args[0]) == other_size
+
+    journal.append(path, 1, OPERATIONS[1], data_key, ASSOCIATED_DATA)
+    assert scan_spy.call_args.args[0] == b""
+    assert journal.read(path, 1, data_key, ASSOCIATED_DATA) == OPERATIONS * 2
@@ -0,0 +1,47 @@
+# Unit tests for `src.utils.model`.
+from src.utils import model
+import json, pytest
+
+FIELDS = {"service": "github.com", "username": "alice", "email": None, "id": 101, "password": "hunter2"}
+
+class TestCredential:
+    """Unit tests for 'model.Credential'."""
+    def test_mapping(self):
+        """Assert that a credential reads like the dict it was made from."""
+        credential = model.Credential(FIELDS)
+
+        assert credential == FIELDS and FIELDS == credential
+        assert dict(credential) == {**credential} == FIELDS
+        assert list(credential) == list(model.FIELDS)
+        assert len(credential) == 5
+        assert credential["service"] == credential.service == "github.com"
+        assert credential.get("email", "default") is None
+        assert credential != {**FIELDS, "id": 102}
+        assert json.loads(json.dumps(credential, default=dict)) == FIELDS
+
+    def test_absent_fields(self):
+        """Assert that missing fields aren't in the mapping, and other fields are kept."""
+        credential = model.Credential({"service": "github.com", "id": 101, "notes": [1, 2]})
+
+        assert "password" not in credential
+        assert credential.password is model.ABSENT
+        assert credential.get("password") is None
+        with pytest.raises(KeyError):
+            credential["password"]
+
+        assert credential["notes"] == [1, 2]
+        assert dict(credential) == {"service": "github.com", "id": 101, "notes": [1, 2]}
+
+    def test_interned(self):
+        """Assert that credentials sharing a service share one string."""
+        first = model.Credential({"service": "".join(["git", "hub.com"])})
+        second = model.Credential({"service": "".join(["githu", "b.com"])})
+
+        assert first.service is second.service
+
+    def test_of(self):
+        """Assert that 'Credential.of' converts mappings and keeps credentials."""
+        credential = model.Credential.of(FIELDS)
+
+        assert isinstance(credential, model.Credential)
+        assert model.Credential.of(credential) is credential
@@ -0,0 +1,97 @@
+# Unit tests for `src.utils.passwords`.
+from src.utils import passwords
+import collections, itertools, pytest
+
+class TestPolicy:
+    """Unit tests for 'passwords.Policy'."""
+    def test_count(self):
+        """Assert that the passwords meeting the policy are counted."""
+        # One letter and two digits, or three digits.
+        policy = passwords.Policy(
+            3, ("lower", "digits"), {"digits": 2},
+            exclude="".join(sorted(set(passwords.CLASSES["lower"]) - {"a", "b"})) + "23456789"
+        )
+
+        assert policy.alphabets == ["ab", "01"]
+        assert policy.count == 3 * 2 * 2 * 2 + 2 ** 3
+        assert policy.entropy() == 5
+
+    @pytest.mark.parametrize("arguments", [
+        {"length": 3, "minimums": {"digits": 4}},
+        {"length": 0},
+        {"classes": ("lower", "emoji")},
+        {"classes": ("lower",), "minimums": {"digits": 1}},
+        {"classes": ("digits",), "exclude": "0123456789"}
+    ])
+    def test_invalid(self, arguments):
+        """Assert that policies no password meets are rejected."""
+        with pytest.raises(ValueError):
+            passwords.Policy(**arguments)
+
+class TestGeneratePasswords:
+    """Unit tests for 'passwords.generate_passwords'."""
+    def test_policy(self):
+        """Assert that every password meets the policy."""
+        policy = passwords.Policy(
+            20, ("lower", "upper", "digits", "symbols"), {"upper": 2, "digits": 5, "symbols": 3},
+            exclude=passwords.AMBIGUOUS
+        )
+
+        for password in passwords.generate_passwords(200, policy):
+            assert len(password) == 20
+            assert sum(char.isupper() for char in password) >= 2
+            assert sum(char.isdigit() for char in password) >= 5
+            assert sum(char in passwords.CLASSES["symbols"] for char in password) >= 3
+            assert not set(password) & set(passwords.AMBIGUOUS)
+
+    def test_uniform(self):
+        """
+        Assert that every password meeting the policy is about equally
+        likely, including the rarer ones with more digits than the minimum.
+        """
+        policy = passwords.Policy(3, ("lower", "digits"), {"digits": 2}, exclude="".join(
+            sorted(set(passwords.CLASSES["lower"]) - {"a", "b"})
+        ) + "23456789")
+
+        counts = collections.Counter(passwords.generate_passwords(32000, policy))
+
+        assert len(counts) == policy.count == 32
+        # 1000 expected each; 6 standard deviations is about 190.
+        assert all(800 < count < 1200 for count in counts.values())
+
+    def test_batched_randomness(self, mocker):
+        """Assert that random bytes are read from the system in batches."""
+        urandom_spy = mocker.spy(passwords.os, "urandom")
+
+        list(passwords.generate_passwords(100, passwords.Policy(16)))
+
+        assert urandom_spy.call_count <= 2
+
+def test_shuffle():
+    """Assert that every order is about equally likely."""
+    random = passwords.RandomSource()
+    counts = collections.Counter()
+    for _ in range(24000):
+        items = list("abcd")
+        random.shuffle(items)
+        counts["".join(items)] += 1
+
+    assert set(counts) == {"".join(order) for order in itertools.permutations("abcd")}
+    assert all(800 < count < 1200 for count in counts.values())
+
+def test_generate_passphrases(tmp_path):
+    """
+    Assert that passphrases are words of the word list, whose duplicates
+    and dice rolls are dropped.
+    """
+    path = tmp_path / "words.txt"
+    path.write_text("11111\tapple\n11112\tbanana\n\n11113\tapple\ncherry\n")
+
+    wordlist = passwords.read_wordlist(path)
+    passphrases = list(passwords.generate_passphrases(50, 4, wordlist, "."))
+
+    assert wordlist == ["apple", "banana", "cherry"]
+    assert len(passphrases) == 50
+    assert all(len(passphrase.split(".")) == 4 for passphrase in passphrases)
+    assert {word for passphrase in passphrases for word in passphrase.split(".")} == set(wordlist)
+    assert passwords.passphrase_entropy(4, ["a", "b"]) == 4
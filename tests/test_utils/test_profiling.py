@@ -0,0 +1,73 @@
+# Unit tests for `src.utils.profiling`.
+from src.utils import profiling
+import pytest, json, pstats, tracemalloc
+
+@profiling.traced
+def inner():
+    return "result"
+
+@profiling.traced
+def outer():
+    with profiling.span("block"):
+        inner()
+    return inner()
+
+@pytest.fixture(autouse=True)
+def stop_tracing():
+    """Turn tracing off after every test."""
+    yield
+    profiling.stop()
+
+def test_disabled():
+    """Assert that nothing is recorded while tracing is off."""
+    assert outer() == "result"
+    assert profiling.span("block") is profiling._NO_SPAN
+    assert profiling._events == []
+
+def test_table(tmp_path):
+    """Assert that the table shows nested phases with their calls."""
+    report = tmp_path / "report.txt"
+    profiling.start(f"table,file={report}")
+    outer()
+    profiling.stop()
+
+    lines = report.read_text().splitlines()
+    assert lines[0].split() == ["Phase", "Calls", "Total", "(ms)", "Self", "(ms)"]
+    assert [line.split()[:2] for line in lines[1:4]] == [
+        ["test_profiling.outer", "1"], ["block", "1"], ["test_profiling.inner", "1"]
+    ]
+    assert lines[3].startswith("    test_profiling.inner")
+    assert lines[4].split()[:2] == ["test_profiling.inner", "1"]
+    assert lines[4].startswith("  test_profiling.inner")
+    assert lines[-1].startswith("Total: ")
+
+def test_trace_events(tmp_path):
+    """Assert that JSON output holds one complete event per span."""
+    trace = tmp_path / "trace.json"
+    profiling.start(f"json,file={trace}")
+    outer()
+    profiling.stop()
+
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == [
+        "test_profiling.outer", "block", "test_profiling.inner", "test_profiling.inner"
+    ]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+def test_dumps(tmp_path, capsys):
+    """Assert that cProfile stats and a tracemalloc snapshot are saved."""
+    profiling.start(f"cprofile={tmp_path / 'stats'},tracemalloc={tmp_path / 'memory'}")
+    outer()
+    profiling.stop()
+
+    assert "Peak memory traced" in capsys.readouterr().err
+    assert pstats.Stats(str(tmp_path / "stats")).total_calls > 0
+    tracemalloc.Snapshot.load(str(tmp_path / "memory"))
+    assert not tracemalloc.is_tracing()
+
+def test_unknown_option():
+    """Assert that an unknown option raises ValueError and tracing stays off."""
+    with pytest.raises(ValueError):
+        profiling.start("table,flamegraph")
+
+    assert not profiling._enabled
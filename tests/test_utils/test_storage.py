@@ -0,0 +1,816 @@
+# Unit tests for `src.utils.storage`.
+from src.utils import storage, container, crypto_utils, constants, helpers, model
+from cryptography.fernet import Fernet, InvalidToken
+import pytest, base64, json, os, threading
+
+CREDENTIALS = [
+    {
+        "service": "service1",
+        "password": "password1",
+        "username": "username1",
+        "email": "email1",
+        "id": 101
+    },
+    {
+        "service": "service2",
+        "password": "password2",
+        "username": None,
+        "email": None,
+        "id": 102
+    }
+]
+
+def write_bound_vault(header: dict, credentials: list, data_key: bytes) -> None:
+    """
+    Write a vault file authenticating its whole header with the body, as
+    vaults were written before headers had unbound fields.
+    """
+    encoded_header = storage._encode_header(header)
+    with constants.VAULT.open("w+b") as file:
+        file.write(storage.VAULT_MAGIC + len(encoded_header).to_bytes(4, "big") + encoded_header)
+        container.write(
+            file, file.tell(), credentials, data_key, storage.VAULT_MAGIC + encoded_header
+        )
+
+def read_header():
+    """Return the header of the vault file."""
+    with constants.VAULT.open("rb") as file:
+        return storage._read_header(file)
+
+class TestVault:
+    """Unit tests for 'storage.read_vault' and 'storage.write_vault'."""
+    def test_missing_vault(self, unlocked):
+        """Assert that a missing vault reads as an empty list."""
+        assert storage.read_vault() == []
+
+    def test_round_trip(self, unlocked):
+        """Assert that written credentials are read back unchanged."""
+        storage.write_vault(CREDENTIALS)
+
+        assert constants.VAULT.read_bytes().startswith(storage.VAULT_MAGIC)
+        assert storage.read_vault() == CREDENTIALS
+
+    def test_write_keeps_header(self, unlocked, mocker):
+        """
+        Assert that rewriting an existing vault reuses its header and
+        doesn't run the password KDF again.
+        """
+        storage.write_vault(CREDENTIALS)
+        header = read_header()
+
+        crypto_utils.clear_key_cache()
+        derive_spy = mocker.spy(crypto_utils, "_derive_key")
+        storage.read_vault()
+        storage.write_vault(CREDENTIALS[:1])
+
+        assert read_header() == {
+            **header,
+            "generation": header["generation"] + 1,
+            "next_id": 103,
+            "version": header["version"] + 1
+        }
+        assert derive_spy.call_count == 1
+        assert storage.read_vault() == CREDENTIALS[:1]
+
+    def test_wrong_password(self, unlocked, mocker):
+        """Assert that the vault can't be read with the wrong password."""
+        storage.write_vault(CREDENTIALS)
+        mocker.patch.object(constants, "MASTER_PASSWORD", "wrong_password")
+
+        with pytest.raises(InvalidToken):
+            storage.read_vault()
+
+    def test_legacy_vault_upgrade(self, unlocked):
+        """
+        Assert that a vault in the original format is read and rewritten in
+        the current format.
+        """
+        salt = os.urandom(16)
+        key = crypto_utils.generate_key(
+            salt, {"name": "pbkdf2-sha256", "iterations": constants.PBKDF2_ITERATIONS}
+        )
+        ciphertext = Fernet(key).encrypt(
+            json.dumps(CREDENTIALS).encode("utf-8")
+        )
+        constants.VAULT.write_text(
+            f"{base64.b64encode(salt).decode()}:{base64.b64encode(ciphertext).decode()}"
+        )
+
+        assert storage.read_vault() == CREDENTIALS
+        assert constants.VAULT.read_bytes().startswith(storage.VAULT_MAGIC)
+        assert storage.read_vault() == CREDENTIALS
+
+class TestMasterPassword:
+    """Unit tests for 'storage.unlock' and 'storage.set_master_password'."""
+    def test_unlock(self, unlocked, mocker):
+        """
+        Assert that 'unlock' checks the master password by running the KDF
+        once, and that reading the vault afterwards doesn't run it again.
+        """
+        storage.write_vault(CREDENTIALS)
+        crypto_utils.clear_key_cache()
+        derive_spy = mocker.spy(crypto_utils, "_derive_key")
+
+        assert storage.unlock()
+        assert storage.read_vault() == CREDENTIALS
+        assert derive_spy.call_count == 1
+
+        mocker.patch.object(constants, "MASTER_PASSWORD", "wrong_password")
+        assert not storage.unlock()
+
+    def test_unlock_without_vault(self, unlocked):
+        """Assert that there is nothing to unlock without a vault."""
+        assert not storage.exists()
+        assert not storage.unlock()
+
+    def test_pbkdf2_vault_upgrade(self, unlocked):
+        """
+        Assert that unlocking a vault from before KDF parameters were stored,
+        whose key is derived with PBKDF2, rewrites it with the default KDF.
+        """
+        salt = os.urandom(16)
+        data_key = crypto_utils.generate_data_key()
+        pbkdf2 = {"name": "pbkdf2-sha256", "iterations": constants.PBKDF2_ITERATIONS}
+        header = {
+            "generation": 0,
+            "iterations": constants.PBKDF2_ITERATIONS,
+            "next_id": storage.FIRST_ID,
+            "salt": base64.b64encode(salt).decode("utf-8"),
+            "version": 0,
+            "wrapped_key": base64.b64encode(
+                crypto_utils.wrap_key(data_key, salt, pbkdf2)
+            ).decode("utf-8")
+        }
+        write_bound_vault(header, CREDENTIALS, data_key)
+        storage.add_credential({**CREDENTIALS[0], "service": "journaled"})
+
+        assert storage.unlock()
+        assert read_header()["kdf"] == crypto_utils.default_kdf()
+        assert not constants.JOURNAL.exists()
+        assert [credential["service"] for credential in storage.read_vault()] == [
+            "service1", "service2", "journaled"
+        ]
+
+    def test_set_kdf(self, unlocked):
+        """
+        Assert that the vault's key can be derived with another KDF, and
+        that changing the master password keeps the vault's KDF.
+        """
+        pbkdf2 = {"name": "pbkdf2-sha256", "iterations": 1000}
+        storage.write_vault(CREDENTIALS)
+        storage.set_kdf(pbkdf2)
+
+        assert storage.kdf() == pbkdf2
+        assert storage.unlock()
+        assert storage.kdf() == pbkdf2
+
+        storage.set_master_password("new_password")
+        assert storage.kdf() == pbkdf2
+        assert storage.read_vault() == CREDENTIALS
+
+    def test_set_format(self, unlocked, mocker):
+        """
+        Assert that the vault's records can be converted between formats
+        without deriving the key again, and that vaults without a format
+        are JSON.
+        """
+        mocker.patch("src.utils.constants.RECORD_FORMAT", "json")
+        storage.write_vault(CREDENTIALS)
+        storage.add_credential({"service": "journaled", "password": "p", "username": None, "email": None})
+        contents = storage.read_vault()
+        assert storage.record_format() == "json"
+
+        derive_spy = mocker.spy(crypto_utils, "derive")
+        storage.set_format("binary")
+        assert storage.record_format() == "binary"
+        assert storage.read_vault() == contents
+        derive_spy.assert_not_called()
+
+        storage.set_format("json")
+        assert storage.record_format() == "json"
+        assert storage.read_vault() == contents
+
+        with pytest.raises(ValueError):
+            storage.set_format("xml")
+
+    def test_set_master_password(self, unlocked, mocker):
+        """
+        Assert that the vault can only be read with the new master password
+        once it is set, and that a missing vault is created.
+        """
+        storage.set_master_password("first_password")
+        assert storage.exists()
+        assert storage.read_vault() == []
+
+        storage.write_vault(CREDENTIALS)
+        storage.set_master_password("second_password")
+
+        assert constants.MASTER_PASSWORD == "second_password"
+        assert storage.read_vault() == CREDENTIALS
+
+        mocker.patch.object(constants, "MASTER_PASSWORD", "first_password")
+        assert not storage.unlock()
+
+class TestRewrap:
+    """Unit tests for wrapping the vault's key again ('storage._rewrap')."""
+    def body(self):
+        """Return the vault file after its header."""
+        contents = constants.VAULT.read_bytes()
+        start = len(storage.VAULT_MAGIC)
+        return contents[start + 4 + int.from_bytes(contents[start:start + 4], "big"):]
+
+    def test_header_only(self, unlocked, mocker):
+        """
+        Assert that changing the master password rewrites the header alone,
+        keeping the body and the journal, and reports progress in bytes.
+        """
+        storage.write_vault(CREDENTIALS)
+        storage.add_credential({**CREDENTIALS[0], "service": "journaled"})
+        contents = storage.read_vault()
+        body, header = self.body(), read_header()
+        write_spy = mocker.spy(storage.container, "write")
+        progress = mocker.Mock()
+
+        storage.set_master_password("new_password", progress=progress)
+
+        write_spy.assert_not_called()
+        assert self.body() == body
+        assert constants.JOURNAL.exists()
+        assert read_header()["version"] == header["version"] + 1
+        assert read_header()["salt"] != header["salt"]
+        progress.assert_called_with(len(body), len(body))
+        assert storage.read_vault() == contents
+
+        mocker.patch.object(constants, "MASTER_PASSWORD", "master_password")
+        assert not storage.unlock()
+
+    def test_header_doesnt_fit(self, unlocked, mocker):
+        """Assert that the vault is sealed again when the new header is longer."""
+        mocker.patch.object(storage, "HEADER_SPACE", 0)
+        storage.write_vault(CREDENTIALS)
+        body = self.body()
+        progress = mocker.Mock()
+
+        storage._rewrap("new_password", {"name": "pbkdf2-sha256", "iterations": 1000}, progress)
+
+        assert self.body() != body
+        progress.assert_called_with(2, 2)
+        assert storage.read_vault() == CREDENTIALS
+
+    def test_bound_header(self, unlocked):
+        """
+        Assert that a vault authenticating its whole header is sealed again
+        in full, after which its key wrap is unbound.
+        """
+        storage.write_vault([])
+        header = read_header()
+        del header["unbound"]
+        write_bound_vault(header, CREDENTIALS, storage._unwrap_data_key(header))
+        storage.add_credential({**CREDENTIALS[0], "service": "journaled"})
+
+        storage.set_master_password("new_password")
+
+        assert set(read_header()["unbound"]) == set(storage.UNBOUND_FIELDS)
+        assert not constants.JOURNAL.exists()
+        assert [credential["service"] for credential in storage.read_vault()] == [
+            "service1", "service2", "journaled"
+        ]
+
+    @pytest.mark.parametrize("failure", [KeyboardInterrupt, ValueError])
+    def test_interrupted(self, unlocked, mocker, failure):
+        """
+        Assert that the vault, the master password and the data directory
+        are left as they were when writing or verifying the new vault file
+        fails.
+        """
+        storage.write_vault(CREDENTIALS)
+        vault = constants.VAULT.read_bytes()
+        if failure is KeyboardInterrupt:
+            progress = mocker.Mock(side_effect=KeyboardInterrupt)
+        else:
+            progress = None
+            mocker.patch.object(storage, "_verify", side_effect=ValueError)
+
+        with pytest.raises(failure):
+            storage.set_master_password("new_password", progress=progress)
+
+        assert constants.VAULT.read_bytes() == vault
+        assert constants.MASTER_PASSWORD == "master_password"
+        assert not list(constants.VAULT.parent.glob("*.tmp"))
+        assert storage.read_vault() == CREDENTIALS
+
+    def test_verify(self, unlocked, tmp_path):
+        """Assert that a vault file holding another data key is rejected."""
+        storage.write_vault(CREDENTIALS)
+        data_key = storage._unwrap_data_key(read_header())
+
+        storage._verify(constants.VAULT, data_key, 2)
+        with pytest.raises(ValueError):
+            storage._verify(constants.VAULT, data_key, 3)
+        with pytest.raises(ValueError):
+            storage._verify(constants.VAULT, crypto_utils.generate_data_key())
+
+class TestCredentials:
+    """Unit tests for the credentials storage returns."""
+    def test_credential_objects(self, unlocked):
+        """
+        Assert that credentials are read as `model.Credential` objects from
+        the vault file, the journal and the cache, and can be written back.
+        """
+        storage.write_vault(CREDENTIALS)
+        credential = storage.get_credential(101)
+        assert storage.update_credential(credential)
+        storage.add_credential({**credential, "service": "service3"})
+
+        vault = storage.read_vault()
+        assert all(isinstance(credential, model.Credential) for credential in vault)
+        assert vault[0] == CREDENTIALS[0]
+        assert all(isinstance(credential, model.Credential) for credential in storage.read_metadata())
+
+        storage.enable_cache()
+        try:
+            cached = storage.read_vault()
+            storage.add_credential({**credential, "service": "service4"})
+            assert all(isinstance(credential, model.Credential) for credential in storage.read_vault())
+        finally:
+            storage.disable_cache()
+
+        assert cached == vault
+
+class TestSessionCache:
+    """Unit tests for the session cache ('storage.enable_cache')."""
+    @pytest.fixture(autouse=True)
+    def cache(self, unlocked):
+        """Write a vault and enable the cache."""
+        storage.write_vault(CREDENTIALS)
+        storage.enable_cache()
+        yield
+        storage.disable_cache()
+
+    def test_cache_hit(self, mocker):
+        """Assert that an unchanged vault is decrypted only once."""
+        read_spy = mocker.spy(storage, "_read_vault_file")
+
+        assert storage.read_vault() == CREDENTIALS
+        assert storage.read_vault() == CREDENTIALS
+        assert read_spy.call_count == 1
+
+    def test_returned_list_is_a_copy(self):
+        """Assert that modifying the returned list doesn't modify the cache."""
+        storage.read_vault().clear()
+        assert storage.read_vault() == CREDENTIALS
+
+    def test_reload_on_change(self, mocker):
+        """Assert that the vault is read again when the file changes."""
+        storage.read_vault()
+
+        storage.disable_cache()
+        storage.write_vault(CREDENTIALS[:1])
+        storage.enable_cache()
+        read_spy = mocker.spy(storage, "_read_vault_file")
+
+        assert storage.read_vault() == CREDENTIALS[:1]
+        assert read_spy.call_count == 1
+
+    def test_write_updates_cache(self, mocker):
+        """Assert that a write doesn't invalidate the cache."""
+        storage.write_vault(CREDENTIALS[:1])
+        read_spy = mocker.spy(storage, "_read_vault_file")
+
+        assert storage.read_vault() == CREDENTIALS[:1]
+        assert not read_spy.called
+
+    def test_deferred_writes(self):
+        """
+        Assert that deferred writes only reach the vault file on 'sync'.
+        """
+        storage.enable_cache(defer_writes=True)
+        before = constants.VAULT.read_bytes()
+
+        storage.write_vault(CREDENTIALS[:1])
+        assert storage.read_vault() == CREDENTIALS[:1]
+        assert constants.VAULT.read_bytes() == before
+
+        assert storage.sync()
+        assert not storage.sync()
+
+        storage.disable_cache()
+        assert storage.read_vault() == CREDENTIALS[:1]
+
+class TestSingleCredential:
+    """Unit tests for 'storage.get_credential' and 'storage.remove_credential'."""
+    def test_get_credential(self, unlocked):
+        storage.write_vault(CREDENTIALS)
+
+        assert storage.get_credential(102) == CREDENTIALS[1]
+        assert storage.get_credential(103) is None
+
+    def test_missing_vault(self, unlocked):
+        assert storage.get_credential(101) is None
+        assert not storage.remove_credential(101)
+
+    def test_remove_credential(self, unlocked):
+        storage.write_vault(CREDENTIALS)
+
+        assert storage.remove_credential(101)
+        assert not storage.remove_credential(101)
+        assert storage.read_vault() == CREDENTIALS[1:]
+
+    def test_remove_credential_updates_cache(self, unlocked, mocker):
+        """Assert that removing a credential keeps the session cache current."""
+        storage.write_vault(CREDENTIALS)
+        storage.enable_cache()
+        storage.read_vault()
+
+        try:
+            assert storage.remove_credential(101)
+            read_spy = mocker.spy(storage, "_read_vault_file")
+            assert storage.read_vault() == CREDENTIALS[1:]
+            assert not read_spy.called
+        finally:
+            storage.disable_cache()
+
+def test_read_metadata(unlocked, mocker):
+    """
+    Assert that 'storage.read_metadata' returns every credential without
+    its password and doesn't decrypt any frame.
+    """
+    storage.write_vault(CREDENTIALS)
+    read_frame_spy = mocker.spy(storage.container, "_read_frame")
+
+    metadata = storage.read_metadata()
+
+    assert metadata == [
+        {key: value for key, value in cred.items() if key != "password"}
+        for cred in CREDENTIALS
+    ]
+    assert not read_frame_spy.called
+
+class TestStreaming:
+    """Unit tests for 'storage.iter_vault' and streaming writes."""
+    def test_rewrite_from_iter_vault(self, unlocked):
+        """
+        Assert that the vault can be rewritten from a generator reading it.
+        """
+        storage.write_vault(CREDENTIALS)
+
+        storage.write_vault(
+            {**cred, "service": cred["service"].upper()}
+            for cred in storage.iter_vault()
+        )
+
+        assert [cred["service"] for cred in storage.read_vault()] == ["SERVICE1", "SERVICE2"]
+        assert not list(constants.DATA_DIR.glob("*.tmp"))
+
+    def test_failed_write_keeps_vault(self, unlocked):
+        """Assert that a write failing halfway leaves the vault untouched."""
+        storage.write_vault(CREDENTIALS)
+
+        def credentials():
+            yield CREDENTIALS[0]
+            raise RuntimeError
+
+        with pytest.raises(RuntimeError):
+            storage.write_vault(credentials())
+
+        assert storage.read_vault() == CREDENTIALS
+        assert not list(constants.DATA_DIR.glob("*.tmp"))
+
+class TestJournal:
+    """Unit tests for the journal of single credential changes."""
+    def test_changes_leave_vault_file_untouched(self, unlocked):
+        """
+        Assert that adding, updating and removing credentials only appends
+        to the journal, and that reads see the changes.
+        """
+        storage.write_vault(CREDENTIALS)
+        vault = constants.VAULT.read_bytes()
+
+        storage.add_credential({**CREDENTIALS[0], "id": 103})
+        assert storage.update_credential({**CREDENTIALS[1], "service": "changed"})
+        assert storage.remove_credential(101)
+        assert not storage.update_credential({**CREDENTIALS[0], "id": 999})
+
+        assert constants.VAULT.read_bytes() == vault
+        assert constants.JOURNAL.exists()
+        assert storage.read_vault() == [
+            {**CREDENTIALS[1], "service": "changed"},
+            {**CREDENTIALS[0], "id": 103}
+        ]
+        assert storage.get_credential(101) is None
+        assert storage.get_credential(103) == {**CREDENTIALS[0], "id": 103}
+        assert [cred["id"] for cred in storage.read_metadata()] == [102, 103]
+        assert "password" not in storage.read_metadata()[1]
+
+    def test_add_to_missing_vault(self, unlocked):
+        """Assert that adding a credential creates the vault."""
+        storage.add_credential(CREDENTIALS[0])
+
+        assert storage.read_vault() == CREDENTIALS[:1]
+
+    def test_compact(self, unlocked):
+        """
+        Assert that compaction writes the changes into a new vault file and
+        discards the journal.
+        """
+        storage.write_vault(CREDENTIALS)
+        generation = read_header()["generation"]
+        storage.remove_credential(101)
+
+        storage.compact()
+
+        assert not constants.JOURNAL.exists()
+        assert read_header()["generation"] == generation + 1
+        assert storage.read_vault() == CREDENTIALS[1:]
+
+    def test_compaction_threshold(self, unlocked, mocker):
+        """
+        Assert that the vault is compacted in the background once the
+        journal grows past the threshold.
+        """
+        mocker.patch.object(constants, "JOURNAL_COMPACTION_SIZE", 500)
+        storage.write_vault(CREDENTIALS)
+
+        for id in range(200, 210):
+            storage.add_credential({**CREDENTIALS[0], "id": id})
+        storage._compaction_thread.join()
+
+        assert read_header()["generation"] > 0
+        assert [cred["id"] for cred in storage.read_vault()] == [101, 102, *range(200, 210)]
+
+    def test_stale_journal_is_ignored(self, unlocked):
+        """
+        Assert that a journal left behind by an interrupted compaction isn't
+        replayed over the new vault file.
+        """
+        storage.write_vault(CREDENTIALS)
+        storage.remove_credential(101)
+        journal = constants.JOURNAL.read_bytes()
+
+        storage.compact()
+        storage.add_credential({**CREDENTIALS[0], "id": 101})
+        storage.compact()
+        constants.JOURNAL.write_bytes(journal)
+
+        assert storage.read_vault() == CREDENTIALS
+
+class TestConcurrency:
+    """Unit tests for the vault lock and merging concurrent writes."""
+    @pytest.fixture
+    def other_process(self):
+        """
+        Return a function running a storage function the way another process
+        would: without this process's session cache.
+        """
+        def run(function, *args):
+            enabled = storage._cache_enabled
+            storage._cache_enabled = False
+            try:
+                return function(*args)
+            finally:
+                storage._cache_enabled = enabled
+
+        yield run
+        storage.disable_cache()
+
+    def test_readers_share_the_lock(self):
+        """
+        Assert that readers don't block each other, and that a writer waits
+        for readers to finish.
+        """
+        def hold_lock(exclusive):
+            with storage._lock(exclusive):
+                pass
+
+        with storage._lock():
+            reader = threading.Thread(target=hold_lock, args=(False,))
+            reader.start()
+            reader.join(timeout=5)
+            assert not reader.is_alive()
+
+            writer = threading.Thread(target=hold_lock, args=(True,))
+            writer.start()
+            writer.join(timeout=0.2)
+            assert writer.is_alive()
+
+        writer.join(timeout=5)
+        assert not writer.is_alive()
+
+    def test_concurrent_adds(self, unlocked):
+        """
+        Assert that credentials added at once under the same ID are all
+        kept, each under its own ID.
+        """
+        storage.write_vault(CREDENTIALS)
+        threads = [
+            threading.Thread(
+                target=storage.add_credential,
+                args=({**CREDENTIALS[0], "service": f"service{index}"},)
+            )
+            for index in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        credentials = storage.read_vault()
+        assert len(credentials) == 12
+        assert len({cred["id"] for cred in credentials}) == 12
+        assert {f"service{index}" for index in range(10)} <= {
+            cred["service"] for cred in credentials
+        }
+
+    def test_version(self, unlocked):
+        """Assert that every change increments the version of the vault."""
+        storage.write_vault(CREDENTIALS)
+        assert storage._read_vault_file()[1] == 1
+
+        storage.remove_credential(101)
+        storage.add_credential(CREDENTIALS[0])
+        assert storage._read_vault_file()[1] == 3
+
+        storage.compact()
+        assert storage._read_vault_file()[1] == 3
+
+    def test_sync_merges_concurrent_changes(self, unlocked, other_process):
+        """
+        Assert that deferred writes are merged with the changes another
+        process made in the meantime instead of overwriting them.
+        """
+        storage.write_vault(CREDENTIALS)
+        storage.enable_cache(defer_writes=True)
+        storage.read_vault()
+
+        assert storage.update_credential({**CREDENTIALS[0], "service": "changed"})
+        storage.add_credential({**CREDENTIALS[0], "id": 103})
+        other_process(storage.remove_credential, 102)
+        other_process(storage.add_credential, {**CREDENTIALS[1], "id": 103})
+
+        assert storage.sync()
+
+        storage.disable_cache()
+        # The credential added in this session gets a new ID, since the other
+        # process took 103 first.
+        assert storage.read_vault() == [
+            {**CREDENTIALS[0], "service": "changed"},
+            {**CREDENTIALS[1], "id": 103},
+            {**CREDENTIALS[0], "id": 104}
+        ]
+
+    def test_stale_write_is_retried(self, unlocked, mocker, other_process):
+        """
+        Assert that a vault file written while another process changed the
+        vault isn't put in place, and the write is merged and tried again.
+        """
+        storage.write_vault(CREDENTIALS)
+        storage.enable_cache()
+        storage.read_vault()
+        write_temporary = storage._write_temporary
+
+        def concurrent_change(*args):
+            mocker.patch.object(storage, "_write_temporary", write_temporary)
+            other_process(storage.remove_credential, 102)
+            return write_temporary(*args)
+
+        mocker.patch.object(storage, "_write_temporary", concurrent_change)
+        storage.write_vault([*CREDENTIALS, {**CREDENTIALS[0], "id": 103}])
+
+        assert storage.read_vault() == [CREDENTIALS[0], {**CREDENTIALS[0], "id": 103}]
+        assert not list(constants.DATA_DIR.glob("*.tmp"))
+
+class TestIdAllocator:
+    """Unit tests for the credential ID counter."""
+    def test_ids_are_never_reused(self, unlocked):
+        """
+        Assert that credentials get increasing IDs, even after the last one
+        is removed and the vault is compacted.
+        """
+        assert storage.add_credential(CREDENTIALS[0]) == 101
+        assert storage.add_credential({**CREDENTIALS[1], "id": 1000}) == 1000
+        # 101 is taken, so the counter hands out the next ID.
+        assert storage.add_credential(CREDENTIALS[0]) == 1001
+
+        storage.remove_credential(1000)
+        storage.remove_credential(1001)
+        storage.compact()
+
+        assert storage.add_credential({"service": "service3"}) == 1002
+        assert storage.get_credential(1002) == {"service": "service3", "id": 1002}
+
+    def test_add_doesnt_scan_the_vault(self, unlocked, mocker):
+        """Assert that allocating an ID reads neither the index nor any frame."""
+        storage.write_vault({**CREDENTIALS[0], "id": id} for id in range(100, 400))
+        metadata_spy = mocker.spy(storage.container, "iter_metadata")
+        frame_spy = mocker.spy(storage.container, "_read_frame")
+
+        assert storage.add_credential({"service": "service3"}) == 400
+        assert not metadata_spy.called
+        assert not frame_spy.called
+
+    def test_vault_without_counter(self, unlocked):
+        """
+        Assert that vaults written before the counter existed continue after
+        their largest ID, and keep their IDs.
+        """
+        storage.write_vault(CREDENTIALS)
+        header = read_header()
+        del header["next_id"]
+        data_key = storage._unwrap_data_key(header)
+        storage._replace(storage._write_temporary(CREDENTIALS, header, data_key))
+
+        assert storage.add_credential({"service": "service3"}) == 103
+        assert [cred["id"] for cred in storage.read_vault()] == [101, 102, 103]
+
+    def test_deferred_writes(self, unlocked):
+        """Assert that deferred adds take IDs from the counter too."""
+        storage.write_vault(CREDENTIALS)
+        storage.enable_cache(defer_writes=True)
+
+        try:
+            assert storage.add_credential({"service": "service3"}) == 103
+            assert storage.add_credential({"service": "service4"}) == 104
+            storage.sync()
+            assert read_header()["next_id"] == 105
+        finally:
+            storage.disable_cache()
+
+class TestSearch:
+    """Unit tests for 'storage.search_metadata'."""
+    @pytest.fixture
+    def credentials(self, unlocked):
+        """Write a vault with several index chunks and return its contents."""
+        credentials = [
+            {**CREDENTIALS[0], "service": f"service{id % 100}", "id": id}
+            for id in range(100, 1100)
+        ]
+        storage.write_vault(credentials)
+        return credentials
+
+    def test_only_matching_chunks_are_read(self, credentials, mocker):
+        """Assert that searching a service reads only the chunks holding it."""
+        read_chunk_spy = mocker.spy(storage.container, "_read_chunk")
+        read_frame_spy = mocker.spy(storage.container, "_read_frame")
+
+        matches = list(storage.search_metadata(service="service7", username="username1"))
+
+        assert [cred["id"] for cred in matches] == list(range(107, 1100, 100))
+        assert "password" not in matches[0]
+        assert read_chunk_spy.call_count == 4
+        assert not read_frame_spy.called
+
+    def test_journal_changes(self, credentials):
+        """Assert that changes in the journal are searched too."""
+        storage.remove_credential(107)
+        storage.update_credential({**credentials[8], "service": "service7"})
+
+        matches = list(storage.search_metadata(service="service7"))
+
+        assert [cred["id"] for cred in matches] == [108, *range(207, 1100, 100)]
+
+    def test_session_cache(self, credentials):
+        """Assert that the cached credentials are searched with an index."""
+        storage.enable_cache()
+        try:
+            matches = list(storage.search_metadata(service="service7", email=None))
+            assert [cred["id"] for cred in matches] == []
+            assert helpers.build_index in storage._cached_indexes
+
+            storage.update_credential({**credentials[0], "email": None})
+            matches = list(storage.search_metadata(service="service0", email=None))
+            assert [cred["id"] for cred in matches] == [100]
+        finally:
+            storage.disable_cache()
+
+class TestBulkAdd:
+    """Unit tests for 'storage.add_credentials'."""
+    def test_single_write(self, unlocked, mocker):
+        """
+        Assert that credentials are added with consecutive IDs and a single
+        vault write.
+        """
+        storage.write_vault(CREDENTIALS)
+        write_spy = mocker.spy(storage, "_write_temporary")
+
+        ids = storage.add_credentials({"service": f"service{n}"} for n in range(3, 6))
+
+        assert ids == range(103, 106)
+        assert write_spy.call_count == 1
+        assert storage.read_vault()[2:] == [
+            {"service": f"service{n}", "id": n + 100} for n in range(3, 6)
+        ]
+        assert read_header()["next_id"] == 106
+
+    def test_deferred_writes(self, unlocked):
+        """Assert that deferred bulk adds only reach the vault on 'sync'."""
+        storage.write_vault(CREDENTIALS)
+        storage.enable_cache(defer_writes=True)
+
+        try:
+            assert storage.add_credentials([{"service": "service3"}]) == range(103, 104)
+            assert len(storage.read_vault()) == 3
+            assert storage.sync()
+        finally:
+            storage.disable_cache()
+
+        assert len(storage.read_vault()) == 3
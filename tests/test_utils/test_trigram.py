@@ -0,0 +1,46 @@
+# Unit tests for `src.utils.trigram`.
+from src.utils import trigram
+
+CREDENTIALS = [
+    {"service": "gitlab.com", "username": "alice", "email": None, "id": 100},
+    {"service": "GitHub.com", "username": "alice", "email": "a@example.com", "id": 101},
+    {"service": "github", "username": "bob", "email": None, "id": 102},
+    {"service": "my github mirror", "username": "alice", "email": None, "id": 103},
+    {"service": "example.org", "username": None, "email": "a@example.com", "id": 104}
+]
+
+def search(**rules):
+    """Return the IDs found by 'trigram.search' on CREDENTIALS."""
+    index = trigram.build_index(CREDENTIALS)
+    return [cred["id"] for cred in trigram.search(CREDENTIALS, index, **rules)]
+
+def test_trigrams():
+    assert trigram.trigrams("git") == {"  g", " gi", "git", "it "}
+
+def test_substring_ranking():
+    """
+    Assert that substring search ignores case and ranks exact matches,
+    then prefixes, then other matches.
+    """
+    assert search(service="GitHub") == [102, 101, 103]
+    assert search(service="hub") == [102, 101, 103]
+
+def test_short_query():
+    """Assert that queries shorter than a trigram are matched too."""
+    assert search(service="gi", limit=2) == [102, 100]
+
+def test_multiple_fields():
+    """Assert that every field searched must match."""
+    assert search(service="git", username="ALICE") == [100, 101, 103]
+    assert search(service="git", email="example") == [101]
+    assert search(service="git", username=None) == []
+
+def test_fuzzy():
+    """Assert that fuzzy search finds values with typos."""
+    assert search(service="githib") == []
+    assert search(service="githib", fuzzy=True)[0] == 102
+
+def test_limit():
+    """Assert that only the best 'limit' credentials are returned."""
+    assert search(service="git", limit=1) == [102]
+    assert search(limit=2) == [100, 101]